@@ -10,31 +10,41 @@ __version__ = pkg_resources.require("bgrrl")[0].version
 import os
 from os.path import join, dirname, basename, exists
 import sys
+import copy
+import csv
 from enum import Enum, unique
 from collections import namedtuple, Counter
 import glob
+import pathlib
 
 from .snakemake_helper import *
 
 from bgrrl.enterobase_helpers import validateEnterobaseInput, loadEnterobaseCriteria 
-from bgrrl.bin.qc_eval import main as qc_eval_main
+from bgrrl.bin.qc_eval import main as qc_eval_main, writePregatePassSheet
 from bgrrl.bin.asm_report import main as asm_report_main
 from bgrrl.bin.ann_report import main as ann_report_main
-from bgrrl.bin.asm_stage_report import main as asm_stage_report_main
+from bgrrl.bin.asm_stage_report import main as asm_stage_report_main, summariseASMStages
 from bgrrl.bin.annocmp import main as annocmp_main
 from bgrrl.samplesheet import verifySamplesheet, Samplesheet, BaseSample, ASM_Sample, ANN_Sample
 from bgrrl.bgrrl_config import BGRRLConfigurationManager
+from bgrrl.statcache import StatCache
+from bgrrl.parse_cache import build_parse_cache, get_ratt_references, SAMPLETYPES as PARSE_CACHE_MODULES
+from bgrrl.sharding import split_samplesheet, run_sharded, merge_tables
+from bgrrl.incremental import write_increment, merge_records, merged_reports
+from bgrrl.plan import plan_snakemake
+from bgrrl.metrics_store import update_metrics_store, REPORT_TABLES
 
 from qaa import QAA_Runner, QAA_ID
-print("QAA_ID="+QAA_ID)
+print("QAA_ID="+QAA_ID, file=sys.stderr)
 
 
 class BGRRLModuleRunner(object):
 	def __init__(self, module, config_manager):
 		self.module = module
 		self.config_manager = config_manager
+		self.increment_sheet = config_manager.input_sheet
 
-	def run_module(self):
+	def run_module(self, plan=False):
 		
 		sampletype = BaseSample
 		verify_fields = ["R1", "R2"]
@@ -53,23 +63,51 @@ class BGRRLModuleRunner(object):
 			sampletype=sampletype
 		)
 
-		if samplesheet.verifySampleData(fields=verify_fields):
+		stat_cache = StatCache(join(self.config_manager.config_dir, "stat_cache.json"))
+		if samplesheet.verifySampleData(fields=verify_fields, stat_cache=stat_cache):
 			self.config_manager._config["samplesheet"] = self.config_manager.input_sheet
 
 		self.config_manager.module = self.module
 
-		config_file = self.config_manager.generate_config_file(self.module)
-		print("Run configuration file: " + config_file)
-
 		snakes = {
 			"bgsurvey": "bgsurvey.smk.py",
 			"bgasm": "bgasm.smk.py",
 			"bgann": "bgasm.smk.py",
+			"bgfull": "bgfull.smk.py",
 			"bgpackage": "bgpackage.smk.py"
 		}
+		snake = join(dirname(__file__), "zzz", snakes[self.module])
+
+		if getattr(self.config_manager, "shards", 1) > 1 and self.module in PARSE_CACHE_MODULES and not plan:
+			return self.run_module_sharded(snake)
+
+		parse_cache = join(self.config_manager.config_dir, self.module + ".parse_cache.sqlite")
+		if self.module in PARSE_CACHE_MODULES:
+			self.config_manager._config["parse_cache"] = parse_cache
+		else:
+			self.config_manager._config.pop("parse_cache", None)
+
+		config_file = self.config_manager.generate_config_file(self.module)
+		print("Run configuration file: " + config_file)
+
+		if self.module in PARSE_CACHE_MODULES:
+			print("Precomputing samplesheet and targets ... ", end="", flush=True)
+			build_parse_cache(self.config_manager.make_run_config(), parse_cache)
+			print("done.")
+
+		if plan:
+			print("Planning " + self.module)
+			return plan_snakemake(
+				snake,
+				self.config_manager.output_dir,
+				config_file,
+				self.config_manager.exe_env,
+				join(self.config_manager.output_dir, "plan"),
+				self.module,
+				unlock=self.config_manager.unlock
+			)
 
 		print("Running " + self.module)
-		snake = join(dirname(__file__), "zzz", snakes[self.module])
 		
 		return run_snakemake(
 			snake,
@@ -80,54 +118,166 @@ class BGRRLModuleRunner(object):
 			unlock=self.config_manager.unlock
 		)
 
+	def get_increment_record(self):
+		return join(self.config_manager.config_dir, self.module + ".samples.csv")
+
+	def select_increment(self):
+		'''
+		Incremental mode: restricts the run to those samples of the input samplesheet
+		that have not been processed by this module before (or whose samplesheet entries changed).
+		Returns the number of samples in the increment.
+		'''
+		self.increment_sheet = join(self.config_manager.config_dir, self.module + ".increment.csv")
+		n_samples = write_increment(self.config_manager.input_sheet, self.get_increment_record(), self.increment_sheet)
+		self.config_manager.input_sheet = self.increment_sheet
+		return n_samples
+
+	def record_increment(self):
+		return merge_records(self.increment_sheet, self.get_increment_record())
+
+	def run_qaa(self, stage, report_stages):
+		'''
+		Runs qaa on the current samplesheet. In incremental mode, the project reports of report_stages
+		(REPORT_TABLES), which qaa writes from the increment only, are merged with the existing reports.
+		'''
+		report_dir = join(self.config_manager.output_dir, "reports")
+		reports = [(join(report_dir, REPORT_TABLES[s][0]), REPORT_TABLES[s][1], "\t") for s in report_stages]
+		with merged_reports(reports, incremental=self.config_manager.incremental):
+			return QAA_Runner(self.config_manager.create_qaa_args(stage=stage)).run()
+
+	def get_shards(self):
+		return split_samplesheet(
+			self.config_manager.input_sheet,
+			self.config_manager.shards,
+			join(self.config_manager.output_dir, "shards", self.module)
+		)
+
+	def run_module_sharded(self, snake):
+		shards = self.get_shards()
+		output_dir = os.path.abspath(self.config_manager.output_dir)
+
+		# each snakemake instance gets its share of the allowed resources
+		exe_env = copy.copy(self.config_manager.exe_env)
+		exe_env.hpc_config = os.path.abspath(exe_env.hpc_config) if exe_env.hpc_config else exe_env.hpc_config
+		exe_env.max_cores = max(1, exe_env.max_cores // len(shards))
+		exe_env.max_nodes = max(1, exe_env.max_nodes // len(shards))
+		exe_env.max_mem = exe_env.max_mem // len(shards)
+
+		shard_args = list()
+		for shard_dir, shard_sheet in shards:
+			shard_dir = os.path.abspath(shard_dir)
+			parse_cache = join(shard_dir, self.module + ".parse_cache.sqlite")
+			overrides = {
+				"samplesheet": os.path.abspath(shard_sheet),
+				"out_dir": output_dir,
+				"parse_cache": parse_cache,
+				"hpc_config_file": os.path.abspath(self.config_manager.hpc_config_file)
+			}
+			config_file = self.config_manager.generate_config_file(
+				self.module,
+				config_file=join(shard_dir, self.module + ".conf.json"),
+				**overrides
+			)
+			build_parse_cache(self.config_manager.make_run_config(**overrides), parse_cache)
+			shard_args.append((snake, shard_dir, config_file, exe_env, False, self.config_manager.unlock, shard_dir))
+
+		if self.config_manager._config.get("run_ratt", False):
+			# shared ratt reference preparation must not be raced by the shards
+			ratt_reference = self.config_manager._config["ratt_reference"]
+			ref_targets = [join(ratt_reference, d, "gff", d + ".gff") for d in get_ratt_references(ratt_reference)]
+			print("Preparing ratt references ... ")
+			if not run_snakemake(*shard_args[0], targets=ref_targets):
+				return False
+
+		print("Running {} in {} shards".format(self.module, len(shards)))
+		return all(run_sharded(run_snakemake, shard_args))
+
 class BGSurveyRunner(BGRRLModuleRunner):
 	def __init__(self, module, config_manager):
 		super(BGSurveyRunner, self).__init__(module, config_manager)
 
-	def run(self):
-		readtype = "bbduk" if self.config_manager.no_normalization else "bbnorm"
-		min_tadpole_size = str(int(self.config_manager.minimum_survey_assembly_size))
-
-		if self.config_manager.report_only:
-			run_result = qc_eval_main(
-				[
-					"--readtype", readtype, 
-					"--min_tadpole_size", min_tadpole_size, 
+	def run_qc_eval(self, readtype, min_tadpole_size):
+		qc_eval_args = ["--readtype", readtype, "--min_tadpole_size", min_tadpole_size]
+		if self.config_manager.incremental:
+			# increments are small, their records are merged into the project reports in a single pass
+			qc_eval_args.append("--merge")
+		if getattr(self.config_manager, "shards", 1) < 2 or self.config_manager.incremental:
+			return qc_eval_main(
+				qc_eval_args + [
 					self.config_manager.input_sheet, 
 					self.config_manager.output_dir
 				]
 			)
-		else:
-			run_result = self.run_module()
-			if run_result:
-				qaa_args = self.config_manager.create_qaa_args(stage="qc_survey")
-				run_result = QAA_Runner(qaa_args).run()					
+
+		shards = self.get_shards()
+		run_result = all(
+			run_sharded(
+				qc_eval_main, 
+				[
+					(qc_eval_args + ["--report-dir", join(shard_dir, "reports"), shard_sheet, self.config_manager.output_dir],)
+					for shard_dir, shard_sheet in shards
+				]
+			)
+		)
+
+		report_dir = join(self.config_manager.output_dir, "reports")
+		merge_tables(
+			[join(shard_dir, "reports", "qc_eval.tsv") for shard_dir, _ in shards],
+			join(report_dir, "qc_eval.tsv"),
+			header_lines=2
+		)
+		merge_tables(
+			[join(shard_dir, "reports", "samplesheets", "samplesheet.qc_pass.tsv") for shard_dir, _ in shards],
+			join(report_dir, "samplesheets", "samplesheet.qc_pass.tsv")
+		)
+		update_metrics_store(report_dir, stages=["qc_eval"])
+		return run_result
+
+	def run_postprocessing(self, readtype, min_tadpole_size):
+		# samples that failed the early survey gate have no survey assemblies to be assessed
+		input_sheet = self.config_manager.input_sheet
+		survey_sheet = join(self.config_manager.output_dir, "reports", "samplesheets", "samplesheet.survey.tsv")
+		pathlib.Path(dirname(survey_sheet)).mkdir(parents=True, exist_ok=True)
+		n_survey, n_failed = writePregatePassSheet(input_sheet, join(self.config_manager.output_dir, "qc"), survey_sheet)
+		if n_failed:
+			print("{} sample(s) failed the early survey gate (read count) and are excluded from the survey assessment.".format(n_failed))
+			self.config_manager.input_sheet = survey_sheet
+		run_result = True
+		if n_survey:
+			run_result = self.run_qaa("qc_survey", ["quast_survey", "blobtools_survey"])
+		self.config_manager.input_sheet = input_sheet
+		if run_result:
+			run_result = self.run_qc_eval(readtype, min_tadpole_size)
+			
+			self.config_manager.input_sheet = join(
+				self.config_manager.output_dir, 
+				"reports", 
+				"samplesheets", 
+				"samplesheet.qc_pass.increment.tsv" if self.config_manager.incremental else "samplesheet.qc_pass.tsv"
+			)
+
+			if run_result and self.config_manager.full_qaa_analysis:
+				run_result = self.run_qaa("qc_report", ["quast_survey", "blobtools_survey"])
 				if run_result:
-					run_result = qc_eval_main(
-						[
-							"--readtype", readtype, 
-							"--min_tadpole_size", min_tadpole_size, 
-							self.config_manager.input_sheet, 
-							self.config_manager.output_dir
-						]
-					)
-					
-					self.config_manager.input_sheet = join(
-						self.config_manager.output_dir, 
-						"reports", 
-						"samplesheets", 
-						"samplesheet.qc_pass.tsv"
-					)
+					update_metrics_store(join(self.config_manager.output_dir, "reports"))
+
+			if run_result and not self.config_manager.no_packaging:
+				# print("SHEET:", self.config_manager.input_sheet, file=sys.stderr)
+				self.config_manager.package_mode = "processed_reads"
+				run_result = BGPackageRunner("bgpackage", self.config_manager).run_module()
 
-					if run_result and self.config_manager.full_qaa_analysis:
-						qaa_args = self.config_manager.create_qaa_args(stage="qc_report")
-						run_result = QAA_Runner(qaa_args).run()
+		return run_result
 
-					if run_result and not self.config_manager.no_packaging:
-						# print("SHEET:", self.config_manager.input_sheet, file=sys.stderr)
-						self.config_manager.package_mode = "processed_reads"
-						run_result = BGPackageRunner("bgpackage", self.config_manager).run_module()						
+	def run(self):
+		readtype = "bbduk" if self.config_manager.no_normalization else "bbnorm"
+		min_tadpole_size = str(int(self.config_manager.minimum_survey_assembly_size))
 
+		if self.config_manager.report_only:
+			run_result = self.run_qc_eval(readtype, min_tadpole_size)
+		else:
+			run_result = self.run_module()
+			if run_result:
+				run_result = self.run_postprocessing(readtype, min_tadpole_size)
 
 		return run_result
 
@@ -136,73 +286,109 @@ class BGAssemblyRunner(BGRRLModuleRunner):
 	def __init__(self, module, config_manager):
 		super(BGAssemblyRunner, self).__init__(module, config_manager)
 
-	def run(self):
-		eb_criteria = self.config_manager._config.get("enterobase_criteria", "")
-
-		if self.config_manager.report_only:
-			run_result = asm_stage_report_main(
+	def run_asm_stage_report(self):
+		report_dir = join(self.config_manager.output_dir, "reports")
+		if self.config_manager.incremental:
+			return asm_stage_report_main(
 				[
 					self.config_manager.output_dir,
-					join(self.config_manager.output_dir, "reports")
+					report_dir,
+					"--samplesheet", self.config_manager.input_sheet,
+					"--merge"
 				]
 			)
-			if self.config_manager.enterobase_groups: # needs validation?
-				run_result = asm_report_main(
-					[
-						self.config_manager.output_dir, 
-						self.config_manager.enterobase_groups, 
-						eb_criteria
-					]
+		if getattr(self.config_manager, "shards", 1) < 2:
+			return asm_stage_report_main(
+				[
+					self.config_manager.output_dir,
+					report_dir
+				]
+			)
+
+		shards = self.get_shards()
+		run_result = all(
+			run_sharded(
+				asm_stage_report_main,
+				[
+					([self.config_manager.output_dir, join(shard_dir, "reports"), "--samplesheet", shard_sheet],)
+					for shard_dir, shard_sheet in shards
+				]
+			)
+		)
+
+		merge_tables(
+			[join(shard_dir, "reports", "assembly_stages.tsv") for shard_dir, _ in shards],
+			join(report_dir, "assembly_stages.tsv")
+		)
+		merge_tables(
+			[join(shard_dir, "reports", "samplesheets", "samplesheet.asm_pass.tsv") for shard_dir, _ in shards],
+			join(report_dir, "samplesheets", "samplesheet.asm_pass.tsv")
+		)
+		summariseASMStages(join(report_dir, "assembly_stages.tsv"), join(report_dir, "assembly_stage_summary.tsv"))
+		update_metrics_store(report_dir, stages=["assembly_stages"])
+		return run_result
+
+	def run_asm_report(self, eb_criteria):
+		asm_report_args = [
+			self.config_manager.output_dir,
+			self.config_manager.enterobase_groups,
+			eb_criteria
+		]
+		if self.config_manager.incremental:
+			asm_report_args.extend(["--samplesheet", self.config_manager.input_sheet, "--merge"])
+		return asm_report_main(asm_report_args)
+
+	def run_postprocessing(self, eb_criteria):
+		run_result = self.run_asm_stage_report()
+		if run_result:
+
+			if self.config_manager.run_annotation:
+				print(
+						"WARNING: Prokka annotation selected\n" + \
+						"If your jobs fail, you might have to update tbl2asn and/or exclude nodes " + \
+						"(hmmscan/GNU parallel fails)."
+				)
+
+				BGAnnotationRunner.check_prokka_nodes(
+					join(self.config_manager.output_dir, "annotation", "prokka"),
+					join(self.config_manager.output_dir, "reports", "ann_run_report.txt")
 				)
+				qaa_stage = "asm,ann"
+				
+				if self.config_manager._config["run_ratt"]: 
+					BGAnnotationRunner.run_ratt_report(
+						self.config_manager.ratt_reference,
+						join(self.config_manager.output_dir, "annotation", "ratt"),
+						join(self.config_manager.output_dir, "annotation", "prokka"),
+						join(self.config_manager.output_dir, "reports")
+					)
+			else:
+				qaa_stage = "asm"
+		
+			run_result = self.run_qaa(qaa_stage, ["quast", "blobtools"])
+			if run_result:
+				# QUAST/Blobtools reports are written by qaa
+				update_metrics_store(join(self.config_manager.output_dir, "reports"))
+				if self.config_manager.enterobase_groups:
+					run_result = self.run_asm_report(eb_criteria)
+				if run_result and not self.config_manager.no_packaging:
+					package_mode = qaa_stage + (",analysis" if self.config_manager.is_final_step or self.config_manager.run_annotation else "")
+					self.config_manager.package_mode = package_mode # "asm"
+					run_result = BGPackageRunner("bgpackage", self.config_manager).run_module()
+
+		return run_result
+
+	def run(self):
+		eb_criteria = self.config_manager._config.get("enterobase_criteria", "")
+
+		if self.config_manager.report_only:
+			run_result = self.run_asm_stage_report()
+			if self.config_manager.enterobase_groups: # needs validation?
+				run_result = self.run_asm_report(eb_criteria)
 		else:
 			run_result = self.run_module()
 			if run_result:
-				run_result = asm_stage_report_main(
-					[
-						self.config_manager.output_dir,
-						join(self.config_manager.output_dir, "reports")
-					]
-				)
-				if run_result:
-
-					if self.config_manager.run_annotation:
-						print(
-								"WARNING: Prokka annotation selected\n" + \
-								"If your jobs fail, you might have to update tbl2asn and/or exclude nodes " + \
-								"(hmmscan/GNU parallel fails)."
-						)
-
-						BGAnnotationRunner.check_prokka_nodes(
-							join(self.config_manager.output_dir, "annotation", "prokka"),
-							join(self.config_manager.output_dir, "reports", "ann_run_report.txt")
-						)
-						qaa_stage = "asm,ann"
-						
-						if self.config_manager._config["run_ratt"]: 
-							BGAnnotationRunner.run_ratt_report(
-								self.config_manager.ratt_reference,
-								join(self.config_manager.output_dir, "annotation", "ratt"),
-								join(self.config_manager.output_dir, "annotation", "prokka"),
-                        	   	join(self.config_manager.output_dir, "reports")
-							)
-					else:
-						qaa_stage = "asm"
-				
-					qaa_args = self.config_manager.create_qaa_args(stage=qaa_stage)
-					run_result = QAA_Runner(qaa_args).run()
-					if run_result:
-						if self.config_manager.enterobase_groups:
-							run_result = asm_report_main(
-								[
-									self.config_manager.output_dir,
-									self.config_manager.enterobase_groups,
-									eb_criteria
-								]
-							)					
-						if run_result and not self.config_manager.no_packaging:
-							package_mode = qaa_stage + (",analysis" if self.config_manager.is_final_step or self.config_manager.run_annotation else "")
-							self.config_manager.package_mode = package_mode # "asm"
-							run_result = BGPackageRunner("bgpackage", self.config_manager).run_module()
+				run_result = self.run_postprocessing(eb_criteria)
 
 		return run_result
 
@@ -309,17 +495,73 @@ class BGPackageRunner(BGRRLModuleRunner):
 		else:
 			self.config_manager._config["enterobase_groups"] = list()
 
-		run_result = self.run_module()
+		if not self.config_manager.incremental:
+			return self.run_module()
+
+		# increments are packaged separately, the existing project packages are left untouched
+		project_prefix = self.config_manager._config["project_prefix"]
+		self.config_manager._config["project_prefix"] = project_prefix + "_increment_" + NOW
+		try:
+			run_result = self.run_module()
+		finally:
+			self.config_manager._config["project_prefix"] = project_prefix
 		return run_result
 
 
 
+class BGFullRunner(BGRRLModuleRunner):
+	def __init__(self, module, config_manager):
+		super(BGFullRunner, self).__init__(module, config_manager)
+
+	def run(self):
+		readtype = "bbduk" if self.config_manager.no_normalization else "bbnorm"
+		min_tadpole_size = str(int(self.config_manager.minimum_survey_assembly_size))
+		eb_criteria = self.config_manager._config.get("enterobase_criteria", "")
+		
+		run_result = True
+		if not self.config_manager.report_only:
+			# survey, assembly and annotation of each sample run in a single DAG, 
+			# gated per sample by the survey tests
+			run_result = self.run_module()
+
+		if run_result:
+			# the project-wide reports and packages are generated once all samples are done
+			run_result = BGSurveyRunner("bgsurvey", self.config_manager).run_postprocessing(readtype, min_tadpole_size)
+			if run_result:
+				run_result = BGAssemblyRunner("bgasm", self.config_manager).run_postprocessing(eb_criteria)
+
+		return run_result
+
+
 class BGRRLRunner(object):
 	def __init__(self, args):
 		self.config_manager = BGRRLConfigurationManager(args)
 
 	def __run_all(self):
-		raise ValueError("Wrong runmode: (ATTEMPT_FULL is not implemented yet)")
+		return self.__run_incremental(BGFullRunner("bgfull", self.config_manager))
+
+	def __run_incremental(self, runner):
+		if self.config_manager.plan:
+			# capacity planning only dry-runs the module's snakefile, no reports or packages are generated
+			run = lambda: runner.run_module(plan=True)
+		else:
+			run = runner.run
+
+		if self.config_manager.report_only or runner.module == "bgpackage":
+			return run()
+
+		if self.config_manager.incremental:
+			n_samples = runner.select_increment()
+			if not n_samples:
+				print("No new samples in {}. Nothing to do.".format(self.config_manager.input))
+				return True
+			print("Incremental mode: processing {} new sample(s) from {}.".format(n_samples, self.config_manager.input))
+
+		# successfully processed samples are recorded, so that later incremental runs can skip them
+		run_result = run()
+		if run_result and not self.config_manager.plan:
+			runner.record_increment()
+		return run_result
 
 	def run(self):
 
@@ -330,11 +572,14 @@ class BGRRLRunner(object):
 			"package": ("bgpackage", BGPackageRunner)
 		}
 		
-		runner = modules.get(self.config_manager.runmode, None)
-		if runner is None:
-			raise ValueError("Not a valid runmode: " + self.config_manager.runmode)
-		module, runner = runner
-		run_result = runner(module, self.config_manager).run()
+		if self.config_manager.runmode == "full":
+			run_result = self.__run_all()
+		else:
+			runner = modules.get(self.config_manager.runmode, None)
+			if runner is None:
+				raise ValueError("Not a valid runmode: " + self.config_manager.runmode)
+			module, runner = runner
+			run_result = self.__run_incremental(runner(module, self.config_manager))
 	
 		print()
 		if run_result:
@@ -17,6 +17,7 @@ BGSURVEY_DESC = "This is the quality control stage at which samples are tested f
 BGASM_DESC = "This stage performs (short-read) assembly of samples passing the survey stage."
 BGANN_DESC = "This stage performs de-novo (and on demand reference-based) gene/functional annotation."
 BGPACKAGE_DESC = "This stage (re-)generates data packages on demand. By default, data packages are automatically generated after each stage."
+BGFULL_DESC = "This runs survey, assembly and annotation in a single pipeline. Each sample proceeds to assembly as soon as it passes its own survey tests."
 
 
 def add_default_options(parser):
@@ -72,6 +73,31 @@ def add_default_options(parser):
 				By default, the enterobase mode is disabled."""
 	)
 
+	common_group.add_argument(
+		"--shards",
+		type=int,
+		default=1,
+		help="""Split the samplesheet into this many shards. Each shard is processed by its own, concurrently running 
+				snakemake instance (with its own working directory, lock and logs in <output-dir>/shards). 
+				Per-shard reports are merged into the project reports. [1]"""
+	)
+
+	common_group.add_argument(
+		"--plan",
+		action="store_true",
+		help="""Capacity planning: only dry-run this stage and report the number of jobs, predicted core-hours and 
+				peak concurrent memory per rule and the estimated critical path (in <output-dir>/plan). 
+				Runtimes are taken from the snakemake .stats files of previous runs, if available. [False]"""
+	)
+
+	common_group.add_argument(
+		"--incremental",
+		action="store_true",
+		help="""Only process samples that have not been processed by this stage before (or whose samplesheet entries changed). 
+				Their records are merged into the existing project reports and samplesheets 
+				and they are packaged separately into <project-prefix>_increment_<timestamp> packages. [False]"""
+	)
+
 	make_exeenv_arg_group(parser, default_hpc_config_file="", allow_mode_selection=False, silent=True)
 
 
@@ -88,6 +114,64 @@ def add_survey_parser(subparsers):
 		help="""Disable read normalization. [False]""" # !TODO
 	)
 
+	survey_parser.add_argument(
+		"--survey-coverage",
+		type=float,
+		default=0,
+		help="""Survey assemblies (tadpole) and k-mer analyses (kat) of samples with at least twice this coverage 
+				(estimated from read bases and --survey-genome-size) run on a reproducible random subsample 
+				of this coverage. 0 disables subsampling. [0]"""
+	)
+
+	survey_parser.add_argument(
+		"--survey-genome-size",
+		type=float,
+		default=5e6,
+		help="""Expected genome size (bp) for estimating the coverage of a sample (s. --survey-coverage). [5e6]"""
+	)
+
+	survey_parser.add_argument(
+		"--no-fastqc",
+		action="store_true",
+		help="""Do not generate FastQC reports. Survey gating uses the read statistics (read counts, read lengths, 
+				pair consistency) computed by read_stats, FastQC reports are only used for reporting. [False]"""
+	)
+
+	survey_parser.add_argument(
+		"--stream-preprocessing",
+		action="store_true",
+		help="""Run read preprocessing (bbduk) and normalization (bbnorm) as a single job per sample. The trimmed reads are 
+				written a second time, uncompressed, to a scratch directory (--stream-scratch-dir), from which bbnorm reads 
+				instead of re-reading the compressed bbduk output. The scratch directory needs space for about 4x the 
+				compressed input reads of a sample, otherwise bbnorm falls back to the compressed bbduk output. 
+				Has no effect with --no-normalization or --adaptive-normalization. As normalization runs 
+				in the same job, samples failing the early survey gate (read count) are still normalized. [False]"""
+	)
+
+	survey_parser.add_argument(
+		"--stream-scratch-dir",
+		type=str,
+		default="",
+		help="""Scratch directory for the uncompressed trimmed reads of --stream-preprocessing (preferably node-local). 
+				Each job creates and removes its own subdirectory. [$TMPDIR, or /tmp if unset]"""
+	)
+
+	survey_parser.add_argument(
+		"--adaptive-normalization",
+		action="store_true",
+		help="""Decide the normalization of each sample from the coverage of its trimmed reads (estimated from read bases 
+				and --survey-genome-size): samples up to the bbnorm target coverage are not normalized, samples with at least 
+				ten times the target coverage are subsampled to the target coverage, all others are normalized with bbnorm. 
+				Has no effect with --no-normalization. [False]"""
+	)
+
+	survey_parser.add_argument(
+		"--run-kat",
+		action="store_true",
+		help="""Run kat for the k-mer analysis (peaks, genome size, GC content). By default, the k-mer analysis is taken 
+				from bbnorm's k-mer histograms, kat is only run with --no-normalization or --adaptive-normalization. [False]"""
+	)
+
 	survey_parser.add_argument(
 		"--no-packaging",
 		action="store_true",
@@ -132,6 +216,16 @@ def add_asm_parser(subparsers):
 		help="""Minimum length [bp] of contigs retained in filtering step [0]."""
 	)
 
+	asm_parser.add_argument(
+		"--assembly-race",
+		type=int,
+		default=1,
+		help="""Run up to this many assembly stages (the main assembly and its fallbacks) of a sample concurrently 
+				instead of one after the other. The stages share the threads and memory of the assembly job (asm_assembly 
+				in the --hpc_config file), each stage needs at least 4 threads and 16GB. The first successful stage in 
+				priority order is kept, the other stages are cancelled. [1]"""
+	)
+
 	asm_parser.add_argument(
         "--no-normalization",
         action="store_true",
@@ -221,6 +315,152 @@ def add_ann_parser(subparsers):
 	ann_parser.set_defaults(runmode="annotate")
 
 
+def add_full_parser(subparsers):
+	full_parser = subparsers.add_parser(
+		"full",
+		help=BGFULL_DESC,
+		description=BGFULL_DESC
+	)
+
+	full_parser.add_argument(
+		"--no-normalization", 
+		action="store_true", 
+		help="""Disable read normalization. [False]"""
+	)
+
+	full_parser.add_argument(
+		"--survey-coverage",
+		type=float,
+		default=0,
+		help="""Survey assemblies (tadpole) and k-mer analyses (kat) of samples with at least twice this coverage 
+				(estimated from read bases and --survey-genome-size) run on a reproducible random subsample 
+				of this coverage. 0 disables subsampling. [0]"""
+	)
+
+	full_parser.add_argument(
+		"--survey-genome-size",
+		type=float,
+		default=5e6,
+		help="""Expected genome size (bp) for estimating the coverage of a sample (s. --survey-coverage). [5e6]"""
+	)
+
+	full_parser.add_argument(
+		"--no-fastqc",
+		action="store_true",
+		help="""Do not generate FastQC reports. Survey gating uses the read statistics (read counts, read lengths, 
+				pair consistency) computed by read_stats, FastQC reports are only used for reporting. [False]"""
+	)
+
+	full_parser.add_argument(
+		"--stream-preprocessing",
+		action="store_true",
+		help="""Run read preprocessing (bbduk) and normalization (bbnorm) as a single job per sample. The trimmed reads are 
+				written a second time, uncompressed, to a scratch directory (--stream-scratch-dir), from which bbnorm reads 
+				instead of re-reading the compressed bbduk output. The scratch directory needs space for about 4x the 
+				compressed input reads of a sample, otherwise bbnorm falls back to the compressed bbduk output. 
+				Has no effect with --no-normalization or --adaptive-normalization. As normalization runs 
+				in the same job, samples failing the early survey gate (read count) are still normalized. [False]"""
+	)
+
+	full_parser.add_argument(
+		"--stream-scratch-dir",
+		type=str,
+		default="",
+		help="""Scratch directory for the uncompressed trimmed reads of --stream-preprocessing (preferably node-local). 
+				Each job creates and removes its own subdirectory. [$TMPDIR, or /tmp if unset]"""
+	)
+
+	full_parser.add_argument(
+		"--adaptive-normalization",
+		action="store_true",
+		help="""Decide the normalization of each sample from the coverage of its trimmed reads (estimated from read bases 
+				and --survey-genome-size): samples up to the bbnorm target coverage are not normalized, samples with at least 
+				ten times the target coverage are subsampled to the target coverage, all others are normalized with bbnorm. 
+				Has no effect with --no-normalization. [False]"""
+	)
+
+	full_parser.add_argument(
+		"--run-kat",
+		action="store_true",
+		help="""Run kat for the k-mer analysis (peaks, genome size, GC content). By default, the k-mer analysis is taken 
+				from bbnorm's k-mer histograms, kat is only run with --no-normalization or --adaptive-normalization. [False]"""
+	)
+
+	full_parser.add_argument(
+		"--minimum-survey-assembly-size",
+		type=int,
+		default=1000000,
+		help="""Minimum size (in bp) for tadpole assembly to pass survey stage [1Mbp] This allows plasmids to be processed."""
+	)
+
+	full_parser.add_argument(
+		"--full-qaa-analysis",
+		action="store_true",
+		help="""Perform full qaa-analysis on survey assemblies. [False]"""
+	)	
+
+	full_parser.add_argument(
+		"--assembler", 
+		type=str, 
+		choices=["unicycler", "velvet"],
+		default="unicycler", 
+		help="""Assembly software to use for genome assembly. [unicycler]""")
+
+	full_parser.add_argument(
+		"--contig-minlen", 
+		type=int, 
+		default=0, 
+		help="""Minimum length [bp] of contigs retained in filtering step [0]."""
+	)
+
+	full_parser.add_argument(
+		"--assembly-race",
+		type=int,
+		default=1,
+		help="""Run up to this many assembly stages (the main assembly and its fallbacks) of a sample concurrently 
+				instead of one after the other. The stages share the threads and memory of the assembly job (asm_assembly 
+				in the --hpc_config file), each stage needs at least 4 threads and 16GB. The first successful stage in 
+				priority order is kept, the other stages are cancelled. [1]"""
+	)
+
+	full_parser.add_argument(
+		"--no-annotation",
+		action="store_false",
+		dest="run_annotation",
+		help="""Do not run annotation on the assemblies. [False]"""
+	)
+
+	full_parser.add_argument(
+		"--custom-prokka-proteins",
+		type=str,
+		default="",
+		help="""If you have a custom protein database that you would like prokka to use (--proteins option), then specify the path to it here. [n/a]"""
+	)
+
+	full_parser.add_argument(
+		"--ratt-reference",
+		type=str,
+		help="Path to reference data for ratt annotation transfer"
+	)
+
+	full_parser.add_argument(
+		"--no-packaging",
+		action="store_true",
+		help="""Disable automatic packaging. [False]"""
+	)
+
+	full_parser.add_argument(
+		"--prokka-package-style",
+		type=str,
+		choices=["by_sample", "all_in_one"],
+		default="by_sample",
+		help="""Should the prokka annotation be packaged into one directory per sample (by_sample) or into one single directory (all_in_one)? [by_sample]"""
+	)
+
+	add_default_options(full_parser)
+	full_parser.set_defaults(runmode="full", is_final_step=True)
+
+
 def add_package_parser(subparsers):
 	package_parser = subparsers.add_parser(
 		"package", 
@@ -272,6 +512,7 @@ def main():
 
 	stage_parsers = bgrrl_parser.add_subparsers(
 		help="""bgrr| comprises three main stages: *survey*, *assemble*, and *annotate* and an auxiliary stage *package*.
+				All three main stages can be run as a single pipeline with *full*.
 				Reporting and quality assessment of the results of each main stage is performed using qaa."""
 	)
 
@@ -279,6 +520,7 @@ def main():
 	add_asm_parser(stage_parsers)
 	add_ann_parser(stage_parsers)
 	add_package_parser(stage_parsers)
+	add_full_parser(stage_parsers)
 	
 
 	args = bgrrl_parser.parse_args()
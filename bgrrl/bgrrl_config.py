@@ -3,9 +3,16 @@ import os
 from os.path import exists, dirname, basename, join
 import sys
 import yaml
+import json
+import hashlib
 import pathlib
 import glob
 
+try:
+	from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+	from yaml import SafeLoader as YAMLLoader
+
 from .snakemake_helper import *
 
 ExecutionEnvironmentArguments = namedtuple(
@@ -16,10 +23,107 @@ ExecutionEnvironmentArguments = namedtuple(
 		"no_drmaa",
 		"max_nodes",
 		"max_cores",
-		"hpc_config"
+		"hpc_config",
+		"max_mem",
+		"group_size",
+		"array_size"
 	]
 )
 
+CONFIG_SNAPSHOT_VERSION = 1
+
+# section -> {key: (type, required)}, unknown keys are allowed
+CONFIG_SCHEMA = {
+	"singularity": {
+		"use_singularity": (bool, False),
+		"bgrrl_container": (str, False),
+		"qaa_container": (str, False)
+	},
+	"tools": {
+		"time": (str, False)
+	},
+	"resources": {
+		"bb_adapters": (str, True),
+		"blob_blastdb": (str, False),
+		"busco_databases": (str, False)
+	},
+	"params": {
+		"bbduk": (str, True),
+		"bbnorm": (str, True)
+	},
+	"misc": {
+		"seqcentre": (str, True)
+	},
+	"compression": {
+		"__default__": (dict, False)
+	}
+}
+
+
+def validate_config(config, schema=CONFIG_SCHEMA):
+	errors = list()
+	if not isinstance(config, dict):
+		errors.append("configuration is not a mapping")
+	else:
+		for section, keys in schema.items():
+			section_d = config.get(section, None)
+			if section_d is None:
+				if any(required for _, required in keys.values()):
+					errors.append("missing section '{}'".format(section))
+				continue
+			if not isinstance(section_d, dict):
+				errors.append("section '{}' is not a mapping".format(section))
+				continue
+			for key, (_type, required) in keys.items():
+				if key not in section_d or section_d[key] is None:
+					if required:
+						errors.append("missing '{}:{}'".format(section, key))
+				elif not isinstance(section_d[key], _type):
+					errors.append("'{}:{}' should be of type {}".format(section, key, _type.__name__))
+	if errors:
+		raise ValueError("CONFIG ERROR: Invalid configuration:\n" + "\n".join(errors))
+	return config
+
+
+def load_config_snapshot(config_file, snapshot_file):
+	'''
+	Returns the validated configuration of a yaml configuration file.
+	The configuration is stored as json snapshot together with the content hash and stat of the file.
+	A changed stat invalidates the snapshot: the file is re-hashed and only re-parsed if its content changed.
+	'''
+	source = os.path.abspath(config_file)
+	st = os.stat(source)
+	stat = [st.st_mtime, st.st_size]
+
+	snapshot = dict()
+	if exists(snapshot_file):
+		try:
+			with open(snapshot_file) as snap_in:
+				snapshot = json.load(snap_in, object_pairs_hook=OrderedDict)
+		except (ValueError, OSError):
+			snapshot = dict()
+	valid = snapshot.get("version", None) == CONFIG_SNAPSHOT_VERSION and snapshot.get("source", None) == source
+
+	if valid and snapshot.get("stat", None) == stat:
+		return snapshot["config"]
+
+	with open(source, "rb") as cfg_in:
+		raw = cfg_in.read()
+	config_hash = hashlib.sha256(raw).hexdigest()
+
+	if not valid or snapshot.get("hash", None) != config_hash:
+		config = validate_config(yaml.load(raw, Loader=YAMLLoader))
+		snapshot = OrderedDict(version=CONFIG_SNAPSHOT_VERSION, source=source, hash=config_hash, config=config)
+
+	# unchanged content (e.g. touched file) only updates the recorded stat
+	snapshot["stat"] = stat
+	tmp_file = snapshot_file + ".tmp"
+	with open(tmp_file, "wt") as snap_out:
+		json.dump(snapshot, snap_out)
+	os.replace(tmp_file, snapshot_file)
+
+	return snapshot["config"]
+
 
 class ConfigurationManager(OrderedDict):
 	
@@ -106,7 +210,10 @@ class ConfigurationManager(OrderedDict):
 			self.no_drmaa,
 			self.max_nodes,
 			self.max_cores,
-			self.hpc_config
+			self.hpc_config,
+			getattr(self, "max_mem", 0),
+			getattr(self, "group_size", 0),
+			getattr(self, "array_size", 0)
 		)
 
 	def __make_exe_env(self):
@@ -115,29 +222,41 @@ class ConfigurationManager(OrderedDict):
 			self.__make_exe_env_args(),
 			NOW,
 			job_suffix=self.input + "_" + self.output_dir,
-			log_dir=self.logs_dir
+			log_dir=os.path.abspath(self.logs_dir)
 		)
 		print("done.")
 		print(str(self.exe_env))
 
 
-	def generate_config_file(self, module):
-		config_file = join(self.config_dir, module + ".conf.yaml")
+	def make_run_config(self, verbose=False, **overrides):
+		config_d = OrderedDict(self._config)
+		for k, v in sorted(vars(self).items()):
+			if not k in self._config and k != "_config":
+				if verbose:
+					print("WRITING {}: {} -> CONFIG".format(k, v))
+				config_d[k] = v
+		config_d.update(overrides)
+		return config_d
+
+	def generate_config_file(self, module, config_file=None, **overrides):
+		if config_file is None:
+			config_file = join(self.config_dir, module + ".conf.json")
 
 		#if not exists(dirname(config_file)):
 		#	print("Could not find config-dir, creating ... ", end="", flush=True)
 		#	pathlib.Path(dirname(config_file)).mkdir(exist_ok=True, parents=True)
 		#	print("done.")	
 
-		with open(config_file, "wt") as cfg_out:
-			config_d = OrderedDict(self._config)
-			for k, v in sorted(vars(self).items()):
-				if not k in self._config and k != "_config":
-					print("WRITING {}: {} -> CONFIG".format(k, v))
-					config_d[k] = v
-			print("Writing configuration to file {} ... ".format(config_file), end="", flush=True)
-			yaml.dump(config_d, cfg_out, default_flow_style=False)
-			print("done.")
+		# snakemake loads json config files without falling back to yaml parsing
+		config_d = self.make_run_config(verbose=True, **overrides)
+		content = json.dumps(config_d, indent=1, default=str)
+		if exists(config_file) and open(config_file).read() == content:
+			print("Configuration file {} is up to date.".format(config_file))
+		else:
+			with open(config_file, "wt") as cfg_out:
+				print("Writing configuration to file {} ... ".format(config_file), end="", flush=True)
+				cfg_out.write(content)
+				print("done.")
 
 		return config_file
 	
@@ -177,7 +296,10 @@ class ConfigurationManager(OrderedDict):
 
 		# Load/edit configuration
 		print("Loading configuration from {} ... ".format(self.config_file), end="", flush=True)
-		self._config = yaml.load(open(self.config_file))
+		self._config = load_config_snapshot(
+			self.config_file, 
+			join(self.config_dir, "bgrrl_config.snapshot.json")
+		)
 		print("done.")
 		print()
 
@@ -220,6 +342,9 @@ class BGRRLConfigurationManager(ConfigurationManager):
 		if hasattr(self, "prokka_package_style"):
 			self._config["prokka_package_style"] = self.prokka_package_style
 
+		if getattr(self, "custom_prokka_proteins", ""):
+			self.custom_prokka_proteins = os.path.abspath(self.custom_prokka_proteins)
+
 		if hasattr(self, "contig_minlen"):
 			self._config["asm_lengthfilter_contig_minlen"] = max(0, self.contig_minlen)
 
@@ -227,7 +352,7 @@ class BGRRLConfigurationManager(ConfigurationManager):
 		if self._config["run_ratt"]:
 			if not exists(self.ratt_reference):
 				raise ValueError("Invalid ratt reference location: " + self.ratt_reference)
-			self._config["ratt_reference"] = self.ratt_reference
+			self._config["ratt_reference"] = os.path.abspath(self.ratt_reference)
 			if hasattr(self, "make_ratt_data_tarballs"):
 				self._config["make_ratt_data_tarballs"] = self.make_ratt_data_tarballs		
 
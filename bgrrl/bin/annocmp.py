@@ -9,10 +9,13 @@ from collections import namedtuple, OrderedDict, Counter
 from argparse import ArgumentParser
 
 from bgrrl.bin.ann_report import ANN_REPORT_HEADER
+from bgrrl.metrics_store import MetricsStore, get_metrics_store, update_metrics_store
 
 GFFeature = namedtuple("GFFeature", "seqname source feature start end score strand frame attribute".split(" "))
 
 PROKKA_FEATURES = ["CDS", "rRNA", "tRNA", "tmRNA"]
+# the assembly size (all contigs) the taxon spans are related to
+ASM_SIZE_METRIC = "Total length (>= 0 bp)"
 BEDTOOLS_CMD = "source bedtools-2.26.0_github20170207; bedtools subtract -sorted -a <(sort -k1,1 -k4,4g {}) -b <(sort -k1,1 -k4,4g {})"
 
 HEADER = ["Sample", "Best ratt reference"] 
@@ -143,32 +146,18 @@ def main(args=sys.argv[1:]):
 
     samples = next(os.walk(args.prokka_dir))[1]
 
-    try:
-        with open(join(args.report_dir, "blobtools_report.tsv")) as _in:
-            tax_report = dict((row[0], row) for i, row in enumerate(csv.reader(_in, delimiter="\t")))
-            
-    except:
-            tax_report = dict()
+    with MetricsStore(get_metrics_store(args.report_dir)) as metrics_store:
+        # the metrics are copied into the annotation report as they are
+        tax_report = metrics_store.get_stage("blobtools", text=True) if metrics_store.sync("blobtools", args.report_dir) else dict()
+        asm_report = metrics_store.get_stage("quast", text=True) if metrics_store.sync("quast", args.report_dir) else dict()
+        tax_metrics = metrics_store.get_metrics("blobtools")[1] if tax_report else list()
 
-    try:
-        with open(join(args.report_dir, "quast_report.tsv")) as _in:
-            asm_report = dict((row[0], row) for i, row in enumerate(csv.reader(_in, delimiter="\t")))
-    except:
-        asm_report = dict()
-
-    tax_header = tax_report.get("Sample", list())
-    # "Sample", "#contigs", "Predominant genus", "#contigs(Predominant genus)", "%(Predominant genus)", "span(Predominant genus)[bp]", "Subdominant genus", "#contigs(Subdominant genus)", "%(Subdominant genus)", "span(Subdominant genus)[bp]"
-    asm_header = asm_report.get("Assembly", list())
-    # Assembly        # contigs (>= 0 bp)     # contigs (>= 1000 bp)  # contigs (>= 5000 bp)  # contigs (>= 10000 bp) # contigs (>= 25000 bp) # contigs (>= 50000 bp) Total length (>= 0 bp)  Total length (>= 1000 bp)       Total length (>= 5000 bp)       Total length (>= 10000 bp)      Total length (>= 25000 bp)      Total length (>= 50000 bp)      # contigs       Largest contig  Total length    GC (%)  N50     N75     L50     L75     # N's per 100 kbp
-    HEADER.extend(tax_header[1:2]) # #contigs
-    HEADER.extend(asm_header[15:16]) # Total length
-    HEADER.extend(tax_header[2:6] + (["%span(Predominant genus)[bp]"] if tax_header else list()))
-    HEADER.extend(tax_header[6:] + (["%span(Subdominant genus)[bp]"] if tax_header else list()))
-    
-    # HEADER.extend(tax_report.get("Sample", list())[1:])
-
-    print("TAX_REPORT:", tax_report, sep="\n")   
-    print("ASM_REPORT:", asm_report, sep="\n") 
+    # "#contigs", "Predominant genus", "#contigs(Predominant genus)", "%(Predominant genus)", "span(Predominant genus)[bp]", "Subdominant genus", "#contigs(Subdominant genus)", "%(Subdominant genus)", "span(Subdominant genus)[bp]"
+    tax_contigs, tax_dominant, tax_subdominant = tax_metrics[:1], tax_metrics[1:5], tax_metrics[5:]
+    HEADER.extend(tax_contigs)
+    HEADER.extend([ASM_SIZE_METRIC] if asm_report else list())
+    HEADER.extend(tax_dominant + (["%span(Predominant genus)[bp]"] if tax_metrics else list()))
+    HEADER.extend(tax_subdominant + (["%span(Subdominant genus)[bp]"] if tax_metrics else list()))
 
     with open(join(args.report_dir, "annotation_report.tsv"), "w") as delta_out:
         print(*HEADER, sep="\t", file=delta_out)
@@ -194,23 +183,22 @@ def main(args=sys.argv[1:]):
                         prokka_ratt_delta[("hypothetical protein", "partial")], 
                         prokka_ratt_delta["partial"] - prokka_ratt_delta[("hypothetical protein", "partial")],
                         ratt_prokka_delta["unpredicted"]])
-            # row.extend(tax_report.get(sample, list())[1:])            
-            row.extend(tax_report.get(sample, list())[1:2])            
-            row.extend(asm_report.get(sample, list())[7:8])
-            row.extend(tax_report.get(sample, list())[2:6])
-            try:
-                row.append(float(tax_report.get(sample, list())[5]) / float(asm_report.get(sample, list())[7]))
-            except:
-                pass
-            row.extend(tax_report.get(sample, list())[6:])            
-            try:
-                row.append(float(tax_report.get(sample, list())[-1]) / float(asm_report.get(sample, list())[7]))
-            except:
-                pass
 
+            # taxonomy and assembly metrics are joined by sample and metric name
+            tax, asm = tax_report.get(sample, dict()), asm_report.get(sample, dict())
+            asm_size = asm.get(ASM_SIZE_METRIC, "")
+            row.extend(tax.get(metric, "") for metric in tax_contigs)
+            row.extend([asm_size] if asm_report else list())
+            for metrics in (tax_dominant, tax_subdominant):
+                row.extend(tax.get(metric, "") for metric in metrics)
+                try:
+                    row.append(float(tax[metrics[-1]]) / float(asm_size))
+                except:
+                    pass
 
             print(*row, sep="\t", file=delta_out)
 
+    update_metrics_store(args.report_dir, stages=["annotation"])
     return True
 
 if __name__ == "__main__":
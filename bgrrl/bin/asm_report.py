@@ -12,9 +12,14 @@ from collections import Counter, namedtuple, OrderedDict
 
 from bgrrl.samplesheet import readSamplesheet, Sample
 from bgrrl.enterobase_helpers import validateEnterobaseInput, ECriteria, loadEnterobaseCriteria
+from bgrrl.incremental import merge_records
+from bgrrl.metrics_store import MetricsStore, get_metrics_store, update_metrics_store
 
 ENTERO_CRITERIA = dict()
 
+# QUAST metrics checked against the Enterobase criteria: genome size, contig amount, N50, N content
+ENTERO_QUAST_METRICS = ("Total length (>= 1000 bp)", "# contigs (>= 1000 bp)", "N50", "# N's per 100 kbp")
+
 BlobSample = namedtuple("BlobSample", "sample ncontigs dom_org dom_org_ncontigs dom_org_perc dom_org_span subdom_org subdom_org_ncontigs subdom_org_perc subdom_org_span".split(" "))
 
 def ENTERO_FILTER(_in, organism="Salmonella", out=sys.stdout, full_out=None):
@@ -25,6 +30,7 @@ def ENTERO_FILTER(_in, organism="Salmonella", out=sys.stdout, full_out=None):
     for row in _in:
         if not header:
             header = list(row)
+            size_col, contigs_col, n50_col, ncontent_col = (header.index(metric) for metric in ENTERO_QUAST_METRICS) if crit is not None else (None,) * 4
             if crit is not None:
                 header.extend(["Enterobase category", "Meets Enterobase criteria?", "Genome Size check", "Contig amount", "N50 check", "N content"])
         elif crit is None:
@@ -39,10 +45,10 @@ def ENTERO_FILTER(_in, organism="Salmonella", out=sys.stdout, full_out=None):
                 print(*row, sep="\t", file=full_out)
             yield row[0]
         else:
-            genome_size_ok = crit.minsize <= int(row[8]) <= crit.maxsize
-            contig_amt_ok = int(row[2]) < crit.ncontigs
-            n50_ok = int(row[17]) > crit.n50
-            ncontent_ok = float(row[21]) < crit.ncount
+            genome_size_ok = crit.minsize <= int(row[size_col]) <= crit.maxsize
+            contig_amt_ok = int(row[contigs_col]) < crit.ncontigs
+            n50_ok = int(row[n50_col]) > crit.n50
+            ncontent_ok = float(row[ncontent_col]) < crit.ncount
             meets_criteria = all((genome_size_ok, contig_amt_ok, n50_ok, ncontent_ok))
             if not header_written:
                 header_written = True
@@ -87,6 +93,8 @@ def main(args_in=sys.argv[1:]):
     ap.add_argument("entero_criteria", type=str, default="")
     ap.add_argument("--report-dir", type=str, default="")
     ap.add_argument("--mode", "-m", type=str, default="asm") # asm/survey
+    ap.add_argument("--samplesheet", type=str, default="", help="Only report samples from this samplesheet.")
+    ap.add_argument("--merge", action="store_true", help="Merge the reported samples into the existing project reports.")
     
     args = ap.parse_args(args_in)
 
@@ -100,42 +108,53 @@ def main(args_in=sys.argv[1:]):
         report_dir = join(args.report_dir)
     pathlib.Path(report_dir).mkdir(parents=True, exist_ok=True)
 
-    print("Reading global QUAST report...", end="", flush=True)
-    try:
-        with open(join(report_dir, "quast_report.tsv")) as quast_in:
-            quast_report = list(row for row in csv.reader(quast_in, delimiter="\t"))
-    except:
-        print()
-        print("Error: No QUAST report found at {}. Exiting.".format(report_dir))
-        sys.exit(1)
-        pass
-    print(" Done")       
-
-    print("Reading global Blobtools report...", end="", flush=True)
-    try:
-        with open(join(report_dir, "blobtools_report.tsv")) as blob_in:
-            blob_report = list(BlobSample(*row) for row in csv.reader(blob_in, delimiter="\t"))
-    except:
-        print()
-        print("Error: No Blobtools report found at {}. Exiting.".format(report_dir))
-        sys.exit(1)
-    print(" Done")
+    samples = None
+    if args.samplesheet:
+        with open(args.samplesheet) as _in:
+            samples = set(row[0] for row in csv.reader(_in, delimiter=",") if row)
+
+    # in merge mode, the reports are written to report_dir/increment and then merged into the project reports
+    out_dir = join(report_dir, "increment") if args.merge else report_dir
+    pathlib.Path(out_dir).mkdir(parents=True, exist_ok=True)
+    project_reports = list()
+
+    # the QUAST and Blobtools reports are read from the metrics store, which (re-)imports them if they changed
+    with MetricsStore(get_metrics_store(report_dir)) as metrics_store:
+        print("Reading global QUAST report...", end="", flush=True)
+        if not metrics_store.sync("quast", report_dir):
+            print()
+            print("Error: No QUAST report found at {}. Exiting.".format(report_dir))
+            sys.exit(1)
+        quast_report = metrics_store.get_table("quast", samples=samples)
+        print(" Done")
+
+        print("Reading global Blobtools report...", end="", flush=True)
+        if not metrics_store.sync("blobtools", report_dir):
+            print()
+            print("Error: No Blobtools report found at {}. Exiting.".format(report_dir))
+            sys.exit(1)
+        blob_report = list(BlobSample(*row) for row in metrics_store.get_table("blobtools", samples=samples)[1:])
+        print(" Done")
+
     valid_sample_groups = validateEnterobaseInput(args.enterobase_groups, ENTERO_CRITERIA)
 
     if not valid_sample_groups:
         print("No Enterobase groups specified. Proceeding without checking Enterobase criteria.")
-        with open(join(report_dir, "all_samples.txt"), "w") as samples_out:
+        project_reports.append(("all_samples.txt", 0))
+        with open(join(out_dir, "all_samples.txt"), "w") as samples_out:
             print(quast_report)
             print(*sorted(line[0] for line in quast_report[1:]), sep="\n", file=samples_out)
     else:
         print("Checking Enterobase groups...") 
         
-        with open(join(report_dir, "all_quast_taxonomy_report.tsv"), "w") as full_out, open(join(report_dir, "eb_taxonomy_report.tsv"), "w") as full_tax_out:
+        project_reports.extend([("all_quast_taxonomy_report.tsv", 1), ("eb_taxonomy_report.tsv", 1)])
+        with open(join(out_dir, "all_quast_taxonomy_report.tsv"), "w") as full_out, open(join(out_dir, "eb_taxonomy_report.tsv"), "w") as full_tax_out:
             for sgroup in valid_sample_groups:
                 print(sgroup)
-                eb_asm_out_fn = join(report_dir, "eb_{}_quast_report.tsv".format(sgroup))
-                eb_samples_out_fn = join(report_dir, "eb_{}_samples.txt".format(sgroup))
-                eb_tax_out_fn = join(report_dir, "eb_{}_taxonomy_report.tsv".format(sgroup))
+                eb_asm_out_fn = join(out_dir, "eb_{}_quast_report.tsv".format(sgroup))
+                eb_samples_out_fn = join(out_dir, "eb_{}_samples.txt".format(sgroup))
+                eb_tax_out_fn = join(out_dir, "eb_{}_taxonomy_report.tsv".format(sgroup))
+                project_reports.extend([(basename(eb_asm_out_fn), 1), (basename(eb_samples_out_fn), 0), (basename(eb_tax_out_fn), 1)])
                 with open(eb_asm_out_fn, "w") as eb_asm_out, open(eb_samples_out_fn, "w") as eb_samples_out, open(eb_tax_out_fn, "w") as eb_tax_out:
                     eb_pass_taxonomy = set(TAX_FILTER(blob_report, organism=sgroup, out=eb_tax_out, full_out=full_tax_out))
                     quast_stream = list(filter(lambda x:x[0] in eb_pass_taxonomy or x[0].startswith("Assembly"), quast_report))
@@ -146,6 +165,15 @@ def main(args_in=sys.argv[1:]):
 
                     blob_report = list(filter(lambda x:x.sample not in eb_pass_taxonomy, blob_report))
 
+    if args.merge:
+        # re-reported samples that no longer pass are dropped from the project reports
+        drop = samples if samples is not None else set(row[0] for row in quast_report[1:])
+        for report, header_lines in project_reports:
+            merge_records(join(out_dir, report), join(report_dir, report), header_lines=header_lines, delimiter="\t", drop=drop)
+
+    if valid_sample_groups:
+        update_metrics_store(report_dir, stages=["enterobase_assembly", "enterobase_taxonomy"])
+
     print(" Done.\n Generated asm reports in {}.".format(report_dir))
     return True
 
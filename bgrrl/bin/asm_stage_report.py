@@ -2,9 +2,14 @@ import sys
 import os
 from os.path import join, basename, dirname
 import argparse
+import csv
+import pathlib
 
 from collections import Counter, OrderedDict
 
+from bgrrl.incremental import merge_records
+from bgrrl.metrics_store import update_metrics_store
+
 
 ASSEMBLY_STAGES = OrderedDict([
 	("asm_main_ucn", "Main,Unicycler,normalized"),
@@ -19,21 +24,36 @@ ASSEMBLY_STAGES = OrderedDict([
 	("NA", "not_assembled")])
 
 
-def compileASMInfo(asm_dir, out=sys.stdout, asm_stat_out=sys.stdout, asm_samplesheet=sys.stdout):
+def writeASMStageSummary(asm_tag_ctr, asm_stat_out=sys.stdout):
+	for asm_tag in ASSEMBLY_STAGES:
+		if asm_tag_ctr[asm_tag] > 0:
+			print(ASSEMBLY_STAGES[asm_tag], asm_tag_ctr[asm_tag], asm_tag_ctr[asm_tag]/sum(asm_tag_ctr.values()), sep="\t", file=asm_stat_out)
+	print("Total", "", "", sum(asm_tag_ctr.values()), sep="\t", file=asm_stat_out)
+
+
+def summariseASMStages(asm_stages_f, asm_stat_f):
+	with open(asm_stages_f) as _in:
+		asm_tag_ctr = Counter(row[1] for row in csv.reader(_in, delimiter="\t") if row)
+	with open(asm_stat_f, "wt") as asm_stat_out:
+		writeASMStageSummary(asm_tag_ctr, asm_stat_out=asm_stat_out)
+
+
+def compileASMInfo(asm_dir, out=sys.stdout, asm_stat_out=sys.stdout, asm_samplesheet=sys.stdout, samples=None):
 	asm_tag_ctr = Counter()
 	for cdir, dirs, files in os.walk(asm_dir):
 		sample = basename(cdir)
+		if cdir == asm_dir and samples is not None:
+			# only descend into the requested sample directories
+			dirs[:] = [d for d in dirs if d in samples]
 		if sample != "log" and os.path.dirname(cdir) == asm_dir:
+			dirs[:] = []
 			asm_tag = ([f for f in files if f.startswith("asm_")] + ["NA"])[0]
-			asm_tag_ctr[asm_tag] += 1 # .setdefault(asm_tag, list()).append(cdir)
+			asm_tag_ctr[asm_tag] += 1 # .setdefault(asm_tag, list()).append(cdir)
 			print(sample, asm_tag, sep="\t", file=out)
 			print(sample, sample, join(cdir, sample + ".assembly.fasta"), sep=",")
 			print(sample, sample, join(cdir, sample + ".assembly.fasta"), sep=",", file=asm_samplesheet)
 	print(asm_tag_ctr)
-	for asm_tag in ASSEMBLY_STAGES:
-		if asm_tag_ctr[asm_tag] > 0:
-			print(ASSEMBLY_STAGES[asm_tag], asm_tag_ctr[asm_tag], asm_tag_ctr[asm_tag]/sum(asm_tag_ctr.values()), sep="\t", file=asm_stat_out)
-	print("Total", "", "", sum(asm_tag_ctr.values()), sep="\t", file=asm_stat_out)
+	writeASMStageSummary(asm_tag_ctr, asm_stat_out=asm_stat_out)
 
 
 def main(args):
@@ -41,12 +61,35 @@ def main(args):
 	ap = argparse.ArgumentParser()
 	ap.add_argument("indir", type=str, default=".")
 	ap.add_argument("report_dir", type=str, default=".")
+	ap.add_argument("--samplesheet", type=str, default="", help="Only report samples from this samplesheet.")
+	ap.add_argument("--merge", action="store_true", help="Merge the reported samples into the existing project reports.")
 	args = ap.parse_args(args)
 
+	samples = None
+	if args.samplesheet:
+		with open(args.samplesheet) as _in:
+			samples = set(row[0] for row in csv.reader(_in, delimiter=",") if row)
+
+	pathlib.Path(join(args.report_dir, "samplesheets")).mkdir(parents=True, exist_ok=True)
+
+	asm_stat_f = join(args.report_dir, "assembly_stage_summary.tsv")
+	asm_stages_f = join(args.report_dir, "assembly_stages.tsv")
+	asm_samplesheet_f = join(args.report_dir, "samplesheets", "samplesheet.asm_pass.tsv")
+	if args.merge:
+		project_tables = asm_stages_f, asm_samplesheet_f
+		asm_stages_f = join(args.report_dir, "assembly_stages.increment.tsv")
+		asm_samplesheet_f = join(args.report_dir, "samplesheets", "samplesheet.asm_pass.increment.tsv")
+		asm_stat_f = join(args.report_dir, "assembly_stage_summary.increment.tsv")
+
 	print("Gathering assembly stage information...")
-	with open(join(args.report_dir, "assembly_stage_summary.tsv"), "wt") as asm_stage_summary, open(join(args.report_dir, "assembly_stages.tsv"), "wt") as asm_stages, open(join(args.report_dir, "samplesheets", "samplesheet.asm_pass.tsv"), "wt") as asm_samplesheet:
-		compileASMInfo(join(args.indir, "assembly"), out=asm_stages, asm_stat_out=asm_stage_summary, asm_samplesheet=asm_samplesheet)
-	return True
+	with open(asm_stat_f, "wt") as asm_stage_summary, open(asm_stages_f, "wt") as asm_stages, open(asm_samplesheet_f, "wt") as asm_samplesheet:
+		compileASMInfo(join(args.indir, "assembly"), out=asm_stages, asm_stat_out=asm_stage_summary, asm_samplesheet=asm_samplesheet, samples=samples)
 
-	
+	if args.merge:
+		drop = samples if samples is not None else tuple()
+		merge_records(asm_stages_f, project_tables[0], delimiter="\t", drop=drop)
+		merge_records(asm_samplesheet_f, project_tables[1], drop=drop)
+		summariseASMStages(project_tables[0], join(args.report_dir, "assembly_stage_summary.tsv"))
 
+	update_metrics_store(args.report_dir, stages=["assembly_stages"])
+	return True
@@ -4,6 +4,8 @@ import sys
 import argparse
 import csv
 
+from bgrrl.metrics_store import MetricsStore, get_metrics_store
+
 def readDatasum(dfile):
     import xlrd
     header, data = list(), dict()
@@ -22,7 +24,35 @@ def readDatasum(dfile):
     return data, header
 
 
-def writeDatasum(data, header, dfile, qc_pass=set(), asm_report=dict(), tax_report=dict(), tax_eb_report=dict(), asm_eb_report=dict()):
+# datasum column -> qc_eval metric
+QC_COLUMNS = [
+    ("qc:Status", "Status"),
+    ("fqc:Status", "FASTQC:READCOUNT:Status"),
+    ("fqc:Description", "FASTQC:READCOUNT:Description"),
+    ("#R1_reads", "FASTQC:READCOUNT:#R1_reads"),
+    ("#R2_reads", "FASTQC:READCOUNT:#R2_reads"),
+    ("Read_Length", "FASTQC:READCOUNT:Read_Length"),
+    ("kat:Status", "KAT:PEAKS:Status"),
+    ("kat:Description", "KAT:PEAKS:Description"),
+    ("#K-mer_peaks", "KAT:PEAKS:#K-mer_peaks"),
+    ("Max_Peak_Volume", "KAT:PEAKS:Max_Peak_Volume"),
+    ("Max_Peak_Volume/total", "KAT:PEAKS:Max_Peak_Volume/total"),
+    ("GC_peaks", "KAT:PEAKS:GC_peaks"),
+    ("Est_GenomeSize", "KAT:PEAKS:Genome_size"),
+    ("Est_GenomeSize_unit", "KAT:PEAKS:Genome_size_unit"),
+    ("K-mer_freq", "KAT:PEAKS:K-mer_freq"),
+    ("mean_GC", "KAT:PEAKS:mean_gc"),
+    ("tadpole:Status", "TADPOLE:SIZE:Status"),
+    ("tadpole:Description", "TADPOLE:SIZE:Description"),
+    ("tadpole:Assembly_size", "TADPOLE:SIZE:Assembly_size")
+]
+
+
+def writeDatasum(data, header, dfile, qc_eval=dict(), report_columns=list()):
+    """
+    Writes the datasummary with the qc_eval metrics and the report metrics of the samples in the pool.
+    report_columns is a list of (metrics, metrics per sample) of the reports to be added (in column order).
+    """
     def write_row(sheet, row_index, data, header):
         for j, col in enumerate(header):
             sheet.write(row_index, j, data[col])
@@ -31,15 +61,9 @@ def writeDatasum(data, header, dfile, qc_pass=set(), asm_report=dict(), tax_repo
     ip_header, nip_header = list(header[:-1]), list(header[:-1])
     ip_header.append("status")
 
-    asm_header = asm_report.get("Assembly", list())
-    asm_eb_header = asm_eb_report.get("Assembly", list())
-    tax_header = tax_report.get("Sample", list())
-    eb_header = tax_eb_report.get("Sample", "")
-    # qc_header = qc_pass.get("Sample", list())
-    qc_header = ["Sample", "qc:Status", "fqc:Status", "fqc:Description", "#R1_reads", "#R2_reads", "Read_Length", "kat:Status", "kat:Description", "#K-mer_peaks", "Max_Peak_Volume", "Max_Peak_Volume/total", "GC_peaks", "Est_GenomeSize", "Est_GenomeSize_unit", "K-mer_freq", "mean_GC", "tadpole:Status", "tadpole:Description", "tadpole:Assembly_size"]
-
-    ip_header.extend(qc_header[1:])
-    ip_header.extend(asm_header[1:] + asm_eb_header[-6:] + tax_header[2:] + [eb_header])
+    ip_header.extend(col for col, _ in QC_COLUMNS)
+    for metrics, _ in report_columns:
+        ip_header.extend(metrics)
 
 
     import xlsxwriter
@@ -54,14 +78,12 @@ def writeDatasum(data, header, dfile, qc_pass=set(), asm_report=dict(), tax_repo
     row_index_ip, row_index_nip = 1, 1
     for i, k in enumerate(sorted(data), 1):
         if data[k][in_pool_cheader]:
-            data[k].update(dict(zip(asm_header[1:], asm_report.get(k, [""]*len(asm_header))[1:])))
-            data[k].update(dict(zip(asm_eb_header[-6:], asm_eb_report.get(k, [""]*len(asm_eb_header))[-6:])))
-            data[k].update(dict(zip(tax_header[2:], tax_report.get(k, [""]*len(tax_header))[2:])))
-            data[k].update(dict(zip([eb_header], [tax_eb_report.get(k, "")])))
-            data[k].update(dict(zip(qc_header[1:], qc_pass.get(k, [""]*len(qc_header))[1:])))
-
-            # data[k]["status"] = "assembled" if k in qc_pass else "failed Bioinf_QC"
-            data[k]["status"] = "assembled" if qc_pass.get(k, [None, "FAIL"])[1] == "PASS" else "failed Bioinf_QC"
+            for metrics, report in report_columns:
+                data[k].update((metric, report.get(k, dict()).get(metric, "")) for metric in metrics)
+            qc_data = qc_eval.get(k, dict())
+            data[k].update((col, qc_data.get(metric, "")) for col, metric in QC_COLUMNS)
+
+            data[k]["status"] = "assembled" if qc_data.get("Status", "FAIL") == "PASS" else "failed Bioinf_QC"
             write_row(sheet_ip, row_index_ip, data[k], ip_header)
             row_index_ip += 1
         else:
@@ -79,33 +101,26 @@ def main():
 
     data, header = readDatasum(args.datasum_file)
     report_dir = join(args.indir, "reports")
-    
-    # with open(join(report_dir, "samplesheets", "samplesheet.qc_pass.tsv")) as qc_in:
-    #     qc_pass = set(row[0] for i, row in enumerate(csv.reader(qc_in, delimiter=",")))
-    with open(join(report_dir, "qc_eval.tsv")) as qc_in:
-        qc_pass = dict((row[0], row) for row in csv.reader(qc_in, delimiter="\t"))
-
-    if args.mode == "asm":
-        quast_report, tax_report = "quast_report.tsv", "blobtools_report.tsv"
-        try:
-            with open(join(report_dir, "eb_taxonomy_report.tsv")) as eb_in:
-                tax_eb_report = dict((row[0], row[-1]) for row in csv.reader(eb_in, delimiter="\t"))
-        except:
-                tax_eb_report = dict() 
-        try:
-            with open(join(report_dir, "all_quast_taxonomy_report.tsv")) as asm_eb_in:
-                asm_eb_report = dict((row[0], row[-6:]) for row in csv.reader(asm_eb_in, delimiter="\t"))
-        except:
-                asm_eb_report = dict()
-    else:
-        quast_report, tax_report = "quast_survey_report", "blobtools_survey_report.tsv"
-        tax_eb_report, asm_eb_report = dict(), dict()
-
-    with open(join(report_dir, quast_report)) as quast_in:
-        quast_data = dict((row[0], row) for i, row in enumerate(csv.reader(quast_in, delimiter="\t")))
-    with open(join(report_dir, tax_report)) as tax_in:
-        tax_report = dict((row[0], row) for i, row in enumerate(csv.reader(tax_in, delimiter="\t")))
-
-    writeDatasum(data, header, args.datasum_file.replace(".xlsx", ".bgsum.xlsx"), qc_pass=qc_pass, asm_report=quast_data, tax_report=tax_report, tax_eb_report=tax_eb_report, asm_eb_report=asm_eb_report)
+
+    # the reports are joined by sample and metric name in the metrics store
+    with MetricsStore(get_metrics_store(report_dir)) as metrics_store:
+        if not metrics_store.sync("qc_eval", report_dir):
+            print("Cannot find qc_eval report in " + report_dir, file=sys.stderr)
+            exit(1)
+        qc_eval = metrics_store.get_stage("qc_eval")
+
+        quast_stage, tax_stage = ("quast", "blobtools") if args.mode == "asm" else ("quast_survey", "blobtools_survey")
+        # quast: all metrics, enterobase assembly check: the criteria columns, blobtools: all but #contigs, enterobase taxonomy check: the criteria column
+        report_columns = [(quast_stage, slice(None)), ("enterobase_assembly", slice(-6, None)), (tax_stage, slice(1, None)), ("enterobase_taxonomy", slice(-1, None))]
+        if args.mode != "asm":
+            report_columns = report_columns[0:3:2]
+
+        report_columns = [
+            (metrics_store.get_metrics(stage)[1][columns], metrics_store.get_stage(stage))
+            for stage, columns in report_columns
+            if metrics_store.sync(stage, report_dir)
+        ]
+
+    writeDatasum(data, header, args.datasum_file.replace(".xlsx", ".bgsum.xlsx"), qc_eval=qc_eval, report_columns=report_columns)
 
     pass
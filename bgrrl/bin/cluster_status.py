@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+import sys
+import os
+from os.path import join, exists
+import re
+import json
+import time
+import fcntl
+import argparse
+import subprocess
+
+# snakemake calls this script once per submitted job (cluster submission command) and once per job status check.
+# It is therefore executed by path and must not import bgrrl (or anything else outside the standard library).
+
+CHECK_INTERVAL = 10
+
+SUCCESS, FAILED, RUNNING = "success", "failed", "running"
+
+JOB_ID_PATTERNS = {
+	# sbatch --parsable: <jobid>[;<cluster>], otherwise: Submitted batch job <jobid>
+	"SLURM": re.compile(r"^(?:Submitted batch job )?(?P<jobid>[0-9]+(?:_[0-9]+)?)"),
+	# Job <jobid> is submitted to queue <queue>.
+	"LSF": re.compile(r"Job <(?P<jobid>[0-9]+)>"),
+	# <jobid>.<server>
+	"PBS": re.compile(r"^(?P<jobid>[0-9]+(?:\[[0-9]*\])?(?:\.[^\s]+)?)")
+}
+
+SLURM_FAILED = {"FAILED", "CANCELLED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL", "PREEMPTED", "BOOT_FAIL", "DEADLINE"}
+
+
+def querySLURM(job_ids):
+	out = subprocess.check_output(["sacct", "-X", "-n", "-P", "-o", "JobID,State", "-j", ",".join(job_ids)], stderr=subprocess.DEVNULL)
+	status = dict()
+	for line in out.decode().strip().split("\n"):
+		if line:
+			job_id, state = line.split("|")[:2]
+			# requeued jobs are reported several times, the last record is the current one
+			state = state.split(" ")[0]
+			status[job_id] = SUCCESS if state == "COMPLETED" else (FAILED if state in SLURM_FAILED else RUNNING)
+	return status
+
+
+def queryLSF(job_ids):
+	out = subprocess.check_output(["bjobs", "-a", "-noheader", "-o", "jobid stat"] + job_ids, stderr=subprocess.DEVNULL)
+	status = dict()
+	for line in out.decode().strip().split("\n"):
+		fields = line.split()
+		if len(fields) == 2 and fields[0] in job_ids:
+			status[fields[0]] = SUCCESS if fields[1] == "DONE" else (FAILED if fields[1] == "EXIT" else RUNNING)
+	return status
+
+
+def queryPBS(job_ids):
+	out = subprocess.check_output(["qstat", "-x", "-f"] + job_ids, stderr=subprocess.DEVNULL)
+	status, job_id, state = dict(), None, None
+	for line in out.decode().split("\n"):
+		line = line.strip()
+		if line.startswith("Job Id:"):
+			job_id, state = line.split(":", 1)[1].strip(), None
+			status[job_id] = RUNNING
+		elif line.startswith("job_state") and job_id is not None:
+			state = line.split("=")[1].strip()
+		elif line.startswith("Exit_status") and job_id is not None and state == "F":
+			status[job_id] = SUCCESS if line.split("=")[1].strip() == "0" else FAILED
+	# qstat may report the full job id (<jobid>.<server>) for a short one
+	for requested in job_ids:
+		if requested not in status:
+			for job_id in status:
+				if job_id.split(".")[0] == requested.split(".")[0]:
+					status[requested] = status[job_id]
+					break
+	return status
+
+
+QUERIES = {
+	"SLURM": querySLURM,
+	"LSF": queryLSF,
+	"PBS": queryPBS
+}
+
+
+class StatusCache:
+	"""
+	Job status cache shared by all submission and status calls of a snakemake run.
+	Outstanding jobs are queried from the scheduler in a single call at most once per interval,
+	final states (success, failed) are never queried again.
+	"""
+	def __init__(self, cache_dir, scheduler, interval=CHECK_INTERVAL):
+		self.cache_file = join(cache_dir, "status.json")
+		self.lock_file = join(cache_dir, "status.lock")
+		self.scheduler = scheduler.upper()
+		self.interval = interval
+		if self.scheduler not in QUERIES:
+			raise ValueError("Unsupported scheduler: {}. Supported schedulers: {}.".format(scheduler, ", ".join(sorted(QUERIES))))
+		os.makedirs(cache_dir, exist_ok=True)
+
+	def __enter__(self):
+		self.lock = open(self.lock_file, "a")
+		fcntl.flock(self.lock, fcntl.LOCK_EX)
+		self.cache = {"checked": 0, "jobs": dict()}
+		if exists(self.cache_file):
+			with open(self.cache_file) as cache_in:
+				self.cache = json.load(cache_in)
+		return self
+
+	def __exit__(self, *exc_info):
+		tmp_file = self.cache_file + ".tmp"
+		with open(tmp_file, "wt") as cache_out:
+			json.dump(self.cache, cache_out)
+		os.replace(tmp_file, self.cache_file)
+		fcntl.flock(self.lock, fcntl.LOCK_UN)
+		self.lock.close()
+		return False
+
+	def register(self, job_ids):
+		self.cache["jobs"].update((job_id, RUNNING) for job_id in job_ids if job_id not in self.cache["jobs"])
+
+	def refresh(self):
+		outstanding = [job_id for job_id, status in self.cache["jobs"].items() if status == RUNNING]
+		if outstanding:
+			try:
+				self.cache["jobs"].update(QUERIES[self.scheduler](outstanding))
+			except (OSError, subprocess.CalledProcessError):
+				# the scheduler is temporarily unavailable, jobs are reported as running until the next check
+				pass
+		self.cache["checked"] = time.time()
+
+	def get_status(self, job_id):
+		status = self.cache["jobs"].get(job_id)
+		if status is None or (status == RUNNING and time.time() - self.cache["checked"] >= self.interval):
+			self.register([job_id])
+			self.refresh()
+		return self.cache["jobs"][job_id]
+
+
+def getJobId(submission_output, scheduler):
+	match = JOB_ID_PATTERNS[scheduler.upper()].search(submission_output.strip())
+	if match is None:
+		raise ValueError("Could not find job id in submission output: {}".format(submission_output))
+	return match.group("jobid")
+
+
+def submitJob(cache_dir, scheduler, submit_cmd):
+	"""Runs submit_cmd and registers the submitted job for status checks. Returns the job id."""
+	job_id = getJobId(subprocess.check_output(submit_cmd).decode(), scheduler)
+	with StatusCache(cache_dir, scheduler) as cache:
+		cache.register([job_id])
+	return job_id
+
+
+def getJobStatus(cache_dir, scheduler, job_id):
+	"""Returns the job status expected by snakemake: success, failed or running."""
+	with StatusCache(cache_dir, scheduler) as cache:
+		return cache.get_status(job_id)
+
+
+def main(args_in=sys.argv[1:]):
+	ap = argparse.ArgumentParser(description="Batched, cached job submission and status commands for snakemake cluster execution (SLURM, LSF, PBS).")
+	subparsers = ap.add_subparsers(dest="command")
+	submit_parser = subparsers.add_parser("submit", help="Submit a job and print its job id.")
+	submit_parser.add_argument("cache_dir", type=str)
+	submit_parser.add_argument("scheduler", type=str, choices=sorted(QUERIES))
+	submit_parser.add_argument("submit_cmd", nargs=argparse.REMAINDER, help="Submission command, options and job script.")
+	status_parser = subparsers.add_parser("status", help="Print the status (success, failed, running) of a job.")
+	status_parser.add_argument("cache_dir", type=str)
+	status_parser.add_argument("scheduler", type=str, choices=sorted(QUERIES))
+	status_parser.add_argument("job_id", type=str)
+	args = ap.parse_args(args_in)
+
+	if args.command == "submit":
+		if not args.submit_cmd:
+			raise ValueError("Missing submission command.")
+		print(submitJob(args.cache_dir, args.scheduler, args.submit_cmd))
+	elif args.command == "status":
+		print(getJobStatus(args.cache_dir, args.scheduler, args.job_id))
+	else:
+		ap.print_help()
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,24 +1,179 @@
 import os
 import sys
-import glob
 import re
+import shutil
 import argparse
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+"""
+Illumina read file naming, e.g.
+bcl2fastq:   <sample>_S1_L001_R1_001.fastq.gz
+EI archive:  FD01543206_PRO1620_plate92_H12_ACGCAGCAA-AGTCAA_L008_R1.fastq.gz
+minimal:     <sample>_R1.fastq.gz
+"""
+ILLUMINA_READFILE = re.compile(
+    r"^(?P<sample>.+?)(?P<snum>_S\d+)?(?P<lane>_L\d{3})?_(?P<mate>R[12])(?P<chunk>_\d{3})?\.(?:fastq|fq)\.gz$"
+)
+
+ReadFile = namedtuple("ReadFile", "sample library lane mate path".split(" "))
+
+
+def parseReadFile(path):
+    m = ILLUMINA_READFILE.match(os.path.basename(path))
+    if m is None:
+        return None
+    sample, snum, lane, mate, chunk = m.group("sample", "snum", "lane", "mate", "chunk")
+    # the library id is the file name without mate and suffix, i.e. it keeps lane and chunk information
+    library = sample + (snum or "") + (lane or "") + (chunk or "")
+    return ReadFile(sample, library, (lane or "").lstrip("_"), mate, path)
+
+
+def _scanDirectory(path):
+    subdirs, readfiles = list(), list()
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        st = entry.stat()
+                        subdirs.append((entry.path, (st.st_dev, st.st_ino)))
+                    elif entry.name.endswith(".gz"):
+                        readfile = parseReadFile(entry.path)
+                        if readfile is not None:
+                            readfiles.append(readfile)
+                except OSError:
+                    continue
+    except OSError as err:
+        print("WARNING: Cannot scan directory {}: {}".format(path, err), file=sys.stderr)
+    return subdirs, readfiles
+
+
+def scanReadDirectories(roots, threads=16, recursive=True):
+    """Concurrently scans directory trees for Illumina read files."""
+    readfiles, seen = list(), set()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = set()
+        for root in roots:
+            st = os.stat(root)
+            seen.add((st.st_dev, st.st_ino))
+            pending.add(pool.submit(_scanDirectory, os.path.abspath(root)))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, found = future.result()
+                readfiles.extend(found)
+                if recursive:
+                    for subdir, inode in subdirs:
+                        # avoid symlink loops and directories reachable via several paths
+                        if inode not in seen:
+                            seen.add(inode)
+                            pending.add(pool.submit(_scanDirectory, subdir))
+    return readfiles
+
+
+def pairReadFiles(readfiles, lane=""):
+    """
+    Pairs mates by library and groups libraries (lanes, chunks) by sample.
+    If a lane is selected, the lane is dropped from the library ids.
+    Returns (OrderedDict sample -> [(library, R1, R2)], list of unpaired read files).
+    """
+    libraries = dict()
+    for readfile in readfiles:
+        library = readfile.library
+        if lane:
+            if readfile.lane != lane:
+                continue
+            library = library.replace("_" + lane, "", 1)
+        libraries.setdefault((readfile.sample, library), dict()).setdefault(readfile.mate, list()).append(readfile)
+
+    samples, unpaired = OrderedDict(), list()
+    for (sample, library), mates in sorted(libraries.items()):
+        r1, r2 = mates.get("R1", list()), mates.get("R2", list())
+        if len(r1) != 1 or len(r2) != 1:
+            # missing mate or the same library found in several locations
+            unpaired.extend(r1 + r2)
+            continue
+        samples.setdefault(sample, list()).append((library, r1[0].path, r2[0].path))
+    return samples, unpaired
+
+
+def _isMerged(merged_file, readfiles):
+    if not os.path.exists(merged_file):
+        return False
+    st = os.stat(merged_file)
+    return st.st_size == sum(os.path.getsize(f) for f in readfiles) and st.st_mtime >= max(os.path.getmtime(f) for f in readfiles)
+
+
+def mergeLanes(sample, libraries, merge_dir):
+    """
+    Concatenates the read files of a multi-lane sample (libraries as returned by pairReadFiles) into a single read pair
+    in merge_dir (concatenated gzip files are valid gzip files). Both mates are merged in library order.
+    Up-to-date merged files are kept. Returns (R1, R2).
+    """
+    merged = list()
+    for mate, readfiles in (("R1", [r1 for _, r1, _ in libraries]), ("R2", [r2 for _, _, r2 in libraries])):
+        merged_file = os.path.join(merge_dir, "{}_{}.fastq.gz".format(sample, mate))
+        if not _isMerged(merged_file, readfiles):
+            tmp_file = merged_file + ".tmp"
+            with open(tmp_file, "wb") as merged_out:
+                for f in readfiles:
+                    with open(f, "rb") as reads_in:
+                        shutil.copyfileobj(reads_in, merged_out, 2**24)
+            os.replace(tmp_file, merged_file)
+        merged.append(merged_file)
+    return tuple(merged)
 
 
 def main(argv=sys.argv[1:]):
 
     ap = argparse.ArgumentParser()
-    ap.add_argument("readpath", type=str)
-    ap.add_argument("--lane", "-l", type=str, default="")
-    args = ap.parse_args()
+    ap.add_argument("readpath", type=str, nargs="+", help="Directories (e.g. sequencing run folders) containing the read files.")
+    ap.add_argument("--lane", "-l", type=str, default="", help="Only use reads from this lane (e.g. L006).")
+    ap.add_argument("--output", "-o", type=str, default="samplesheet.csv", help="Path to output samplesheet. [samplesheet.csv]")
+    ap.add_argument("--threads", "-t", type=int, default=16, help="Number of directories to scan concurrently. [16]")
+    ap.add_argument("--no-recursion", action="store_true", help="Do not descend into subdirectories.")
+    ap.add_argument("--strict", action="store_true", help="Fail if any read file is missing its mate.")
+    ap.add_argument("--merge-dir", type=str, default="", help="Directory for the merged read files of multi-lane samples. [merged_reads next to the samplesheet]")
+    args = ap.parse_args(argv)
+
+    merge_dir = os.path.abspath(args.merge_dir or os.path.join(os.path.dirname(os.path.abspath(args.output)), "merged_reads"))
+    readfiles = [
+        readfile
+        for readfile in scanReadDirectories(args.readpath, threads=max(1, args.threads), recursive=not args.no_recursion)
+        # merged read files of earlier calls
+        if os.path.dirname(readfile.path) != merge_dir
+    ]
+    samples, unpaired = pairReadFiles(readfiles, lane=args.lane)
+
+    for readfile in sorted(unpaired, key=lambda x:x.path):
+        print("WARNING: Missing or ambiguous mate for {} ({}).".format(readfile.path, readfile.library), file=sys.stderr)
+
+    # bgrrl takes exactly one R1/R2 pair per sample, the lanes (and chunks) of multi-lane samples are concatenated
+    multi_lane = OrderedDict((sample, libraries) for sample, libraries in samples.items() if len(libraries) > 1)
+    merged = dict()
+    if multi_lane:
+        os.makedirs(merge_dir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=max(1, args.threads)) as pool:
+            merged = dict(zip(multi_lane, pool.map(lambda item: mergeLanes(*item, merge_dir), multi_lane.items())))
+        print("Merged the lanes of {} multi-lane samples into {}.".format(len(merged), merge_dir), file=sys.stderr)
+
+    with open(args.output, "w") as samplesheet:
+        for sample, libraries in samples.items():
+            r1, r2 = merged[sample] if sample in merged else libraries[0][1:]
+            print(sample, sample, r1, r2, ",,,,,", sep=",", file=samplesheet)
 
-    lane = ("_" + args.lane) if args.lane else ""
+    print(
+        "Found {} read files: {} libraries from {} samples, {} files without mate.".format(
+            len(readfiles), sum(map(len, samples.values())), len(samples), len(unpaired)
+        ),
+        file=sys.stderr
+    )
 
-    with open("samplesheet.csv", "w") as samplesheet:
-        for f in sorted(glob.glob(os.path.join(args.readpath, "*{}_R1.fastq.gz".format(lane)))):
-            s = os.path.basename(f).replace("{}_R1.fastq.gz".format(lane), "")
-            print(s, s, f, f.replace("R1.fastq.gz", "R2.fastq.gz"), ",,,,,", sep=",", file=samplesheet)
-    return True
+    if unpaired and args.strict:
+        print("ERROR: {} read files without mate (--strict).".format(len(unpaired)), file=sys.stderr)
+        sys.exit(1)
 
 
 
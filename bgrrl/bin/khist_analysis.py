@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import argparse
+
+import numpy as np
+
+from bgrrl.bin.read_stats import readReadStats
+
+KMER_SIZE = 31
+SMOOTHING_WINDOW = 5
+MIN_PEAK_VOLUME = 0.01
+
+
+def readKmerHistogram(fn):
+	"""
+	Reads a k-mer histogram as written by bbnorm (khist/khistout: #Depth, Raw_Count, Unique_Kmers).
+	Returns the number of distinct k-mers per depth (index).
+	"""
+	if not os.path.exists(fn) or os.stat(fn).st_size == 0:
+		return np.zeros(0)
+	data = np.loadtxt(fn, comments="#", ndmin=2)
+	if not data.size:
+		return np.zeros(0)
+	return np.bincount(data[:, 0].astype(int), weights=data[:, -1])
+
+
+def getPeakRegions(smoothed, peaks, start):
+	"""Each peak extends to the minima between it and its neighbouring peaks, the first peak starts at start."""
+	bounds = [start]
+	for left, right in zip(peaks[:-1], peaks[1:]):
+		bounds.append(left + int(np.argmin(smoothed[left:right])))
+	bounds.append(len(smoothed))
+	return list(zip(bounds[:-1], bounds[1:]))
+
+
+def findPeaks(counts, window=SMOOTHING_WINDOW, min_volume=MIN_PEAK_VOLUME):
+	"""
+	Finds the peaks of a k-mer histogram beyond the error trough (the first minimum of the smoothed histogram).
+	Peaks with less than min_volume of the largest peak's volume are dropped.
+	Returns the start of the peaks (error trough) and a list of (first depth, last depth + 1) regions, one per peak.
+	"""
+	if len(counts) < 3:
+		return None, list()
+	# depth 0 is not a k-mer frequency, the histogram is extended by its edge values for smoothing
+	smoothed = np.convolve(np.pad(counts[1:], window // 2, mode="edge"), np.ones(window) / window, mode="valid")
+	smoothed = np.concatenate(([smoothed[0]], smoothed))
+	slope = np.sign(np.diff(smoothed[1:]))
+	minima = np.flatnonzero((slope[:-1] < 0) & (slope[1:] >= 0)) + 2
+	maxima = np.flatnonzero((slope[:-1] > 0) & (slope[1:] <= 0)) + 2
+	# without an error trough (e.g. normalized or error-free reads), the histogram starts at depth 1
+	start = int(minima[0]) if minima.size and (not maxima.size or minima[0] < maxima[0]) else 1
+	peaks = maxima[maxima > start]
+	if not peaks.size:
+		return start, list()
+
+	regions = getPeakRegions(smoothed, peaks, start)
+	volumes = np.array([counts[lo:hi].sum() for lo, hi in regions])
+	peaks = peaks[volumes >= min_volume * volumes.max()]
+	return start, getPeakRegions(smoothed, peaks, start)
+
+
+def analyseKmerHistogram(counts, read_length=0, kmer_size=KMER_SIZE):
+	"""
+	Estimates peaks, k-mer coverage and genome size from a k-mer histogram.
+	The genome size is the number of k-mers beyond the error trough divided by the mean frequency of the main (largest) peak.
+	Returns the coverage section of a kat gcp distribution analysis (dist_analysis.json).
+	"""
+	depths = np.arange(len(counts))
+	start, regions = findPeaks(counts)
+	coverage = {"nb_peaks": len(regions), "mean_freq": None, "est_genome_size": None, "peaks": list(), "kmer_size": kmer_size}
+	for lo, hi in regions:
+		d, n = depths[lo:hi], counts[lo:hi]
+		volume = n.sum()
+		mean = (d * n).sum() / volume
+		coverage["peaks"].append({
+			"mean_freq": float(mean),
+			"stddev": float(np.sqrt((((d - mean) ** 2) * n).sum() / volume)),
+			"count": int(n.max()),
+			"volume": int(volume)
+		})
+
+	if coverage["peaks"]:
+		main_peak = max(coverage["peaks"], key=lambda peak: peak["volume"])
+		coverage["mean_freq"] = main_peak["mean_freq"]
+		coverage["est_genome_size"] = int((depths[start:] * counts[start:]).sum() / main_peak["mean_freq"])
+		if read_length > kmer_size:
+			# k-mer coverage -> base coverage
+			coverage["est_base_coverage"] = main_peak["mean_freq"] * read_length / (read_length - kmer_size + 1)
+	return coverage
+
+
+def getMeanGC(read_stats):
+	if read_stats is None:
+		return None
+	bases = read_stats["R1"]["bases"] + read_stats["R2"]["bases"]
+	gc_bases = read_stats["R1"].get("gc_bases"), read_stats["R2"].get("gc_bases")
+	if None in gc_bases or not bases:
+		return None
+	return 100 * sum(gc_bases) / bases
+
+
+def main(args_in=sys.argv[1:]):
+	ap = argparse.ArgumentParser(description="Estimates k-mer peaks, coverage and genome size from a bbnorm k-mer histogram. Writes a kat gcp compatible distribution analysis (JSON).")
+	ap.add_argument("khist", type=str, help="k-mer histogram (bbnorm khist).")
+	ap.add_argument("--read-stats", type=str, default="", help="Read statistics (read_stats) of the histogram's reads, for mean read length and GC content.")
+	ap.add_argument("--kmer-size", type=int, default=KMER_SIZE, help="k-mer size of the histogram. [{}]".format(KMER_SIZE))
+	ap.add_argument("--output", "-o", type=str, default="", help="Write the analysis to this file. [stdout]")
+	args = ap.parse_args(args_in)
+
+	read_stats = readReadStats(args.read_stats) if args.read_stats else None
+	read_length = max(read_stats["R1"]["mean_length"], read_stats["R2"]["mean_length"]) if read_stats else 0
+
+	analysis = {
+		"coverage": analyseKmerHistogram(readKmerHistogram(args.khist), read_length=read_length, kmer_size=args.kmer_size),
+		# bbnorm histograms carry no GC information, the mean GC content is taken from the read statistics
+		"gc": {"nb_peaks": None, "mean_gc%": getMeanGC(read_stats)},
+		"source": os.path.abspath(args.khist)
+	}
+
+	if args.output:
+		tmp_out = args.output + ".tmp"
+		with open(tmp_out, "wt") as analysis_out:
+			json.dump(analysis, analysis_out, indent=1)
+		os.replace(tmp_out, args.output)
+	else:
+		json.dump(analysis, sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+	main()
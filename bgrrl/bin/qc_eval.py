@@ -7,15 +7,21 @@ import re
 import csv
 import argparse
 import pathlib 
+import json
 
 from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 # from bgrrl.samplesheet import readSamplesheet, Sample, ASM_Sample, sample2asmsample
 from bgrrl.samplesheet import *
+from bgrrl.incremental import merge_records
+from bgrrl.metrics_store import update_metrics_store
+from bgrrl.statcache import StatCache
+from bgrrl.bin.read_stats import readReadStats
 
 TestResult = namedtuple("TestResult", "test status errmsg data".split(" "))
 
-def test_fastqc_readcount(sample, min_reads=1000, readtype="bbnorm", **kwargs):
+def test_fastqc_readcount(sample, min_reads=1000, readtype="bbnorm", qcdir="qc", **kwargs):
     def extractReadCount(fn):
         try:
             with open(fn) as fi:
@@ -38,10 +44,21 @@ def test_fastqc_readcount(sample, min_reads=1000, readtype="bbnorm", **kwargs):
         return os.stat(_file).st_size if exists(_file) else "NA"
 
     test = "FASTQC:READCOUNT"
-    fastqc_dir = join(QCDIR, "fastqc", readtype, sample)
+    # read statistics (read_stats) are preferred, FastQC reports are only used for surveys without them
+    read_stats = readReadStats(getReadStatsFile(qcdir, sample, readtype))
+    if read_stats is not None:
+        n1, n2 = read_stats["R1"]["reads"], read_stats["R2"]["reads"]
+        readlen = max(read_stats["R1"]["max_length"], read_stats["R2"]["max_length"])
+        if not read_stats["pairs"]["consistent"]:
+            return TestResult(test, "FAIL", "INCONSISTENT", (n1, n2, readlen))
+        if n1 < min_reads:
+            return TestResult(test, "FAIL", "LOW", (n1, n2, readlen))
+        return TestResult(test, "PASS", "", (n1, n2, readlen))
+
+    fastqc_dir = join(qcdir, "fastqc", readtype, sample)
     fastqc_r1 = join(fastqc_dir, sample + "_R1.{}_fastqc".format(readtype), "fastqc_data.txt")
     fastqc_r2 = join(fastqc_dir, sample + "_R2.{}_fastqc".format(readtype), "fastqc_data.txt")
-    read_dir = join(QCDIR, readtype, sample)
+    read_dir = join(qcdir, readtype, sample)
     if not (exists(fastqc_r1) and exists(fastqc_r2)):
         R1_size = checkReadFile(join(read_dir, sample + "_R1.{}.fastq.gz".format(readtype)))
         R2_size = checkReadFile(join(read_dir, sample + "_R2.{}.fastq.gz".format(readtype)))
@@ -59,9 +76,9 @@ def test_fastqc_readcount(sample, min_reads=1000, readtype="bbnorm", **kwargs):
         return TestResult(test, "FAIL", "LOW", (n1, n2, readlen))
     return TestResult(test, "PASS", "", (n1, n2, readlen)) 
 
-def test_kat_peaks(sample, max_peak_volume_threshold=0.9, **kwargs):
+def test_kat_peaks(sample, max_peak_volume_threshold=0.9, qcdir="qc", **kwargs):
     test = "KAT:PEAKS"
-    kat_log = join(QCDIR, "kat", sample, sample + ".dist_analysis.json")
+    kat_log = join(qcdir, "kat", sample, sample + ".dist_analysis.json")
     status, errmsg, data = "PASS", "", tuple([None]*8)
     kmer_peaks, gc_peaks, gsize, unit, kmer_freq, mean_gc = None, None, None, None, None, None
     kmer_peak_table = list()
@@ -75,8 +92,6 @@ def test_kat_peaks(sample, max_peak_volume_threshold=0.9, **kwargs):
         except:
             return(test, "PASS", "JSON_ERROR", data)
 
-        print(sample, kat_data)
-
         cov_data = kat_data.get("coverage", dict())
         kmer_peaks = cov_data.get("nb_peaks", None)
         kmer_freq = cov_data.get("mean_freq", None)
@@ -91,9 +106,6 @@ def test_kat_peaks(sample, max_peak_volume_threshold=0.9, **kwargs):
         keys = ("mean_freq", "stddev", "count", "volume")
         kmer_peak_table = list([peak[k] for k in keys] for peak in cov_data.get("peaks", dict(zip(keys, [None]*4))))
 
-
-        print(sample, kmer_peak_table)
-
         VOLUME_INDEX = 3
 
         try:
@@ -121,9 +133,9 @@ def test_kat_peaks(sample, max_peak_volume_threshold=0.9, **kwargs):
     return TestResult(test, status, errmsg, data)
 
 
-def test_kat_peaks_old(sample, max_peak_volume_threshold=0.9, **kwargs):
+def test_kat_peaks_old(sample, max_peak_volume_threshold=0.9, qcdir="qc", **kwargs):
     test = "KAT:PEAKS"
-    kat_log = join(QCDIR, "kat", sample, sample + ".kat")
+    kat_log = join(qcdir, "kat", sample, sample + ".kat")
     status, errmsg, data = "PASS", "", tuple([None]*8)
     kmer_peaks, gc_peaks, gsize, unit, kmer_freq, mean_gc = None, None, None, None, None, None
     if not exists(kat_log) or os.stat(kat_log).st_size == 0:
@@ -237,18 +249,23 @@ L75	472
 # N's per 100 kbp	0.00
 """
  
-def test_tadpole_size(sample, min_size=1e6, **kwargs):
+def test_tadpole_size(sample, min_size=1e6, qcdir="qc", qadir=join("qaa", "survey"), **kwargs):
     def extractAssemblySize(qreport_in):
         for row in csv.reader(qreport_in, delimiter="\t"):
             if row[0].startswith("Total length"):
                 return int(row[1])
         return 0
+    def extractFastaSize(fasta_in):
+        return sum(len(line.strip()) for line in fasta_in if not line.startswith(">"))
     test = "TADPOLE:SIZE"
-    quast_report = join(QADIR, "quast", sample, "report.tsv")
+    quast_report = join(qadir, "quast", sample, "report.tsv")
+    tadpole_contigs = join(qcdir, "tadpole", sample, sample + "_tadpole_contigs.fasta")
 
     status, errmsg, assembly_size = "PASS", "", 0
-    if exists(quast_report):
-        assembly_size = extractAssemblySize(open(quast_report))
+    if exists(quast_report) or exists(tadpole_contigs):
+        # without survey qaa run (e.g. per-sample gating), the size is taken from the contigs
+        with open(quast_report if exists(quast_report) else tadpole_contigs) as _in:
+            assembly_size = extractAssemblySize(_in) if exists(quast_report) else extractFastaSize(_in)
         if assembly_size < min_size:
             status, errmsg = "FAIL", "TOO_SMALL"
     else:
@@ -270,10 +287,282 @@ TESTS = [("FASTQC:READCOUNT",
           {"min_size": 1e6})]
 
 
+def evaluateSample(sample, indir, readtype="bbnorm", min_tadpole_size=1e6):
+    """
+    Runs the survey tests on a sample.
+    Returns (passed, test results, qc_eval.tsv row).
+    """
+    qcdir, qadir = join(indir, "qc"), join(indir, "qaa", "survey")
 
+    if readPregate(getPregateFile(qcdir, sample)) is False:
+        # the survey stopped after preprocessing, the read count is taken from the preprocessed reads
+        readtype = "bbduk"
 
-
-
+    results = list()
+    for test, testf, tdata, kwargs in TESTS:
+        kwargs = dict(kwargs, qcdir=qcdir, qadir=qadir)
+        if test == "FASTQC:READCOUNT":
+            kwargs["readtype"] = readtype
+        elif test == "TADPOLE:SIZE":
+            kwargs["min_size"] = min_tadpole_size
+        results.append(testf(sample, **kwargs))
+    passed = all(result[1] == "PASS" for result in results)
+
+    row = [sample, "PASS" if passed else "FAIL"]
+    for result in results:
+        row.extend(result[1:3] + result[3])
+
+    return passed, results, row
+
+
+def getQCEvalHeader():
+    header = ["Sample", "Status"]
+    header2 = ["", ""]
+    for test, testf, tdata, _ in TESTS:
+        header.extend([test] + [""]*(len(tdata)-1))   
+        header2.extend(tdata)
+    return header, header2
+
+
+def getTestResult(row, test):
+    """Returns (status, description) of a test from a qc_eval.tsv row."""
+    col = 2
+    for _test, testf, tdata, _ in TESTS:
+        if _test == test:
+            return row[col], row[col + 1]
+        col += len(tdata)
+    return None, None
+
+
+def getASMSampleData(sample, qcdir):
+    """Preprocessed read files of a sample (as written by the survey rules) in ASM samplesheet column order."""
+    trimdata = [join(qcdir, "bbduk", sample, "{}_{}.bbduk.fastq.gz".format(sample, mate)) for mate in ("R1", "R2")] + [""]
+    normdata = [join(qcdir, "bbnorm", sample, "{}_{}.bbnorm.fastq.gz".format(sample, mate)) for mate in ("R1", "R2")] + [""]
+    if not exists(normdata[0]) or not exists(normdata[1]):
+        normdata = ["", "", ""]
+    return trimdata + normdata
+
+
+def getReadStatsFile(qcdir, sample, readtype):
+    return join(qcdir, "readstats", readtype, sample, "{}.{}.read_stats.json".format(sample, readtype))
+
+
+NORMALIZATION_MODES = ("passthrough", "subsample", "bbnorm")
+
+
+def getNormalizationFile(qcdir, sample):
+    return join(qcdir, "bbnorm", sample, sample + ".normalization.json")
+
+
+def getNormalizationPolicy(read_stats, genome_size, target_coverage=100, max_excess=10):
+    """
+    Chooses the normalization of a sample from its estimated coverage (read bases / genome size):
+    passthrough (bbnorm would not reduce the reads) up to target_coverage,
+    subsample (to target_coverage) from max_excess times target_coverage, otherwise bbnorm.
+    """
+    bases = read_stats["R1"]["bases"] + read_stats["R2"]["bases"]
+    coverage = bases / genome_size if genome_size > 0 else 0
+    policy = {"mode": "bbnorm", "coverage": coverage, "target_coverage": target_coverage, "sample_rate": 1}
+    if coverage <= target_coverage:
+        policy["mode"] = "passthrough"
+    elif coverage >= target_coverage * max_excess:
+        policy["mode"], policy["sample_rate"] = "subsample", target_coverage / coverage
+    return policy
+
+
+def writeNormalizationPolicy(sample, read_stats_file, policy_file, genome_size, target_coverage=100):
+    read_stats = readReadStats(read_stats_file)
+    if read_stats is None:
+        raise ValueError("Cannot read read statistics from {}.".format(read_stats_file))
+    policy = getNormalizationPolicy(read_stats, genome_size, target_coverage=target_coverage)
+    policy.update({"sample": sample, "genome_size": int(genome_size)})
+    with open(policy_file, "wt") as policy_out:
+        json.dump(policy, policy_out, indent=1)
+    return policy
+
+
+def readNormalizationPolicy(policy_file):
+    """Returns the normalization policy of a sample, or None if it has not been decided (yet)."""
+    try:
+        with open(policy_file) as policy_in:
+            policy = json.load(policy_in)
+    except (OSError, ValueError):
+        return None
+    return policy if policy.get("mode") in NORMALIZATION_MODES else None
+
+
+def getVerdictFile(qcdir, sample):
+    return join(qcdir, "gate", sample, sample + ".qc_verdict.json")
+
+
+def writeVerdict(sample, indir, verdict_file, readtype="bbnorm", min_tadpole_size=1e6):
+    """Evaluates a sample and stores the verdict. Returns (passed, qc_eval.tsv row)."""
+    passed, results, row = evaluateSample(sample, indir, readtype=readtype, min_tadpole_size=min_tadpole_size)
+    # replaced, not rewritten in place: the EvaluationCache only re-stats files in changed directories
+    tmp_file = verdict_file + ".tmp"
+    with open(tmp_file, "wt") as verdict_out:
+        json.dump(
+            {"sample": sample, "readtype": readtype, "min_tadpole_size": int(min_tadpole_size), "passed": passed, "row": row}, 
+            verdict_out
+        )
+    os.replace(tmp_file, verdict_file)
+    return passed, row
+
+
+def readVerdict(verdict_file, readtype="bbnorm", min_tadpole_size=1e6):
+    """Returns (passed, qc_eval.tsv row) of a stored verdict, or None if there is none for these settings."""
+    try:
+        with open(verdict_file) as verdict_in:
+            verdict = json.load(verdict_in)
+    except (OSError, ValueError):
+        return None
+    if verdict.get("readtype", None) != readtype or verdict.get("min_tadpole_size", None) != int(min_tadpole_size):
+        return None
+    return verdict["passed"], verdict["row"]
+
+
+def getPregateFile(qcdir, sample):
+    return join(qcdir, "gate", sample, sample + ".pregate.json")
+
+
+def writePregate(sample, indir, pregate_file, min_reads=1000):
+    """
+    Early survey gate on the preprocessed (bbduk) reads: normalization only removes reads,
+    hence a sample with fewer than min_reads cannot pass the read count test. Returns whether the sample passed.
+    """
+    result = test_fastqc_readcount(sample, min_reads=min_reads, readtype="bbduk", qcdir=join(indir, "qc"))
+    passed = not (result[1] == "FAIL" and result[2] == "LOW")
+    with open(pregate_file, "wt") as pregate_out:
+        json.dump({"sample": sample, "min_reads": min_reads, "passed": passed, "reads": result[3][0]}, pregate_out)
+    return passed
+
+
+def readPregate(pregate_file):
+    """Returns whether a sample passed the early survey gate, or None if it has not been gated."""
+    try:
+        with open(pregate_file) as pregate_in:
+            return json.load(pregate_in)["passed"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def writePregatePassSheet(input_sheet, qcdir, out_sheet):
+    """Writes the samples of input_sheet that did not fail the early survey gate. Returns the numbers of kept and excluded samples."""
+    sheet = Samplesheet(input_sheet)
+    failed = set(sample for sample in sheet if readPregate(getPregateFile(qcdir, sample)) is False)
+    with open(out_sheet, "wt") as sheet_out:
+        sheet.write(sheet_out, set(sheet).difference(failed))
+    return len(sheet) - len(failed), len(failed)
+
+
+def appendVerdict(report_dir, row, asm_row=None):
+    """
+    Appends a sample's verdict to the project qc_eval.tsv and, if it passed, its ASM row to samplesheet.qc_pass.tsv.
+    The tables grow while the survey is running and are rewritten in samplesheet order by main().
+    """
+    import fcntl
+    pathlib.Path(join(report_dir, "samplesheets")).mkdir(parents=True, exist_ok=True)
+    tables = [(join(report_dir, "qc_eval.tsv"), "\t", [row], getQCEvalHeader())]
+    if asm_row is not None:
+        tables.append((join(report_dir, "samplesheets", "samplesheet.qc_pass.tsv"), ",", [asm_row], tuple()))
+    for table, sep, rows, header in tables:
+        with open(table, "at") as table_out:
+            fcntl.flock(table_out, fcntl.LOCK_EX)
+            try:
+                if table_out.tell() == 0:
+                    rows = list(header) + rows
+                for _row in rows:
+                    print(*_row, sep=sep, file=table_out)
+                table_out.flush()
+            finally:
+                fcntl.flock(table_out, fcntl.LOCK_UN)
+
+
+EVAL_THREADS = 16
+EVAL_BATCH_SIZE = 256
+QC_EVAL_CACHE_VERSION = 2
+
+
+def getEvaluationInputs(sample, indir, readtype):
+    """All files the evaluation of a sample (verdict, tests, ASM samplesheet data) depends on."""
+    qcdir, qadir = join(indir, "qc"), join(indir, "qaa", "survey")
+    inputs = [getVerdictFile(qcdir, sample), getPregateFile(qcdir, sample), getNormalizationFile(qcdir, sample)]
+    for _readtype in ("bbduk", "bbnorm"):
+        inputs.append(getReadStatsFile(qcdir, sample, _readtype))
+        for mate in ("R1", "R2"):
+            inputs.append(join(qcdir, "fastqc", _readtype, sample, "{}_{}.{}_fastqc".format(sample, mate, _readtype), "fastqc_data.txt"))
+            inputs.append(join(qcdir, _readtype, sample, "{}_{}.{}.fastq.gz".format(sample, mate, _readtype)))
+    inputs.append(join(qcdir, "kat", sample, sample + ".dist_analysis.json"))
+    inputs.append(join(qcdir, "tadpole", sample, sample + "_tadpole_contigs.fasta"))
+    inputs.append(join(qadir, "quast", sample, "report.tsv"))
+    return inputs
+
+
+class EvaluationCache(object):
+    """
+    Per-sample evaluation results (passed, qc_eval.tsv row, ASM samplesheet data), keyed by the (mtime, size) of the
+    sample's input files. The inputs of all samples are verified at once by a StatCache, which is stored with the results:
+    each input directory is listed once and files are only re-stat'ed if their directory has changed.
+    Only samples whose inputs changed are re-evaluated, concurrently in batches.
+    """
+    def __init__(self, cache_file, readtype="bbnorm", min_tadpole_size=1e6, threads=EVAL_THREADS):
+        self.cache_file = cache_file
+        self.settings = [QC_EVAL_CACHE_VERSION, readtype, int(min_tadpole_size)]
+        self.readtype, self.min_tadpole_size = readtype, min_tadpole_size
+        self.threads = max(1, threads)
+        self.samples = dict()
+        self.stat_cache = StatCache(threads=threads)
+        try:
+            with open(cache_file) as cache_in:
+                data = json.load(cache_in)
+            if data.get("settings") == self.settings:
+                self.samples = data.get("samples", dict())
+                self.stat_cache.dirs, self.stat_cache.files = data.get("dirs", dict()), data.get("files", dict())
+        except (OSError, ValueError):
+            pass
+        self.n_evaluated = 0
+
+    def save(self):
+        if not self.n_evaluated and exists(self.cache_file):
+            return
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, "wt") as cache_out:
+            # json.dumps uses the C encoder, json.dump does not
+            cache_out.write(json.dumps({"settings": self.settings, "samples": self.samples, "dirs": self.stat_cache.dirs, "files": self.stat_cache.files}))
+        os.replace(tmp_file, self.cache_file)
+
+    def _evaluate_batch(self, samples, indir):
+        results = list()
+        for sample, key in samples:
+            # per-sample verdicts are written by the survey gate as soon as a sample's survey is done
+            verdict = readVerdict(getVerdictFile(join(indir, "qc"), sample), readtype=self.readtype, min_tadpole_size=self.min_tadpole_size)
+            if verdict is None:
+                passed, _, row = evaluateSample(sample, indir, readtype=self.readtype, min_tadpole_size=self.min_tadpole_size)
+            else:
+                passed, row = verdict
+            results.append((sample, {"key": key, "passed": passed, "row": row, "asm_data": getASMSampleData(sample, join(indir, "qc"))}))
+        return results
+
+    def evaluate(self, samples, indir):
+        """Returns (passed, qc_eval.tsv row, ASM samplesheet data) per sample, in the order of samples."""
+        samples = list(samples)
+        inputs = [getEvaluationInputs(sample, indir, self.readtype) for sample in samples]
+        self.stat_cache.verify(f for sample_inputs in inputs for f in sample_inputs)
+        keys = [[self.stat_cache.files.get(f) for f in sample_inputs] for sample_inputs in inputs]
+
+        # json round trip: stats are stored as lists
+        stale = [
+            (sample, key) for sample, key in zip(samples, json.loads(json.dumps(keys)))
+            if self.samples.get(sample, dict()).get("key") != key
+        ]
+        batches = [stale[i:i + EVAL_BATCH_SIZE] for i in range(0, len(stale), EVAL_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for results in pool.map(lambda batch: self._evaluate_batch(batch, indir), batches):
+                for sample, result in results:
+                    self.samples[sample] = result
+                    self.n_evaluated += 1
+
+        return [(self.samples[sample]["passed"], self.samples[sample]["row"], self.samples[sample]["asm_data"]) for sample in samples]
 
 
 def main(args_in=sys.argv[1:]):
@@ -285,6 +574,8 @@ def main(args_in=sys.argv[1:]):
     ap.add_argument("--readtype", type=str, choices=["bbnorm", "bbduk"], default="bbnorm")
     ap.add_argument("--report-dir", type=str, default="")
     ap.add_argument("--override_survey", action="store_true")
+    ap.add_argument("--merge", action="store_true", help="Only evaluate the samples in input and merge their records into the existing project reports.")
+    ap.add_argument("--threads", type=int, default=EVAL_THREADS, help="Number of samples evaluated concurrently. [{}]".format(EVAL_THREADS))
     args = ap.parse_args(args_in)
     
     print("Running qc:evaluation...", end="", flush=True)
@@ -296,77 +587,42 @@ def main(args_in=sys.argv[1:]):
     pathlib.Path(os.path.join(report_dir, "samplesheets")).mkdir(parents=True, exist_ok=True)
     
 
-    INPUTFILES = dict(readSamplesheet(args.input))
     SHEET = Samplesheet(args.input)
-    global QCDIR
-    # QCDIR  = join(args.indir, "Analysis", "qc")
-    QCDIR = join(args.indir, "qc")
-    global QADIR
-    QADIR = join(args.indir, "qaa", "survey")
 
     #Sample = namedtuple("Sample", "sampleID customerSampleID R1 R2 S taxonomyID taxonomyTxt fastqcR1 fastqcR2 fastqcS".split(" "))
     
     qc_eval_outf, asm_samplesheet_f = join(report_dir, "qc_eval.tsv"), join(report_dir, "samplesheets", "samplesheet.qc_pass.tsv")
+    if args.merge:
+        project_tables = qc_eval_outf, asm_samplesheet_f
+        qc_eval_outf, asm_samplesheet_f = join(report_dir, "qc_eval.increment.tsv"), join(report_dir, "samplesheets", "samplesheet.qc_pass.increment.tsv")
     with open(qc_eval_outf, "w") as qc_eval_out, open(asm_samplesheet_f, "w") as asm_samplesheet:
-        # print("SAMPLE", *tuple(test for test, testf, tdata in TESTS), sep="\t", file=qc_eval_out)
-
-        header = ["Sample", "Status"]
-        header2 = ["", ""]
-        # print("SAMPLE", end="\t", file=qc_eval_out)
-        for test, testf, tdata, _ in TESTS:
-            header.extend([test] + [""]*(len(tdata)-1))   
-            header2.extend(tdata)
-            # print(*((test,) + tuple([""]*len(tdata)) for test, testf, tdata in TESTS), sep="\t", file=qc_eval_out)
-        print(*header, sep="\t", file=qc_eval_out)
-        print(*header2, sep="\t", file=qc_eval_out)
-
-        # for sample in sorted(INPUTFILES):
+        for header in getQCEvalHeader():
+            print(*header, sep="\t", file=qc_eval_out)
+
         keepSamples = set()
-        for sample in SHEET:
-            results = list()
-            for test, testf, tdata, kwargs in TESTS:
-                if test == "FASTQC:READCOUNT":
-                    kwargs["readtype"] = args.readtype
-                elif test == "TADPOLE:SIZE":
-                    kwargs["min_size"] = args.min_tadpole_size
-                results.append(testf(sample, **kwargs))
-            # results = list(testf(sample, **kwargs) for test, testf, tdata, kwargs in TESTS)
-            passed = all(result[1] == "PASS" for result in results)
+        cache = EvaluationCache(join(report_dir, "qc_eval.cache.json"), readtype=args.readtype, min_tadpole_size=args.min_tadpole_size, threads=args.threads)
+        evaluation = cache.evaluate(SHEET, args.indir)
+        cache.save()
+        for sample, (passed, row, asm_data) in zip(SHEET, evaluation):
             if passed or args.override_survey:
-
-                # /tgac/data/reads/Jay_Hinton_GCRF_Salmonella_LITE/180524_K00287_0041_BHVMHLBBXX/FD01543206_PRO1620_plate92_H12_ACGCAGCAA-AGTCAA_L008_R1.fastq.gz
-                # /tgac/workarea/group-pb/schudomc_sandbox/bgrrl_test/Analysis_20180719/qc/bbduk/FD01543280_PRO1620_plate92_F03_GAGTATAAT-AGTCAA_L008/FD01543280_PRO1620_plate92_F03_GAGTATAAT-AGTCAA_L008_R1.bbduk.fastq.gz
-                trimdata = [join(QCDIR, "bbduk", SHEET[sample].sampleID, basename(SHEET[sample].R1).replace(".fastq.gz", ".bbduk.fastq.gz")),
-                            join(QCDIR, "bbduk", SHEET[sample].sampleID, basename(SHEET[sample].R2).replace(".fastq.gz", ".bbduk.fastq.gz")),
-                            ""]
-                normdata = [join(QCDIR, "bbnorm", SHEET[sample].sampleID, basename(SHEET[sample].R1).replace(".fastq.gz", ".bbnorm.fastq.gz")),
-                            join(QCDIR, "bbnorm", SHEET[sample].sampleID, basename(SHEET[sample].R2).replace(".fastq.gz", ".bbnorm.fastq.gz")),
-                            ""]
-                if not exists(normdata[0]) or not exists(normdata[1]):
-                    normdata = ["", "", ""]
-                # asmsample = sample2asmsample(INPUTFILES[sample], trimdata, normdata=normdata)
-                # print(asmsample, sep=",", file=asm_samplesheet)
-                SHEET[sample].upgrade(ASM_SAMPLE_FIELDS, trimdata + normdata)
+                SHEET[sample].upgrade(ASM_SAMPLE_FIELDS, asm_data)
                 keepSamples.add(sample)
-                #print(*INPUTFILES[sample], sep=",", file=asm_samplesheet)
-
-
-            elif results[0][1] == "FAIL" and results[0][2] == "MISSING" and results[2][1] == "PASS":
+            elif getTestResult(row, "FASTQC:READCOUNT") == ("FAIL", "MISSING") and getTestResult(row, "TADPOLE:SIZE")[0] == "PASS":
                 print("WARNING: sample {} has missing fastqc report(s), but passes survey assembly.".format(sample), file=sys.stderr)
 
-            # p_results = tuple(",".join(result) for result in results)
-            # print(p_results)
-            row = [sample, "PASS" if passed else "FAIL"]
-            for result in results:
-                row.extend(result[1:3] + result[3])
             print(*row, sep="\t", file=qc_eval_out)
-            # p_result = tuple("\t".join(map(str, result[1:])) for result in results)          
 
-            # print(sample, *p_result, sep="\t", file=qc_eval_out)
         SHEET.write(asm_samplesheet, keepSamples)
 
+    if args.merge:
+        # samples that were re-evaluated and failed are dropped from the project pass sheet
+        merge_records(qc_eval_outf, project_tables[0], header_lines=len(getQCEvalHeader()), delimiter="\t")
+        merge_records(asm_samplesheet_f, project_tables[1], drop=set(SHEET))
+        print(" Merged {} sample(s) into {} and {}.".format(len(SHEET), *project_tables), end="", flush=True)
+
+    update_metrics_store(report_dir, stages=["qc_eval"])
 
-    print(" Done.\n Generated qc_eval report in {} and asm-samplesheet in {}.".format(qc_eval_outf, asm_samplesheet_f))
+    print(" Done ({} of {} sample(s) (re-)evaluated).\n Generated qc_eval report in {} and asm-samplesheet in {}.".format(cache.n_evaluated, len(SHEET), qc_eval_outf, asm_samplesheet_f))
 
     return True
 
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import gzip
+import shutil
+import argparse
+import subprocess
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+
+@contextmanager
+def openReads(fn, threads=1):
+	"""
+	Opens a (gzipped) FASTQ file for binary reading. Gzipped files are decompressed by a pigz/gzip process,
+	so that both mates of a pair are decompressed in parallel to the parsing.
+	"""
+	decompressor = shutil.which("pigz") or shutil.which("gzip")
+	if not fn.endswith(".gz") or not decompressor:
+		with (gzip.open if fn.endswith(".gz") else open)(fn, "rb") as _in:
+			yield _in
+		return
+	cmd = [decompressor, "-dc", fn] + (["-p", str(max(1, threads))] if decompressor.endswith("pigz") else [])
+	proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=2**20)
+	try:
+		yield proc.stdout
+	finally:
+		proc.stdout.close()
+		returncode = proc.wait()
+	if returncode != 0:
+		raise ValueError("Could not decompress {} ({} exited with {}).".format(fn, cmd[0], returncode))
+
+
+def readFastq(_in):
+	"""Yields (name, sequence length, quality sum, number of G/C bases) per record."""
+	while True:
+		header = _in.readline()
+		if not header:
+			return
+		seq, _, qual = _in.readline(), _in.readline(), _in.readline()
+		seq, qual = seq.rstrip(b"\r\n"), qual.rstrip(b"\r\n")
+		yield header[1:].split()[0] if header.strip() else b"", len(seq), sum(qual) - 33 * len(qual), seq.count(b"G") + seq.count(b"C")
+
+
+def getPairName(name):
+	return name[:-2] if name[-2:] in (b"/1", b"/2") else name
+
+
+class MateStats:
+	def __init__(self):
+		self.reads, self.bases, self.qual_sum, self.gc_bases = 0, 0, 0, 0
+		self.lengths = Counter()
+
+	def add(self, length, qual_sum, gc_bases):
+		self.reads += 1
+		self.bases += length
+		self.qual_sum += qual_sum
+		self.gc_bases += gc_bases
+		self.lengths[length] += 1
+
+	def toDict(self):
+		return {
+			"reads": self.reads,
+			"bases": self.bases,
+			"gc_bases": self.gc_bases,
+			"min_length": min(self.lengths) if self.lengths else 0,
+			"max_length": max(self.lengths) if self.lengths else 0,
+			"mean_length": self.bases / self.reads if self.reads else 0,
+			"mean_quality": self.qual_sum / self.bases if self.bases else 0,
+			"length_distribution": {str(length): count for length, count in sorted(self.lengths.items())}
+		}
+
+
+def computeReadStats(r1, r2, threads=2):
+	"""
+	Computes read counts, length distributions, mean (Phred+33) quality and G/C bases of both mates
+	and the pair consistency (same number of reads, matching read names) in a single pass over the read pair.
+	"""
+	stats = MateStats(), MateStats()
+	name_mismatches = 0
+	with ExitStack() as stack:
+		mates = [readFastq(stack.enter_context(openReads(fn, threads=max(1, threads // 2)))) for fn in (r1, r2)]
+		sentinel = (None, 0, 0, 0)
+		while True:
+			rec1, rec2 = next(mates[0], sentinel), next(mates[1], sentinel)
+			if rec1 is sentinel and rec2 is sentinel:
+				break
+			if rec1 is not sentinel:
+				stats[0].add(*rec1[1:])
+			if rec2 is not sentinel:
+				stats[1].add(*rec2[1:])
+			if rec1 is not sentinel and rec2 is not sentinel and getPairName(rec1[0]) != getPairName(rec2[0]):
+				name_mismatches += 1
+
+	r1_stats, r2_stats = stats[0].toDict(), stats[1].toDict()
+	return {
+		"R1": r1_stats,
+		"R2": r2_stats,
+		"pairs": {
+			"consistent": r1_stats["reads"] == r2_stats["reads"] and name_mismatches == 0,
+			"unpaired": abs(r1_stats["reads"] - r2_stats["reads"]),
+			"name_mismatches": name_mismatches
+		}
+	}
+
+
+def readReadStats(fn):
+	"""Returns the read statistics written by read_stats, or None if there are none."""
+	try:
+		with open(fn) as _in:
+			return json.load(_in)
+	except (OSError, ValueError):
+		return None
+
+
+def getSampleRate(read_stats, target_coverage, genome_size, min_excess=2.0):
+	"""
+	Returns the fraction of read pairs needed for target_coverage of a genome of genome_size (bp),
+	or 1 if the estimated coverage (read bases / genome size) does not exceed the target by at least min_excess.
+	"""
+	bases = read_stats["R1"]["bases"] + read_stats["R2"]["bases"]
+	coverage = bases / genome_size if genome_size > 0 else 0
+	if target_coverage <= 0 or coverage < target_coverage * min_excess:
+		return 1
+	return target_coverage / coverage
+
+
+def main(args_in=sys.argv[1:]):
+	ap = argparse.ArgumentParser(description="Computes read counts, length distribution, mean quality and pair consistency of a (gzipped) FASTQ read pair.")
+	ap.add_argument("r1", type=str, nargs="?")
+	ap.add_argument("r2", type=str, nargs="?")
+	ap.add_argument("--output", "-o", type=str, default="", help="Write statistics (JSON) to this file. [stdout]")
+	ap.add_argument("--threads", "-t", type=int, default=2, help="Number of decompression threads. [2]")
+	ap.add_argument("--sample-rate", type=str, default="", help="Instead of computing statistics, print the subsampling rate for --target-coverage from this read statistics file.")
+	ap.add_argument("--target-coverage", type=float, default=40, help="Target coverage for --sample-rate. [40]")
+	ap.add_argument("--genome-size", type=float, default=5e6, help="Expected genome size (bp) for --sample-rate. [5000000]")
+	args = ap.parse_args(args_in)
+
+	if args.sample_rate:
+		read_stats = readReadStats(args.sample_rate)
+		if read_stats is None:
+			raise ValueError("Cannot read read statistics from {}.".format(args.sample_rate))
+		rate = getSampleRate(read_stats, args.target_coverage, args.genome_size)
+		print(1 if rate == 1 else "{:.6f}".format(rate))
+		return
+
+	if not args.r1 or not args.r2:
+		raise ValueError("Missing read files.")
+	for fn in (args.r1, args.r2):
+		if not os.path.exists(fn):
+			raise ValueError("Read file {} does not exist.".format(fn))
+
+	stats = computeReadStats(args.r1, args.r2, threads=args.threads)
+	if args.output:
+		tmp_out = args.output + ".tmp"
+		with open(tmp_out, "wt") as stats_out:
+			json.dump(stats, stats_out, indent=1)
+		os.replace(tmp_out, args.output)
+	else:
+		json.dump(stats, sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+import sys
+import os
+from os.path import join, basename, exists
+import re
+import glob
+import json
+import math
+import argparse
+from collections import OrderedDict, namedtuple
+
+# rule logs are named <sample>.<rule>.log or <sample>_<rule>.log (mate-specific logs: <sample>_<mate>.<rule>.log)
+RULE_LOG = re.compile(r"^(?P<sample>.+?)(?:_R[12])?[._](?P<rule>(?:qc|asm|ann)_[A-Za-z0-9_]+)\.log$")
+MAX_RSS = re.compile(r"Maximum resident set size \(kbytes\): (?P<rss>\d+)")
+WALL_TIME = re.compile(r"Elapsed \(wall clock\) time \(h:mm:ss or m:ss\): (?P<time>[0-9:.]+)")
+
+DEFAULT_PARTITIONS = "ei-short=2:00:00,ei-medium=24:00:00,ei-long=168:00:00"
+
+Measurement = namedtuple("Measurement", "rule sample input_size max_rss_mb wall_time_s".split(" "))
+Profile = namedtuple("Profile", "rule n intercept_mb slope_mb memory_mb intercept_s slope_s time_s partition".split(" "))
+
+
+def parseTime(time_str):
+	seconds = 0.0
+	for field in time_str.split(":"):
+		seconds = seconds * 60 + float(field)
+	return seconds
+
+
+def formatTime(seconds):
+	seconds = int(math.ceil(seconds))
+	return "{}:{:02d}:{:02d}".format(seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+
+def parseTimeLog(log_file):
+	"""
+	Returns the peak RSS (MB) and the wall time (s) reported by /usr/bin/time -v in log_file.
+	Logs with several reports (e.g. retried commands) are combined by taking the peak RSS and the total wall time.
+	"""
+	max_rss, wall_time, found = 0, 0.0, False
+	with open(log_file, errors="replace") as log_in:
+		for line in log_in:
+			match = MAX_RSS.search(line)
+			if match:
+				max_rss, found = max(max_rss, int(match.group("rss"))), True
+				continue
+			match = WALL_TIME.search(line)
+			if match:
+				wall_time += parseTime(match.group("time"))
+	return (max_rss / 1024, wall_time) if found else None
+
+
+def getInputSizes(run_dir):
+	"""
+	Uses the size of the preprocessed (bbduk) reads of each sample as proxy for the input size of all its jobs.
+	Returns a dictionary sample -> input size (bytes).
+	"""
+	sizes = dict()
+	for sample_dir in glob.glob(join(run_dir, "qc", "bbduk", "*")):
+		sizes[basename(sample_dir)] = sum(os.path.getsize(f) for f in glob.glob(join(sample_dir, "*.fastq.gz")))
+	return sizes
+
+
+def collectMeasurements(run_dir):
+	sizes = getInputSizes(run_dir)
+	for cdir, dirs, files in os.walk(run_dir):
+		# hpc logs and shard copies of the project do not contain rule logs
+		dirs[:] = [d for d in dirs if d not in ("hpc_logs", "shards", ".snakemake")]
+		for f in files:
+			match = RULE_LOG.match(f)
+			if not match or match.group("sample") not in sizes:
+				continue
+			usage = parseTimeLog(join(cdir, f))
+			if usage is not None:
+				yield Measurement(match.group("rule"), match.group("sample"), sizes[match.group("sample")], *usage)
+
+
+def fitLinear(x, y):
+	"""Least squares fit y = a + b * x. Returns (a, b)."""
+	n = len(x)
+	mean_x, mean_y = sum(x) / n, sum(y) / n
+	var_x = sum((xi - mean_x) ** 2 for xi in x)
+	if var_x == 0:
+		return mean_y, 0.0
+	slope = sum((xi - mean_x) * (yi - mean_y) for xi, yi in zip(x, y)) / var_x
+	if slope < 0:
+		# resource usage does not shrink with larger inputs
+		return mean_y, 0.0
+	return mean_y - slope * mean_x, slope
+
+
+def selectPartition(time_s, partitions):
+	for partition, max_time in sorted(partitions.items(), key=lambda x:x[1]):
+		if time_s <= max_time:
+			return partition
+	return None
+
+
+def profileRule(rule, measurements, partitions, target_size=None, margin=1.25, min_memory=1000):
+	"""
+	Fits peak memory and wall time of a rule's jobs against their input size and
+	derives the requirements for an input of target_size (default: the largest observed input).
+	Requirements are never below the observed maxima and are increased by margin.
+	"""
+	sizes = [m.input_size for m in measurements]
+	target_size = max(sizes) if target_size is None else target_size
+	mem_a, mem_b = fitLinear(sizes, [m.max_rss_mb for m in measurements])
+	time_a, time_b = fitLinear(sizes, [m.wall_time_s for m in measurements])
+
+	memory = max(mem_a + mem_b * target_size, max(m.max_rss_mb for m in measurements)) * margin
+	memory = max(min_memory, int(math.ceil(memory / 1000)) * 1000)
+	time_s = max(time_a + time_b * target_size, max(m.wall_time_s for m in measurements)) * margin
+	time_s = max(600, int(math.ceil(time_s / 600)) * 600)
+
+	return Profile(rule, len(measurements), mem_a, mem_b, memory, time_a, time_b, time_s, selectPartition(time_s, partitions))
+
+
+def parsePartitions(partition_str):
+	partitions = dict()
+	for item in partition_str.split(","):
+		if item:
+			try:
+				partition, max_time = item.split("=")
+				partitions[partition] = parseTime(max_time)
+			except ValueError:
+				raise ValueError("Invalid partition specification {}. Expected <partition>=<max. walltime, e.g. 24:00:00>.".format(item))
+	return partitions
+
+
+def writeProfiles(profiles, out=sys.stdout):
+	print("Rule", "#Jobs", "Memory[MB] intercept", "Memory[MB/GB input]", "Memory[MB]", "Time[s] intercept", "Time[s/GB input]", "Time", "Partition", sep="\t", file=out)
+	for p in profiles:
+		print(
+			p.rule, p.n,
+			"{:.0f}".format(p.intercept_mb), "{:.1f}".format(p.slope_mb * 2**30), p.memory_mb,
+			"{:.0f}".format(p.intercept_s), "{:.1f}".format(p.slope_s * 2**30), formatTime(p.time_s),
+			p.partition if p.partition else "n/a",
+			sep="\t", file=out
+		)
+
+
+def main(args_in=sys.argv[1:]):
+	ap = argparse.ArgumentParser(description="Learns per-rule resource requirements from the /usr/bin/time -v output in the logs of previous runs and generates a tuned hpc configuration.")
+	ap.add_argument("run_dirs", type=str, nargs="+", help="Output directories of previous bgrr| runs.")
+	ap.add_argument("--hpc-config", type=str, required=True, help="hpc configuration to be tuned.")
+	ap.add_argument("--output", "-o", type=str, default="hpc_config.tuned.json", help="Tuned hpc configuration. [hpc_config.tuned.json]")
+	ap.add_argument("--report", type=str, default="", help="Write the per-rule profiles to this file. [stdout]")
+	ap.add_argument("--partitions", type=str, default=DEFAULT_PARTITIONS, help="Comma-separated list of partitions and their maximum walltime. [{}]".format(DEFAULT_PARTITIONS))
+	ap.add_argument("--max-input-size", type=float, default=0, help="Size of the largest expected input (preprocessed reads, in GB). [largest observed input]")
+	ap.add_argument("--margin", type=float, default=1.25, help="Safety margin applied to the predicted requirements. [1.25]")
+	ap.add_argument("--min-jobs", type=int, default=5, help="Only tune rules with at least this many observed jobs. [5]")
+	args = ap.parse_args(args_in)
+
+	partitions = parsePartitions(args.partitions)
+	with open(args.hpc_config) as hpc_in:
+		hpc_config = json.load(hpc_in, object_pairs_hook=OrderedDict)
+
+	measurements = OrderedDict()
+	for run_dir in args.run_dirs:
+		if not exists(run_dir):
+			raise ValueError("Run directory {} does not exist.".format(run_dir))
+		for m in collectMeasurements(run_dir):
+			measurements.setdefault(m.rule, list()).append(m)
+
+	target_size = args.max_input_size * 2**30 if args.max_input_size > 0 else None
+	profiles = [
+		profileRule(rule, rule_measurements, partitions, target_size=target_size, margin=args.margin)
+		for rule, rule_measurements in sorted(measurements.items())
+		if len(rule_measurements) >= args.min_jobs
+	]
+	if not profiles:
+		print("No rule has at least {} jobs with /usr/bin/time -v output. Please check that config['tools']['time'] is set to '/usr/bin/time -v'.".format(args.min_jobs), file=sys.stderr)
+		sys.exit(1)
+
+	for p in profiles:
+		rule_cfg = hpc_config.setdefault(p.rule, OrderedDict())
+		rule_cfg["memory"] = str(p.memory_mb)
+		rule_cfg["time"] = formatTime(p.time_s)
+		if p.partition is not None:
+			rule_cfg["partition"] = p.partition
+		else:
+			print("WARNING: {} requires {}, which exceeds the walltime limits of all partitions.".format(p.rule, formatTime(p.time_s)), file=sys.stderr)
+
+	with open(args.output, "wt") as hpc_out:
+		json.dump(hpc_config, hpc_out, indent=2)
+
+	if args.report:
+		with open(args.report, "wt") as report_out:
+			writeProfiles(profiles, out=report_out)
+	else:
+		writeProfiles(profiles)
+
+	print("Tuned hpc configuration for {} rules written to {}.".format(len(profiles), args.output), file=sys.stderr)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+import sys
+import os
+from os.path import join, exists
+import glob
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+import subprocess
+
+try:
+	from .cluster_status import StatusCache, getJobId
+except ImportError:
+	from cluster_status import StatusCache, getJobId
+
+# snakemake calls this script once per submitted job (cluster submission command) and once per job status check.
+# It is therefore executed by path and must not import bgrrl (or anything else outside the standard library).
+
+ARRAY_WAIT = 10
+DISPATCH_INTERVAL = 2
+MAX_ARRAY_SIZE = 1000
+
+# each array task runs the snakemake job script in the corresponding line of the array's manifest
+DISPATCH_SCRIPT = """#!/bin/sh
+exec sh "$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" "$1")"
+"""
+
+
+def writeAtomic(f, content):
+	tmp_f = "{}.{}.tmp".format(f, uuid.uuid4().hex)
+	with open(tmp_f, "wt") as _out:
+		_out.write(content)
+	os.replace(tmp_f, f)
+
+
+def getResourceClass(options):
+	"""Jobs with identical submission options (rule, threads, memory, partition, time) share a resource class."""
+	return hashlib.md5("\0".join(options).encode()).hexdigest()[:16]
+
+
+def submitJob(spool_dir, options, jobscript):
+	"""
+	Queues jobscript in its resource class for submission as part of a job array.
+	Returns the (bgrrl) job id, which is later resolved to the array task by getJobStatus.
+	"""
+	resource_class = getResourceClass(options)
+	class_dir = join(spool_dir, resource_class)
+	for subdir in ("queue", "tasks"):
+		os.makedirs(join(class_dir, subdir), exist_ok=True)
+	if not exists(join(class_dir, "options.json")):
+		writeAtomic(join(class_dir, "options.json"), json.dumps(options))
+
+	job_id = "{}.{}".format(resource_class, uuid.uuid4().hex[:16])
+	writeAtomic(join(class_dir, "queue", job_id), os.path.abspath(jobscript))
+	return job_id
+
+
+def getJobStatus(spool_dir, job_id):
+	"""
+	Returns the job status expected by snakemake: success, failed or running.
+	The states of all submitted array tasks are queried together and cached (see cluster_status.StatusCache).
+	"""
+	resource_class = job_id.split(".")[0]
+	task_f = join(spool_dir, resource_class, "tasks", job_id)
+	if exists(task_f):
+		task_id = open(task_f).read().strip()
+		if task_id == "failed":
+			return "failed"
+		with StatusCache(spool_dir, "SLURM") as cache:
+			return cache.get_status(task_id)
+	if exists(join(spool_dir, resource_class, "queue", job_id)):
+		return "running"
+	return "failed"
+
+
+class ArrayDispatcher(threading.Thread):
+	"""
+	Submits the queued jobs of each resource class as a single SLURM array once the array is full (array_size)
+	or its oldest job has been waiting for wait seconds. The array task of each job is recorded for getJobStatus.
+	"""
+	def __init__(self, spool_dir, sub_cmd="sbatch", array_size=MAX_ARRAY_SIZE, wait=ARRAY_WAIT, interval=DISPATCH_INTERVAL):
+		super().__init__(daemon=True)
+		self.spool_dir = spool_dir
+		self.sub_cmd = sub_cmd
+		self.array_size = max(1, min(array_size, MAX_ARRAY_SIZE))
+		self.wait = wait
+		self.interval = interval
+		self.stopped = threading.Event()
+		self.dispatch_script = join(spool_dir, "dispatch.sh")
+		os.makedirs(spool_dir, exist_ok=True)
+		writeAtomic(self.dispatch_script, DISPATCH_SCRIPT)
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			self.dispatch()
+
+	def stop(self):
+		self.stopped.set()
+		self.join()
+
+	def dispatch(self):
+		for class_dir in glob.glob(join(self.spool_dir, "*", "")):
+			queue_dir = join(class_dir, "queue")
+			queued = sorted(
+				(os.path.getmtime(join(queue_dir, job_id)), job_id)
+				for job_id in os.listdir(queue_dir)
+				if not job_id.endswith(".tmp")
+			) if exists(queue_dir) else list()
+			now = time.time()
+			for i in range(0, len(queued), self.array_size):
+				chunk = queued[i:i + self.array_size]
+				# incomplete arrays keep collecting jobs until their oldest job has waited long enough
+				if len(chunk) == self.array_size or now - chunk[0][0] >= self.wait:
+					self.submitArray(class_dir, [job_id for _, job_id in chunk])
+
+	def submitArray(self, class_dir, job_ids):
+		queue_dir, tasks_dir = join(class_dir, "queue"), join(class_dir, "tasks")
+		options = json.load(open(join(class_dir, "options.json")))
+		manifest = join(class_dir, "array_{}.txt".format(uuid.uuid4().hex[:16]))
+		writeAtomic(manifest, "".join(open(join(queue_dir, job_id)).read() + "\n" for job_id in job_ids))
+
+		cmd = [self.sub_cmd, "--parsable", "--array=0-{}".format(len(job_ids) - 1)] + options + [self.dispatch_script, manifest]
+		try:
+			array_id = getJobId(subprocess.check_output(cmd).decode(), "SLURM")
+		except (OSError, ValueError, subprocess.CalledProcessError) as e:
+			print("Submission of job array ({} jobs) failed: {}".format(len(job_ids), e), file=sys.stderr)
+			array_id = None
+
+		if array_id:
+			with StatusCache(self.spool_dir, "SLURM") as cache:
+				cache.register(["{}_{}".format(array_id, task) for task in range(len(job_ids))])
+
+		# task records have to exist before the queue entries are removed, otherwise a status check could miss the job
+		for task, job_id in enumerate(job_ids):
+			writeAtomic(join(tasks_dir, job_id), "{}_{}".format(array_id, task) if array_id else "failed")
+			os.remove(join(queue_dir, job_id))
+
+
+def main(args_in=sys.argv[1:]):
+	ap = argparse.ArgumentParser(description="Submission and status commands for running snakemake jobs as SLURM job arrays.")
+	subparsers = ap.add_subparsers(dest="command")
+	submit_parser = subparsers.add_parser("submit", help="Queue a snakemake job script for array submission. Prints the job id.")
+	submit_parser.add_argument("spool_dir", type=str)
+	submit_parser.add_argument("sbatch_args", nargs=argparse.REMAINDER, help="sbatch options followed by the job script.")
+	status_parser = subparsers.add_parser("status", help="Print the status (success, failed, running) of a job.")
+	status_parser.add_argument("spool_dir", type=str)
+	status_parser.add_argument("job_id", type=str)
+	args = ap.parse_args(args_in)
+
+	if args.command == "submit":
+		if not args.sbatch_args:
+			raise ValueError("Missing job script.")
+		print(submitJob(args.spool_dir, args.sbatch_args[:-1], args.sbatch_args[-1]))
+	elif args.command == "status":
+		print(getJobStatus(args.spool_dir, args.job_id))
+	else:
+		ap.print_help()
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -4,12 +4,21 @@ import argparse
 import subprocess
 import shutil
 import pathlib
+import signal
+import time
 
 ACTIVATE_ASM_ENV = "source activate bgasm_env" 
 
+SPADES_MEM_GB = 64
+# racing stages need at least this share of the allocation each
+MIN_STAGE_THREADS = 4
+MIN_STAGE_MEM_MB = 16000
+RACE_POLL_INTERVAL = 10
+
+
 class ASM_Wrapper(object):
 	def __init__(self, args):
-		# self.assembler = args.assembler
+		# self.assembler = args.assembler
 		def check_reads(reads):
 			return not reads or os.path.exists(reads)
 
@@ -29,21 +38,46 @@ class ASM_Wrapper(object):
 		
 		self.outdir = args.outdir
 		self.threads = args.threads
+		self.race = getattr(args, "race", 1)
+		self.mem_mb = getattr(args, "mem_mb", 0)
+
+	def get_race_width(self):
+		"""Number of stages that can run concurrently, such that each stage gets at least MIN_STAGE_THREADS and MIN_STAGE_MEM_MB."""
+		width = min(self.race, len(self.fallback_queue), self.threads // MIN_STAGE_THREADS)
+		if self.mem_mb:
+			width = min(width, self.mem_mb // MIN_STAGE_MEM_MB)
+		return max(1, width)
 
+	def get_stage_cmd(self, cmd, params, outdir, width=1):
+		"""Stage commands are templates for the stage's output directory and its share of threads and memory."""
+		mem_gb = min(SPADES_MEM_GB, self.mem_mb // width // 1000) if self.mem_mb else SPADES_MEM_GB
+		return cmd.format(outdir=outdir, threads=max(1, self.threads // width), mem_gb=mem_gb, **params)
+
+	def record_assembly(self, step):
+		open(os.path.join(self.outdir, step), "wt").close()
 
 	def run(self, env="bgasm_env"):
 		self.fallback_queue = [item for item in self.fallback_queue if not item is None]
 
-		assembly_complete = False
-		# conda_cmd = "source deactivate && source activate {} && ".format(env)
+		if self.get_race_width() > 1:
+			assembly_complete = self.run_race(self.get_race_width())
+		else:
+			assembly_complete = self.run_sequential(env=env)
+
+		if not assembly_complete:
+			pathlib.Path(self.outdir).mkdir(parents=True, exist_ok=True)
+			open(os.path.join(self.outdir, "assembly.fasta"), "wt").close()		
+
+	def run_sequential(self, env="bgasm_env"):
+		# conda_cmd = "source deactivate && source activate {} && ".format(env)
 		conda_cmd = ""
 		
 		while self.fallback_queue:
-			step, cmd = self.fallback_queue.pop(0)
+			step, cmd, params = self.fallback_queue.pop(0)
 			print("BGRR|_ASM_WRAPPER::" + step)
 			
 			try:
-				out = subprocess.check_output(conda_cmd + cmd, stderr=subprocess.STDOUT, shell=True)
+				out = subprocess.check_output(conda_cmd + self.get_stage_cmd(cmd, params, self.outdir), stderr=subprocess.STDOUT, shell=True)
 			except subprocess.CalledProcessError as err:
 				print(err, flush=True)
 				print("Stage: {} failed.".format(step), flush=True)
@@ -52,13 +86,83 @@ class ASM_Wrapper(object):
 
 			print(out)
 
-			open(os.path.join(self.outdir, step), "wt").close()
-			assembly_complete = True
-			break
-
-		if not assembly_complete:
-			pathlib.Path(self.outdir).mkdir(parents=True, exist_ok=True)
-			open(os.path.join(self.outdir, "assembly.fasta"), "wt").close()		
+			self.record_assembly(step)
+			return True
+
+		return False
+
+	def run_race(self, width):
+		"""
+		Runs up to width stages concurrently, each in its own work directory (outdir/race/<stage>) with an equal share of
+		threads and memory. Stages are started in priority order as slots become free. The first successful stage in priority
+		order (i.e. all stages before it have failed) wins: its output is moved into outdir and all other stages are cancelled.
+		"""
+		race_dir = os.path.join(self.outdir, "race")
+		pending, running, results = list(enumerate(self.fallback_queue)), dict(), dict()
+		winner = None
+		print("BGRR|_ASM_WRAPPER::race ({} concurrent stages)".format(width), flush=True)
+
+		def terminate(signum, frame):
+			# the stages run in their own sessions and would outlive the wrapper (e.g. a cancelled job)
+			raise SystemExit(128 + signum)
+
+		previous_handler = signal.signal(signal.SIGTERM, terminate)
+		try:
+			while winner is None and (pending or running):
+				# stages after a successful stage cannot win anymore
+				first_success = min((i for i, success in results.items() if success), default=len(self.fallback_queue))
+				while pending and len(running) < width and pending[0][0] < first_success:
+					i, (step, cmd, params) = pending.pop(0)
+					workdir = os.path.join(race_dir, step)
+					shutil.rmtree(workdir, ignore_errors=True)
+					pathlib.Path(workdir).mkdir(parents=True, exist_ok=True)
+					print("BGRR|_ASM_WRAPPER::" + step, flush=True)
+					log = open(os.path.join(race_dir, step + ".log"), "wb")
+					proc = subprocess.Popen(self.get_stage_cmd(cmd, params, workdir, width=width), stdout=log, stderr=subprocess.STDOUT, shell=True, start_new_session=True)
+					running[i] = step, proc, log
+
+				time.sleep(RACE_POLL_INTERVAL)
+
+				for i, (step, proc, log) in list(running.items()):
+					if proc.poll() is not None:
+						log.close()
+						print(open(log.name, "rb").read())
+						results[i] = proc.returncode == 0
+						if not results[i]:
+							print("Stage: {} failed (exit status {}).".format(step, proc.returncode), flush=True)
+							shutil.rmtree(os.path.join(race_dir, step), ignore_errors=True)
+						del running[i]
+
+				for i in range(len(self.fallback_queue)):
+					if i not in results:
+						break
+					if results[i]:
+						winner = i
+						break
+		finally:
+			signal.signal(signal.SIGTERM, previous_handler)
+			for i, (step, proc, log) in running.items():
+				print("Stage: {} cancelled.".format(step), flush=True)
+				try:
+					os.killpg(proc.pid, signal.SIGTERM)
+				except ProcessLookupError:
+					pass
+				proc.wait()
+				log.close()
+
+		if winner is not None:
+			step = self.fallback_queue[winner][0]
+			workdir = os.path.join(race_dir, step)
+			for f in os.listdir(workdir):
+				target = os.path.join(self.outdir, f)
+				# leftovers of previous runs
+				if os.path.isdir(target) and not os.path.islink(target):
+					shutil.rmtree(target)
+				os.replace(os.path.join(workdir, f), target)
+			self.record_assembly(step)
+		shutil.rmtree(race_dir, ignore_errors=True)
+
+		return winner is not None
 
 
 
@@ -72,32 +176,29 @@ class VelvetWrapper(ASM_Wrapper):
 	def __init__(self, args):
 		super().__init__(args)
 		
-		tmpdir = os.path.join(self.outdir, "tmp")
-		pathlib.Path(tmpdir).mkdir(parents=True, exist_ok=True)
-
 		cwd = os.getcwd()
 
 		singularity_prefix = ("singularity exec " + args.singularity_container + " ") if args.singularity_container else ""
 
-		cmd = "cd {0}" + \
+		cmd = "mkdir -p {outdir}/tmp" + \
+			" && cd {outdir}/tmp" + \
 			" && " + singularity_prefix + \
-			"VelvetOptimiser.pl -v -s 19 -e 191 -x 2 -t {1} -d ../velvet_assembly -f '-shortPaired -fastq.gz -separate {2} {3}'" + \
+			"VelvetOptimiser.pl -v -s 19 -e 191 -x 2 -t {threads} -d ../velvet_assembly -f '-shortPaired -fastq.gz -separate {r1} {r2}'" + \
 			" && cd .." + \
 			" && mv -v velvet_assembly/* ." + \
 			" && rm -rf velvet_assembly/ tmp/" + \
 			" && ln -s contigs.fa assembly.fasta" + \
-			" && cd {4}"
+			" && cd {cwd}"
 	
 		if not (self.fb_reads_r1 and self.fb_reads_r2):
 			self.fallback_queue = [
 				(
 					"asm_main_vet", 
-					cmd.format(
-						tmpdir, 
-						self.threads, 
-						os.path.join(cwd, self.reads_r1), 
-						os.path.join(cwd, self.reads_r2), 
-						cwd
+					cmd,
+					dict(
+						r1=os.path.join(cwd, self.reads_r1), 
+						r2=os.path.join(cwd, self.reads_r2), 
+						cwd=cwd
 					)
 				)
 			]
@@ -105,22 +206,20 @@ class VelvetWrapper(ASM_Wrapper):
 			self.fallback_queue = [
 				(
 					"asm_main_ven", 
-					cmd.format(
-						tmpdir, 
-						self.threads, 
-						os.path.join(cwd, self.reads_r1), 
-						os.path.join(cwd, self.reads_r2), 
-						cwd
+					cmd,
+					dict(
+						r1=os.path.join(cwd, self.reads_r1), 
+						r2=os.path.join(cwd, self.reads_r2), 
+						cwd=cwd
 					)
 				),
 				(
 					"asm_fb1_vet", 
-					cmd.format(
-						tmpdir, 
-						self.threads, 
-						os.path.join(cwd, self.fb_reads_r1), 
-						os.path.join(cwd, self.fb_reads_r2), 
-						cwd
+					cmd,
+					dict(
+						r1=os.path.join(cwd, self.fb_reads_r1), 
+						r2=os.path.join(cwd, self.fb_reads_r2), 
+						cwd=cwd
 					)
 				)
 			]
@@ -134,8 +233,8 @@ class UnicyclerWrapper(ASM_Wrapper):
 
 		singularity_prefix = ("singularity exec " + args.singularity_container + " ") if args.singularity_container else ""
 
-		unicycler_cmd = singularity_prefix + "unicycler -1 {0} -2 {1} -t {2} -o {3} {4}"
-		spades_cmd = singularity_prefix + "spades.py -1 {0} -2 {1} -t {2} -o {3} -m 64 {4} && ln -s scaffolds.fasta {3}/assembly.fasta" 
+		unicycler_cmd = singularity_prefix + "unicycler -1 {r1} -2 {r2} -t {threads} -o {outdir} {params}"
+		spades_cmd = singularity_prefix + "spades.py -1 {r1} -2 {r2} -t {threads} -o {outdir} -m {mem_gb} {params} && ln -s scaffolds.fasta {outdir}/assembly.fasta" 
 
 
 		self.fallback_queue = list()
@@ -143,66 +242,36 @@ class UnicyclerWrapper(ASM_Wrapper):
 			self.fallback_queue = [
 				(
 					"asm_main_uct", 
-					unicycler_cmd.format(
-						self.reads_r1, 
-						self.reads_r2, 
-						self.threads, 
-						self.outdir, 
-						unicycler_params
-					)
+					unicycler_cmd,
+					dict(r1=self.reads_r1, r2=self.reads_r2, params=unicycler_params)
 				),
 				(
 					"asm_fb1_spt", 
-					spades_cmd.format(
-						self.reads_r1, 
-						self.reads_r2, 
-						self.threads, 
-						self.outdir, 
-						spades_params
-					)
+					spades_cmd,
+					dict(r1=self.reads_r1, r2=self.reads_r2, params=spades_params)
 				)
 			]
 		else:
 			self.fallback_queue = [
 				(
 					"asm_main_ucn", 
-					unicycler_cmd.format(
-						self.reads_r1, 
-						self.reads_r2, 
-						self.threads, 
-						self.outdir, 
-						unicycler_params
-					)
+					unicycler_cmd,
+					dict(r1=self.reads_r1, r2=self.reads_r2, params=unicycler_params)
 				),
 				(
 					"asm_fb1_uct", 
-					unicycler_cmd.format(
-						self.fb_reads_r1, 
-						self.fb_reads_r2, 
-						self.threads, 
-						self.outdir, 
-						unicycler_params
-					)
+					unicycler_cmd,
+					dict(r1=self.fb_reads_r1, r2=self.fb_reads_r2, params=unicycler_params)
 				),
 				(
 					"asm_fb2_spn", 
-					spades_cmd.format(
-						self.reads_r1, 
-						self.reads_r2, 
-						self.threads, 
-						self.outdir, 
-						spades_params
-					)
+					spades_cmd,
+					dict(r1=self.reads_r1, r2=self.reads_r2, params=spades_params)
 				),
 				(
 					"asm_fb3_spt", 
-					spades_cmd.format(
-						self.fb_reads_r1, 
-						self.fb_reads_r2, 
-						self.threads, 
-						self.outdir, 
-						spades_params
-					)
+					spades_cmd,
+					dict(r1=self.fb_reads_r1, r2=self.fb_reads_r2, params=spades_params)
 				)
 			]
 
@@ -216,6 +285,8 @@ def main():
 	ap.add_argument("outdir", type=str)
 	ap.add_argument("--threads", type=int, default=8)
 	ap.add_argument("--singularity-container", type=str, default="")
+	ap.add_argument("--race", type=int, default=1, help="Run up to this many assembly stages (main and fallbacks) concurrently, each with an equal share of --threads and --mem-mb. The first successful stage in priority order wins. [1]")
+	ap.add_argument("--mem-mb", type=int, default=0, help="Memory (MB) of the allocation, shared by concurrent stages. [n/a]")
 
 	args = ap.parse_args()
 
@@ -0,0 +1,113 @@
+import os
+from os.path import exists, dirname
+import pathlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def read_records(table, header_lines=0, delimiter=","):
+	'''
+	Reads a per-sample table, whose records are keyed by their first column.
+	Returns the header lines and an OrderedDict of sample -> record line.
+	'''
+	header, records = list(), OrderedDict()
+	if exists(table):
+		with open(table) as _in:
+			for i, line in enumerate(_in.read().splitlines()):
+				if i < header_lines:
+					header.append(line)
+				elif line:
+					records.setdefault(line.split(delimiter)[0], line)
+	return header, records
+
+
+def write_lines(table, lines):
+	'''Atomically (re-)writes table, only if its content changes (parse caches are keyed by samplesheet mtime).'''
+	content = "".join(line + "\n" for line in lines)
+	if exists(table) and open(table).read() == content:
+		return table
+	pathlib.Path(dirname(table) or ".").mkdir(parents=True, exist_ok=True)
+	tmp_table = table + ".tmp"
+	with open(tmp_table, "wt") as table_out:
+		table_out.write(content)
+	os.replace(tmp_table, table)
+	return table
+
+
+def write_increment(samplesheet, project_sheet, increment_sheet):
+	'''
+	Writes those rows of samplesheet to increment_sheet, whose samples are not yet recorded
+	in project_sheet or whose samplesheet entries have changed since they were recorded.
+	Returns the number of samples in the increment.
+	'''
+	_, processed = read_records(project_sheet)
+	_, requested = read_records(samplesheet)
+	increment = [line for sample, line in requested.items() if processed.get(sample, None) != line]
+	write_lines(increment_sheet, increment)
+	return len(increment)
+
+
+def merge_records(increment_table, table, header_lines=0, delimiter=",", drop=tuple()):
+	'''
+	Merges the per-sample records of increment_table into table.
+	Records of samples that are already present are replaced in place (duplicates are removed),
+	records of samples in drop that are not part of the increment are removed and
+	records of new samples are appended. The header is taken from table or, if it does not exist yet,
+	from increment_table. Returns the number of records in the merged table.
+	'''
+	inc_header, increment = read_records(increment_table, header_lines=header_lines, delimiter=delimiter)
+	header, merged = list(), OrderedDict()
+	if exists(table):
+		with open(table) as _in:
+			for i, line in enumerate(_in.read().splitlines()):
+				if i < header_lines:
+					header.append(line)
+				elif line:
+					sample = line.split(delimiter)[0]
+					if sample in merged or (sample in drop and sample not in increment):
+						continue
+					merged[sample] = increment.get(sample, line)
+	merged.update((sample, line) for sample, line in increment.items() if sample not in merged)
+	write_lines(table, (header if header else inc_header) + list(merged.values()))
+	return len(merged)
+
+
+def get_increment_table(table):
+	'''Path of the per-increment version of a report table, e.g. quast_report.tsv -> quast_report.increment.tsv.'''
+	base, ext = os.path.splitext(table)
+	return base + ".increment" + ext
+
+
+@contextmanager
+def merged_reports(tables, incremental=True):
+	'''
+	Protects project-level report tables that an external tool (e.g. qaa) rewrites from scratch.
+	tables is a list of (table, header_lines, delimiter). In incremental mode, the existing tables are set aside
+	while the tool runs on the increment. Afterwards, the tool's (increment-only) tables are kept as *.increment.*
+	and merged into the restored project tables. Without incremental, the tables are left to the tool.
+	'''
+	if not incremental:
+		yield
+		return
+	saved = list()
+	for table, header_lines, delimiter in tables:
+		if exists(table + ".project"):
+			# left behind by an interrupted run, the table is the interrupted tool's output
+			os.replace(table + ".project", table)
+		if exists(table):
+			os.replace(table, table + ".project")
+			saved.append(table)
+	try:
+		yield
+	finally:
+		for table, header_lines, delimiter in tables:
+			increment_table = get_increment_table(table)
+			if exists(table):
+				os.replace(table, increment_table)
+			elif exists(increment_table):
+				# the tool did not report on this increment
+				os.remove(increment_table)
+			if table in saved:
+				os.replace(table + ".project", table)
+			if exists(increment_table):
+				merge_records(increment_table, table, header_lines=header_lines, delimiter=delimiter)
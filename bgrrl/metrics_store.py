@@ -0,0 +1,225 @@
+import os
+from os.path import join, exists
+import csv
+import math
+import sqlite3
+from collections import OrderedDict
+
+
+METRICS_STORE = "metrics.sqlite"
+METRICS_STORE_VERSION = 2
+
+# stage -> (report table in the report directory, number of header lines, metric names of headerless tables)
+REPORT_TABLES = OrderedDict([
+	("qc_eval", ("qc_eval.tsv", 2, None)),
+	("quast", ("quast_report.tsv", 1, None)),
+	("blobtools", ("blobtools_report.tsv", 1, None)),
+	("quast_survey", ("quast_survey_report", 1, None)),
+	("blobtools_survey", ("blobtools_survey_report.tsv", 1, None)),
+	("assembly_stages", ("assembly_stages.tsv", 0, ["Assembly stage"])),
+	("enterobase_assembly", ("all_quast_taxonomy_report.tsv", 1, None)),
+	("enterobase_taxonomy", ("eb_taxonomy_report.tsv", 1, None)),
+	("annotation", ("annotation_report.tsv", 1, None))
+])
+
+SCHEMA = [
+	"CREATE TABLE IF NOT EXISTS metrics (sample TEXT NOT NULL, stage TEXT NOT NULL, metric TEXT NOT NULL, row INTEGER NOT NULL, col INTEGER NOT NULL, value, text TEXT NOT NULL, PRIMARY KEY (sample, stage, metric)) WITHOUT ROWID",
+	"CREATE INDEX IF NOT EXISTS metrics_stage ON metrics (stage, row, col)",
+	"CREATE TABLE IF NOT EXISTS stages (stage TEXT PRIMARY KEY, key TEXT, metrics TEXT, source TEXT, mtime REAL, size INTEGER)"
+]
+
+
+def get_metrics_store(report_dir):
+	return join(report_dir, METRICS_STORE)
+
+
+def to_metric_value(value):
+	'''Typed report value: integers and (finite) floats as numbers, everything else as text. The original text is stored as well.'''
+	if not isinstance(value, str):
+		return value
+	try:
+		return int(value)
+	except ValueError:
+		pass
+	try:
+		fvalue = float(value)
+	except ValueError:
+		return value
+	return fvalue if math.isfinite(fvalue) else value
+
+
+def get_metric_names(header_rows):
+	'''
+	Metric names of a (multi-line) report header, e.g. qc_eval.tsv's test name/test data lines.
+	Group labels of the first line(s) are carried forward over their empty columns and prefixed to the labels of the last line.
+	Duplicate names are made unique by their column index.
+	'''
+	if not header_rows:
+		return list()
+	names, groups, seen = list(), [""] * (len(header_rows) - 1), set()
+	for col in range(max(len(row) for row in header_rows)):
+		labels = [row[col] if col < len(row) else "" for row in header_rows]
+		for i, label in enumerate(labels[:-1]):
+			if label:
+				groups[i:] = [label] + [""] * (len(groups) - i - 1)
+		name = ":".join(label for label in groups + labels[-1:] if label)
+		if name in seen:
+			name = "{}[{}]".format(name, col)
+		seen.add(name)
+		names.append(name)
+	return names
+
+
+class MetricsStore(object):
+	'''
+	Per-sample metric records of all stages (qc evaluation, assembly, QUAST, Blobtools, Enterobase, annotation)
+	in a single SQLite database (reports/metrics.sqlite). Records are (sample, stage, metric, value), indexed by
+	sample and stage, so that report generators can join stages by sample and metric name instead of re-reading
+	and re-joining the report tables by column position. Values are stored typed (see to_metric_value) and as their
+	original report text, records keep their report row and column, so that tables are rendered as they were imported.
+	Each stage remembers the stats of the report table it was imported from, unchanged tables are not re-imported (see sync).
+	'''
+	def __init__(self, path):
+		self.path = path
+		self.db = sqlite3.connect(path, timeout=60)
+		version = self.db.execute("PRAGMA user_version").fetchone()[0]
+		if version != METRICS_STORE_VERSION:
+			with self.db:
+				self.db.execute("DROP TABLE IF EXISTS metrics")
+				self.db.execute("DROP TABLE IF EXISTS stages")
+				self.db.execute("PRAGMA user_version = {}".format(METRICS_STORE_VERSION))
+		with self.db:
+			for statement in SCHEMA:
+				self.db.execute(statement)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		self.db.close()
+
+	def put_records(self, stage, key, metrics, records, samples=None, source=None):
+		'''
+		Stores records (sample, values in metrics order) of a stage.
+		All records of the stage are replaced, or, if samples is given, only those of the samples in samples.
+		Replaced samples keep their row, new samples are appended in the order of records.
+		'''
+		st = os.stat(source) if source is not None else None
+		with self.db:
+			rows, next_row = dict(), 0
+			if samples is None:
+				self.db.execute("DELETE FROM metrics WHERE stage = ?", (stage,))
+			else:
+				samples = list(samples)
+				for sample in samples:
+					row = self.db.execute("SELECT row FROM metrics WHERE sample = ? AND stage = ? LIMIT 1", (sample, stage)).fetchone()
+					if row is not None:
+						rows[sample] = row[0]
+				max_row = self.db.execute("SELECT MAX(row) FROM metrics WHERE stage = ?", (stage,)).fetchone()[0]
+				next_row = max_row + 1 if max_row is not None else 0
+				self.db.executemany("DELETE FROM metrics WHERE stage = ? AND sample = ?", ((stage, sample) for sample in samples))
+			values = list()
+			for sample, record in records:
+				if sample not in rows:
+					rows[sample], next_row = next_row, next_row + 1
+				values.extend(
+					(sample, stage, metric, rows[sample], col, to_metric_value(value), str(value))
+					for col, (metric, value) in enumerate(zip(metrics, record))
+				)
+			self.db.executemany("INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?)", values)
+			self.db.execute(
+				"INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?)",
+				(stage, key, "\t".join(metrics), source, st.st_mtime if st else None, st.st_size if st else None)
+			)
+
+	def import_table(self, stage, table, header_lines=1, metrics=None, delimiter="\t"):
+		'''
+		Imports a per-sample report table (keyed by its first column) as stage.
+		Repeated header lines (e.g. one per Enterobase group) are skipped. Returns the number of imported records.
+		'''
+		with open(table) as _in:
+			rows = [row for row in csv.reader(_in, delimiter=delimiter) if row]
+		header, rows = rows[:header_lines], rows[header_lines:]
+		key = header[0][0] if header else "Sample"
+		if metrics is None:
+			metrics = get_metric_names([row[1:] for row in header])
+		records = OrderedDict((row[0], row[1:]) for row in rows if not (header and row[0] == key))
+		self.put_records(stage, key, metrics, records.items(), source=table)
+		return len(records)
+
+	def sync(self, stage, report_dir):
+		'''(Re-)imports a registered report table (REPORT_TABLES) if it changed since its last import. Returns whether the stage exists.'''
+		table, header_lines, metrics = REPORT_TABLES[stage]
+		table = join(report_dir, table)
+		if not exists(table):
+			return self.has_stage(stage)
+		st = os.stat(table)
+		imported = self.db.execute("SELECT source, mtime, size FROM stages WHERE stage = ?", (stage,)).fetchone()
+		if imported != (table, st.st_mtime, st.st_size):
+			self.import_table(stage, table, header_lines=header_lines, metrics=metrics)
+		return True
+
+	def has_stage(self, stage):
+		return self.db.execute("SELECT 1 FROM stages WHERE stage = ?", (stage,)).fetchone() is not None
+
+	def get_metrics(self, stage):
+		'''Returns the key column name and the metric names of a stage (in report column order).'''
+		row = self.db.execute("SELECT key, metrics FROM stages WHERE stage = ?", (stage,)).fetchone()
+		if row is None:
+			return None, list()
+		return row[0], row[1].split("\t") if row[1] else list()
+
+	def get(self, sample, stage=None, text=False):
+		'''
+		Returns the metrics (metric -> value) of a sample in stage or, without stage, per stage (stage -> metrics).
+		Values are typed or, with text, as in the report.
+		'''
+		column = "text" if text else "value"
+		if stage is not None:
+			return OrderedDict(self.db.execute("SELECT metric, {} FROM metrics WHERE sample = ? AND stage = ? ORDER BY col".format(column), (sample, stage)))
+		data = OrderedDict()
+		for _stage, metric, value in self.db.execute("SELECT stage, metric, {} FROM metrics WHERE sample = ? ORDER BY stage, col".format(column), (sample,)):
+			data.setdefault(_stage, OrderedDict())[metric] = value
+		return data
+
+	def get_stage(self, stage, samples=None, text=False):
+		'''
+		Returns the metrics (metric -> value) of all samples (or those in samples) in a stage, in report order.
+		Values are typed or, with text, as in the report.
+		'''
+		column = "text" if text else "value"
+		data = OrderedDict()
+		if samples is None:
+			records = self.db.execute("SELECT sample, metric, {} FROM metrics WHERE stage = ? ORDER BY row, col".format(column), (stage,))
+		else:
+			# (sample, stage) lookups use the primary key
+			records = (
+				record[2:]
+				for record in sorted(
+					(row, col, sample, metric, value)
+					for sample in set(samples)
+					for row, col, metric, value in self.db.execute("SELECT row, col, metric, {} FROM metrics WHERE sample = ? AND stage = ?".format(column), (sample, stage))
+				)
+			)
+		for sample, metric, value in records:
+			data.setdefault(sample, OrderedDict())[metric] = value
+		return data
+
+	def get_table(self, stage, samples=None, metrics=None):
+		'''
+		Returns a stage as report table: header row (key column + metrics) followed by one row per sample (in report order).
+		Values are rendered as in the report, missing values are empty.
+		'''
+		key, stage_metrics = self.get_metrics(stage)
+		metrics = stage_metrics if metrics is None else metrics
+		data = self.get_stage(stage, samples=samples, text=True)
+		return [[key] + list(metrics)] + [[sample] + [values.get(metric, "") for metric in metrics] for sample, values in data.items()]
+
+
+def update_metrics_store(report_dir, stages=None):
+	'''Imports the (new or changed) report tables of stages (default: all registered stages) into the report directory's metrics store.'''
+	with MetricsStore(get_metrics_store(report_dir)) as store:
+		return [stage for stage in (stages or REPORT_TABLES) if store.sync(stage, report_dir)]
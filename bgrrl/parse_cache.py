@@ -0,0 +1,258 @@
+import os
+from os.path import join, exists, abspath
+import pickle
+import sqlite3
+from urllib.request import pathname2url
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from .samplesheet import Samplesheet, BaseSample, ASM_Sample, ANN_Sample
+
+PARSE_CACHE_VERSION = 7
+
+SCHEMA = [
+	"CREATE TABLE meta (name TEXT PRIMARY KEY, value BLOB)",
+	"CREATE TABLE samples (pos INTEGER PRIMARY KEY, sample TEXT NOT NULL UNIQUE, record BLOB)",
+	"CREATE TABLE targets (target TEXT)"
+]
+
+SAMPLETYPES = {
+	"bgsurvey": BaseSample,
+	"bgasm": ASM_Sample,
+	"bgann": ANN_Sample,
+	"bgfull": BaseSample
+}
+
+
+def _mtime(path):
+	try:
+		return os.stat(path).st_mtime
+	except (OSError, TypeError):
+		return None
+
+
+def get_ratt_reference_key(ratt_ref_path):
+	'''(path, size, mtime) of the reference annotations (.embl) in the subdirectories of the ratt reference directory.'''
+	key = list()
+	if os.path.isdir(ratt_ref_path):
+		for d in sorted(next(os.walk(ratt_ref_path))[1]):
+			for f in sorted(next(os.walk(join(ratt_ref_path, d)))[2]):
+				if f.endswith(".embl"):
+					st = os.stat(join(ratt_ref_path, d, f))
+					key.append((join(d, f), st.st_size, st.st_mtime))
+	return tuple(key)
+
+
+def get_cache_key(config):
+	'''
+	Everything the parse-time values of a Snakefile depend on:
+	the samplesheet (by mtime), the ratt reference annotations (by path, size and mtime) and the relevant run options.
+	'''
+	ratt_reference = abspath(config.get("ratt_reference", ".")) if config.get("run_ratt", False) else ""
+	return (
+		PARSE_CACHE_VERSION,
+		config["module"],
+		abspath(config["samplesheet"]),
+		_mtime(config["samplesheet"]),
+		config["out_dir"],
+		bool(config.get("no_normalization", False)),
+		bool(config.get("no_fastqc", False)),
+		bool(config.get("run_prokka", False)),
+		ratt_reference,
+		get_ratt_reference_key(ratt_reference) if ratt_reference else None
+	)
+
+
+def get_ratt_references(ratt_ref_path):
+	ref_prefixes = OrderedDict()
+	for d in next(os.walk(ratt_ref_path))[1]:
+		ref_prefixes[d] = list(f.strip(".embl").split(".")[-1] for f in next(os.walk(join(ratt_ref_path, d)))[2] if f.endswith(".embl"))
+	return ref_prefixes
+
+
+def get_survey_targets(samples, config):
+	'''
+	Per-sample survey targets up to the early survey gate (qc_pregate).
+	The later survey stages (get_post_pregate_targets) are requested by each sample's .survey.done target,
+	so that samples failing the early gate skip them.
+	'''
+	qc_dir = join(abspath(config["out_dir"]), "qc")
+	fastqc_dir, gate_dir = join(qc_dir, "fastqc"), get_gate_dir(config)
+
+	targets = list()
+	targets.extend(map(lambda s:join(gate_dir, s, s + ".qc_verdict.json"), samples))
+	targets.extend(map(lambda s:join(gate_dir, s, s + ".survey.done"), samples))
+	targets.extend(map(lambda s:join(qc_dir, "readstats", "bbduk", s, "{}.bbduk.read_stats.json".format(s)), samples))
+	# FastQC reports are optional (reporting only)
+	if not config.get("no_fastqc", False):
+		targets.extend(map(lambda s:join(fastqc_dir, "bbduk", s, "{}_R1.bbduk_fastqc.html".format(s)), samples))
+		targets.extend(map(lambda s:join(fastqc_dir, "bbduk", s, "{}_R2.bbduk_fastqc.html".format(s)), samples))
+	return targets
+
+
+def get_post_pregate_targets(samples, config):
+	'''Survey targets of samples that passed the early survey gate: normalization, survey assembly and k-mer analysis.'''
+	qc_dir = join(abspath(config["out_dir"]), "qc")
+	fastqc_dir, tadpole_dir, kat_dir = join(qc_dir, "fastqc"), join(qc_dir, "tadpole"), join(qc_dir, "kat")
+
+	targets = list()
+	targets.extend(map(lambda s:join(tadpole_dir, s, s + "_tadpole_contigs.fasta"), samples))
+	targets.extend(map(lambda s:join(kat_dir, s, s + ".dist_analysis.json"), samples))
+	if not config.get("no_normalization", False):
+		targets.extend(map(lambda s:join(qc_dir, "readstats", "bbnorm", s, "{}.bbnorm.read_stats.json".format(s)), samples))
+		if not config.get("no_fastqc", False):
+			targets.extend(map(lambda s:join(fastqc_dir, "bbnorm", s, "{}_R1.bbnorm_fastqc.html".format(s)), samples))
+			targets.extend(map(lambda s:join(fastqc_dir, "bbnorm", s, "{}_R2.bbnorm_fastqc.html".format(s)), samples))
+	return targets
+
+
+def get_asm_targets(samples, config, ref_prefixes):
+	out_dir = abspath(config["out_dir"])
+	assembly_dir = join(out_dir, "assembly")
+	prokka_dir, ratt_dir = join(out_dir, "annotation", "prokka"), join(out_dir, "annotation", "ratt")
+
+	targets = list()
+	if config["run_prokka"]:
+		targets.extend(map(lambda s:join(prokka_dir, s, s + ".gff"), samples))
+		targets.extend(map(lambda s:join(prokka_dir, s, s + ".fna"), samples))
+		targets.extend(map(lambda s:join(prokka_dir, s, s + ".ffn.16S"), samples))
+	else:
+		targets.extend(map(lambda s:join(assembly_dir, s, s + ".assembly.fasta"), samples))
+
+	if config["run_ratt"]:
+		ratt_ref_path = abspath(config.get("ratt_reference", "."))
+		for d in ref_prefixes:
+			targets.extend(map(lambda s:join(ratt_dir, s, d, "{}_{}.final.gff".format(s, d)), samples))
+			targets.append(join(ratt_ref_path, d, "gff", d + ".gff"))
+	return targets
+
+
+def get_gate_dir(config):
+	return join(abspath(config["out_dir"]), "qc", "gate")
+
+
+def get_full_targets(samples, config):
+	gate_dir = get_gate_dir(config)
+	return list(map(lambda s:join(gate_dir, s, s + ".done"), samples))
+
+
+def compute_parse_data(config, samplesheet=None):
+	'''Returns (samplesheet, targets, ref_prefixes) for the Snakefile of config["module"].'''
+	module = config["module"]
+	if samplesheet is None:
+		samplesheet = Samplesheet(config["samplesheet"], sampletype=SAMPLETYPES[module])
+
+	ref_prefixes = OrderedDict()
+	if module != "bgsurvey" and config.get("run_ratt", False):
+		ref_prefixes = get_ratt_references(abspath(config.get("ratt_reference", ".")))
+
+	if module == "bgsurvey":
+		targets = get_survey_targets(samplesheet, config)
+	elif module == "bgfull":
+		# the per-sample assembly/annotation targets depend on the survey gate
+		targets = get_full_targets(samplesheet, config)
+	else:
+		targets = get_asm_targets(samplesheet, config, ref_prefixes)
+
+	return samplesheet, targets, ref_prefixes
+
+
+def build_parse_cache(config, cache_file, samplesheet=None):
+	'''
+	Precomputes the parse-time values of a Snakefile, unless an up-to-date cache exists.
+	The cache is an SQLite database with one (pickled) record per sample, the targets and the ratt reference prefixes.
+	'''
+	key = get_cache_key(config)
+	if _read_cache_key(cache_file) == key:
+		return False
+
+	samplesheet, targets, ref_prefixes = compute_parse_data(config, samplesheet=samplesheet)
+	tmp_file = cache_file + ".tmp"
+	if exists(tmp_file):
+		os.remove(tmp_file)
+	db = sqlite3.connect(tmp_file)
+	try:
+		with db:
+			for statement in SCHEMA:
+				db.execute(statement)
+			db.executemany(
+				"INSERT INTO meta VALUES (?, ?)",
+				(
+					("key", pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL)),
+					("ref_prefixes", pickle.dumps(ref_prefixes, protocol=pickle.HIGHEST_PROTOCOL))
+				)
+			)
+			db.executemany(
+				"INSERT INTO samples (sample, record) VALUES (?, ?)",
+				((sample_id, pickle.dumps(samplesheet[sample_id], protocol=pickle.HIGHEST_PROTOCOL)) for sample_id in samplesheet)
+			)
+			db.executemany("INSERT INTO targets (target) VALUES (?)", ((target,) for target in targets))
+	finally:
+		db.close()
+	os.replace(tmp_file, cache_file)
+	return True
+
+
+def _connect(cache_file):
+	# the cache is only replaced, never modified in place, so readers do not need any locking (e.g. on network filesystems)
+	return sqlite3.connect("file:{}?mode=ro&immutable=1".format(pathname2url(abspath(cache_file))), uri=True)
+
+
+def _read_cache_key(cache_file):
+	if not exists(cache_file):
+		return None
+	try:
+		db = _connect(cache_file)
+		try:
+			return pickle.loads(db.execute("SELECT value FROM meta WHERE name = 'key'").fetchone()[0])
+		finally:
+			db.close()
+	except Exception:
+		return None
+
+
+class CachedSamples(Mapping):
+	'''Read-only, ordered sampleID -> sample mapping backed by a parse cache. Samples are loaded on first access.'''
+	def __init__(self, db):
+		self.db = db
+		self._samples = dict()
+	def __getitem__(self, sample_id):
+		sample = self._samples.get(sample_id, None)
+		if sample is None:
+			row = self.db.execute("SELECT record FROM samples WHERE sample = ?", (sample_id,)).fetchone()
+			if row is None:
+				raise KeyError(sample_id)
+			sample = self._samples[sample_id] = pickle.loads(row[0])
+		return sample
+	def __iter__(self):
+		return (row[0] for row in self.db.execute("SELECT sample FROM samples ORDER BY pos"))
+	def __len__(self):
+		return self.db.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+	def __contains__(self, sample_id):
+		return sample_id in self._samples or self.db.execute("SELECT 1 FROM samples WHERE sample = ?", (sample_id,)).fetchone() is not None
+
+
+def load_parse_data(config, targets=True):
+	'''
+	Used by the Snakefiles: returns samples (sampleID -> sample), targets and ratt reference prefixes
+	from the cache precomputed by the module runner, or computes them if there is no valid cache.
+	Loading from the cache only validates the cache key, samples are looked up by their id when they are first accessed.
+	The targets are only needed by the main snakemake process, jobs (targets=False) get an empty target list.
+	Per-job loading therefore does not depend on the number of samples.
+	'''
+	cache_file = config.get("parse_cache", "")
+	if cache_file and exists(cache_file):
+		try:
+			db = _connect(cache_file)
+			meta = dict(db.execute("SELECT name, value FROM meta"))
+			if pickle.loads(meta["key"]) == get_cache_key(config):
+				return (
+					CachedSamples(db),
+					[row[0] for row in db.execute("SELECT target FROM targets ORDER BY rowid")] if targets else list(),
+					pickle.loads(meta["ref_prefixes"])
+				)
+			db.close()
+		except Exception:
+			pass
+	samplesheet, _targets, ref_prefixes = compute_parse_data(config)
+	return samplesheet, _targets if targets else list(), ref_prefixes
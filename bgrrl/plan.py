@@ -0,0 +1,200 @@
+import os
+from os.path import join
+import glob
+import json
+import pathlib
+from collections import OrderedDict
+
+from .snakemake_helper import run_snakemake, RuleResources
+
+
+def load_rule_runtimes(stats_files):
+	'''
+	Collects the mean runtime (s) per rule from snakemake .stats files of previous runs.
+	Returns a dictionary rule -> mean runtime (means of several stats files are weighted equally).
+	'''
+	runtimes = dict()
+	for stats_file in stats_files:
+		try:
+			with open(stats_file) as stats_in:
+				rules = json.load(stats_in).get("rules", dict())
+		except (OSError, ValueError):
+			continue
+		for rule, stats in rules.items():
+			runtimes.setdefault(rule, list()).append(stats["mean-runtime"])
+	return {rule: sum(values) / len(values) for rule, values in runtimes.items()}
+
+
+def find_stats_files(output_dir):
+	return glob.glob(join(output_dir, "*.stats")) + glob.glob(join(output_dir, "shards", "*", "*", "*.stats"))
+
+
+def parse_time(time_str):
+	seconds = 0.0
+	for field in str(time_str).split(":"):
+		seconds = seconds * 60 + float(field)
+	return seconds
+
+
+class RulePlan(object):
+	__slots__ = ["rule", "local", "n_jobs", "threads", "mem_mb", "input_size", "runtime_src", "core_hours", "peak_mem_mb"]
+	def __init__(self, rule, threads, mem_mb, local=False):
+		self.rule, self.local = rule, local
+		self.n_jobs, self.input_size = 0, 0
+		self.threads, self.mem_mb = threads, mem_mb
+		self.runtime_src = "n/a"
+		self.core_hours, self.peak_mem_mb = 0.0, 0
+
+
+class PlanCollector(object):
+	'''
+	Snakemake log handler collecting the jobs reported by a dry run.
+	Each job is written to the job table as soon as it is reported, only a compact record
+	(rule, threads, input size, dependencies) per job is kept for the estimates.
+	Dry runs report jobs in topological order, hence the producers of a job's inputs are always known.
+	'''
+	def __init__(self, jobs_out):
+		self.jobs_out = jobs_out
+		self.rules = OrderedDict()
+		self.jobs = list()
+		self.producers = dict()
+		self.estimated_sizes = dict()
+		self.unresolved = 0
+		print("JobID", "Rule", "Sample", "Threads", "Memory[MB]", "InputSize[bytes]", sep="\t", file=self.jobs_out)
+
+	def get_size(self, f):
+		if f in self.estimated_sizes:
+			return self.estimated_sizes[f]
+		try:
+			return os.path.getsize(f)
+		except OSError:
+			return 0
+
+	def __call__(self, msg):
+		if msg.get("level") != "job_info":
+			return
+		rule, threads = msg["name"], int(msg.get("threads", 1))
+		resources = msg.get("resources", dict())
+		mem_mb = int(dict(resources.items()).get("mem_mb", 0)) if resources else 0
+		inputs = [str(f) for f in msg.get("input", list())]
+		outputs = [str(f) for f in msg.get("output", list())]
+
+		input_size = sum(self.get_size(f) for f in inputs)
+		deps = set(self.producers[f] for f in inputs if f in self.producers)
+		self.unresolved += "<TBD>" in outputs
+
+		job_index = len(self.jobs)
+		self.jobs.append((rule, threads, input_size, tuple(deps)))
+		for f in outputs:
+			self.producers[f] = job_index
+			# outputs that do not exist yet are assumed to share the size of the job's input
+			self.estimated_sizes[f] = input_size // max(1, len(outputs))
+
+		rule_plan = self.rules.setdefault(rule, RulePlan(rule, threads, mem_mb, local=msg.get("local", False)))
+		rule_plan.n_jobs += 1
+		rule_plan.input_size += input_size
+		rule_plan.threads, rule_plan.mem_mb = max(rule_plan.threads, threads), max(rule_plan.mem_mb, mem_mb)
+
+		print(msg.get("jobid", job_index), rule, msg.get("wildcards", dict()).get("sample", ""), threads, mem_mb, input_size, sep="\t", file=self.jobs_out)
+
+	def estimate(self, rule_runtimes, fallback_runtimes, max_jobs):
+		'''
+		Estimates core-hours and peak concurrent memory per rule and the critical path.
+		A job's runtime is its rule's recorded mean runtime, scaled by the job's input size relative to
+		the mean input size of the rule's planned jobs. Rules without recorded runtimes use fallback_runtimes,
+		local rules without recorded runtimes are assumed to take no time.
+		max_jobs(rule_plan) returns the maximum number of concurrently running jobs of a rule.
+		Returns the critical path as list of (rule, number of consecutive jobs) and its length in seconds.
+		'''
+		runtimes = dict()
+		for rule, rule_plan in self.rules.items():
+			if rule in rule_runtimes:
+				runtimes[rule], rule_plan.runtime_src = rule_runtimes[rule], "stats"
+			elif rule in fallback_runtimes and not rule_plan.local:
+				runtimes[rule], rule_plan.runtime_src = fallback_runtimes[rule], "hpc_config"
+			else:
+				runtimes[rule] = 0.0
+			rule_plan.peak_mem_mb = rule_plan.mem_mb * min(rule_plan.n_jobs, max_jobs(rule_plan))
+
+		finish, predecessor = [0.0] * len(self.jobs), [None] * len(self.jobs)
+		for i, (rule, threads, input_size, deps) in enumerate(self.jobs):
+			rule_plan = self.rules[rule]
+			mean_size = rule_plan.input_size / rule_plan.n_jobs
+			runtime = runtimes[rule] * (input_size / mean_size if mean_size else 1.0)
+			rule_plan.core_hours += threads * runtime / 3600
+			start = 0.0
+			for d in deps:
+				if finish[d] > start:
+					start, predecessor[i] = finish[d], d
+			finish[i] = start + runtime
+
+		path = list()
+		if finish:
+			i = max(range(len(finish)), key=finish.__getitem__)
+			length = finish[i]
+			while i is not None:
+				rule = self.jobs[i][0]
+				if path and path[-1][0] == rule:
+					path[-1][1] += 1
+				else:
+					path.append([rule, 1])
+				i = predecessor[i]
+			return [tuple(step) for step in reversed(path)], length
+		return path, 0.0
+
+
+def format_hours(seconds):
+	return "{:.2f}".format(seconds / 3600)
+
+
+def write_plan(collector, critical_path, path_length, out):
+	print("Rule", "#Jobs", "Threads", "Memory[MB]", "InputSize[GB]", "CoreHours", "PeakConcurrentMemory[MB]", "RuntimeSource", sep="\t", file=out)
+	for rule_plan in collector.rules.values():
+		print(
+			rule_plan.rule, rule_plan.n_jobs, rule_plan.threads, rule_plan.mem_mb,
+			"{:.2f}".format(rule_plan.input_size / 2**30), "{:.2f}".format(rule_plan.core_hours),
+			rule_plan.peak_mem_mb, rule_plan.runtime_src,
+			sep="\t", file=out
+		)
+	print("Total", len(collector.jobs), "", "", "", "{:.2f}".format(sum(r.core_hours for r in collector.rules.values())), "", "", sep="\t", file=out)
+	print("#Critical path [h]: " + format_hours(path_length), file=out)
+	print("#Critical path: " + " -> ".join("{} (x{})".format(rule, n) if n > 1 else rule for rule, n in critical_path), file=out)
+	if collector.unresolved:
+		print("#Note: {} job(s) are checkpoints, jobs depending on their outcome are not included.".format(collector.unresolved), file=out)
+
+
+def plan_snakemake(snakefile, out_dir, cfg_file, exe_env, plan_dir, module, unlock=False):
+	'''
+	Dry-runs snakefile and writes a capacity plan: <plan_dir>/<module>.jobs.tsv (one line per job, streamed)
+	and <plan_dir>/<module>.plan.tsv (jobs, core-hours, peak concurrent memory per rule and the critical path).
+	'''
+	pathlib.Path(plan_dir).mkdir(parents=True, exist_ok=True)
+	jobs_file, plan_file = join(plan_dir, module + ".jobs.tsv"), join(plan_dir, module + ".plan.tsv")
+	with open(jobs_file, "wt") as jobs_out:
+		collector = PlanCollector(jobs_out)
+		if not run_snakemake(snakefile, out_dir, cfg_file, exe_env, dryrun=True, unlock=unlock, log_handler=collector):
+			return False
+
+	# without recorded runtimes, the rule-specific walltime limits serve as (pessimistic) estimates
+	hpc_config = RuleResources({"hpc_config_file": exe_env.hpc_config}).hpc_config
+	fallback_runtimes = {
+		rule: parse_time(cfg["time"])
+		for rule, cfg in hpc_config.items()
+		if "time" in cfg and rule != "__default__"
+	}
+
+	def max_jobs(rule_plan):
+		if exe_env.use_scheduler:
+			return exe_env.max_nodes
+		n_jobs = max(1, exe_env.max_cores // max(1, rule_plan.threads))
+		if exe_env.max_mem and rule_plan.mem_mb:
+			n_jobs = min(n_jobs, max(1, exe_env.max_mem // rule_plan.mem_mb))
+		return n_jobs
+
+	critical_path, path_length = collector.estimate(load_rule_runtimes(find_stats_files(out_dir)), fallback_runtimes, max_jobs)
+	with open(plan_file, "wt") as plan_out:
+		write_plan(collector, critical_path, path_length, plan_out)
+	with open(plan_file) as plan_in:
+		print(plan_in.read())
+	print("Capacity plan written to {}, jobs written to {}.".format(plan_file, jobs_file))
+	return True
@@ -1,8 +1,11 @@
 import os
 from collections import namedtuple, OrderedDict
+from collections.abc import MutableMapping
 import csv
 import sys
 
+from .statcache import StatCache
+
 RAW_SAMPLE_FIELDS = [
 	"sampleID",
 	"customerSampleID",
@@ -43,68 +46,152 @@ def sample2asmsample(sample, trimdata, normdata=["", "", ""]):
 	return ASM_Sample(*sample, *trimdata, *normdata)
 
 
+class SampleSchema(object):
+	"""
+	Field layout shared by all samples of the same type. Samples only keep their raw row,
+	field access is resolved through the schema's name -> column index map.
+	"""
+	__slots__ = ("fields", "index")
+	def __init__(self, fields):
+		self.fields = tuple(fields)
+		self.index = dict((field, i) for i, field in enumerate(self.fields))
+	def __len__(self):
+		return len(self.fields)
+
+SCHEMAS = dict()
+
+def get_schema(fields):
+	fields = tuple(fields)
+	schema = SCHEMAS.get(fields, None)
+	if schema is None:
+		schema = SCHEMAS.setdefault(fields, SampleSchema(fields))
+	return schema
+
+def _rebuild_sample(sampletype, fields, values):
+	sample = object.__new__(sampletype)
+	object.__setattr__(sample, "_schema", get_schema(fields))
+	object.__setattr__(sample, "_values", list(values))
+	return sample
+
+
 class BaseSample(object):
-	def __init__(self, *args, sampleFields=RAW_SAMPLE_FIELDS):
-		self._sample_field_order = list(sampleFields)
-		if not len(args) == len(sampleFields):
-			 raise ValueError("SAMPLE ERROR: Number of arguments ({}) does not match number of fields ({}).".format(len(args), len(sampleFields)))
-		for argid, arg in zip(sampleFields, args):
-			setattr(self, argid, arg)
+	__slots__ = ("_schema", "_values")
+	SCHEMA = get_schema(RAW_SAMPLE_FIELDS)
+	ERROR_TAG = "SAMPLE ERROR"
+	def __init__(self, *args, sampleFields=None):
+		schema = self.SCHEMA if sampleFields is None else get_schema(sampleFields)
+		if not len(args) == len(schema):
+			raise ValueError("{}: Number of arguments ({}) does not match number of fields ({}).".format(self.ERROR_TAG, len(args), len(schema)))
+		object.__setattr__(self, "_schema", schema)
+		object.__setattr__(self, "_values", list(args))
+	def __getattr__(self, name):
+		if name.startswith("_"):
+			raise AttributeError(name)
+		try:
+			return self._values[self._schema.index[name]]
+		except KeyError:
+			raise AttributeError("{} has no field {}.".format(self.__class__.__name__, name))
+	def __setattr__(self, name, value):
+		try:
+			self._values[self._schema.index[name]] = value
+		except KeyError:
+			raise AttributeError("{} has no field {}.".format(self.__class__.__name__, name))
+	def __reduce__(self):
+		return (_rebuild_sample, (self.__class__, self._schema.fields, tuple(self._values)))
+	def __repr__(self):
+		return "{}({})".format(self.__class__.__name__, ", ".join("{}={!r}".format(f, v) for f, v in zip(self._schema.fields, self._values)))
 	def verifyDatasets(self, fields=["R1", "R2"]):
 		for f in fields:
 			path = getattr(self, f)
 			if path and not os.path.exists(path):
-				raise ValueError("SAMPLE ERROR: Sample {}. Cannot find {} data at {}.".format(s, f, path))	   
+				raise ValueError("{}: Sample {}. Cannot find {} data at {}.".format(self.ERROR_TAG, self.sampleID, f, path))
 	def upgrade(self, sampleFields, sampleData):
 		if not len(sampleFields) == len(sampleData):
 			raise ValueError("SAMPLE UPGRADE ERROR: Number of fields ({}) does not match expected number of fields ({}).".format(len(sampleData), len(sampleFields)))
-		for argid, arg in zip(sampleFields, sampleData):
-			setattr(self, argid, arg)
-		self._sample_field_order.extend(sampleFields)
+		object.__setattr__(self, "_schema", get_schema(self._schema.fields + tuple(sampleFields)))
+		self._values.extend(sampleData)
 	def __iter__(self):
-		for fname in self._sample_field_order:
-			yield getattr(self, fname)
+		return iter(self._values)
+	def __len__(self):
+		return len(self._values)
 
 class ASM_Sample(BaseSample):
-	def __init__(self, *args, sampleFields=(RAW_SAMPLE_FIELDS, ASM_SAMPLE_FIELDS)):
-		super(ASM_Sample, self).__init__(*args[:len(sampleFields[0])], sampleFields=RAW_SAMPLE_FIELDS)
-		self._sample_field_order = sampleFields[0] + sampleFields[1]
-		if not len(args[len(sampleFields[0]):]) == len(sampleFields[1]):
-			print(args[len(sampleFields[0]):], sampleFields[1], file=sys.stderr)
-			raise ValueError("ASM_SAMPLE ERROR: Number of arguments ({}) does not match number of fields ({}).".format(len(args[len(sampleFields[0]):]), len(sampleFields[1])))
-		for argid, arg in zip(sampleFields[1], args[len(sampleFields[0]):]):
-			setattr(self, argid, arg)
+	__slots__ = ()
+	SCHEMA = get_schema(RAW_SAMPLE_FIELDS + ASM_SAMPLE_FIELDS)
+	ERROR_TAG = "ASM_SAMPLE ERROR"
 
 class ANN_Sample(BaseSample):
-	def __init__(self, *args, sampleFields=(RAW_SAMPLE_FIELDS[:2], ANN_SAMPLE_FIELDS)):
-		super(ANN_Sample, self).__init__(*args[:len(sampleFields[0])], sampleFields=RAW_SAMPLE_FIELDS[:2])
-		self._sample_field_order = sampleFields[0] + sampleFields[1]
-		if not len(args[len(sampleFields[0]):]) == len(sampleFields[1]):
-			print(args[len(sampleFields[0]):], sampleFields[1], file=sys.stderr)
-			raise ValueError("ANN_SAMPLE ERROR: Number of arguments ({}) does not match number of fields ({}).".format(len(args[len(sampleFields[0]):]), len(sampleFields[1])))
-		for argid, arg in zip(sampleFields[1], args[len(sampleFields[0]):]):
-			setattr(self, argid, arg)
+	__slots__ = ()
+	SCHEMA = get_schema(RAW_SAMPLE_FIELDS[:2] + ANN_SAMPLE_FIELDS)
+	ERROR_TAG = "ANN_SAMPLE ERROR"
 
 
 
-class Samplesheet(OrderedDict):
+class Samplesheet(MutableMapping):
+	"""
+	Ordered sampleID -> sample mapping. Rows are kept as raw lines and
+	only split into sample records when a sample is first accessed.
+	"""
 	def __init__(self, _input, sampletype=BaseSample):
-		super(Samplesheet, self).__init__()
+		self.sampletype = sampletype
+		self._order, self._rows, self._samples = list(), dict(), dict()
 		if type(_input) is str:
 			if not os.path.exists(_input):
 				raise ValueError("SAMPLESHEET ERORR: input file {} does not exist.".format(_input))
 			with open(_input) as _in:
-				for r in csv.reader(_in, delimiter=","):
-					print(r)
-					self[r[0]] = sampletype(*r)
+				lines = [line for line in _in.read().splitlines() if line]
+			self._order = [line.partition(",")[0].strip('"') for line in lines]
+			self._rows = dict(zip(self._order, lines))
+			if len(self._rows) != len(self._order):
+				# duplicate sampleIDs: last row wins, first position is kept
+				self._order = list(OrderedDict.fromkeys(self._order))
+	def __parse(self, line):
+		if '"' in line:
+			return next(csv.reader([line], delimiter=","))
+		return line.split(",")
+	def __getitem__(self, sample_id):
+		sample = self._samples.get(sample_id, None)
+		if sample is None:
+			sample = self._samples[sample_id] = self.sampletype(*self.__parse(self._rows[sample_id]))
+		return sample
+	def __setitem__(self, sample_id, sample):
+		if sample_id not in self._rows:
+			self._order.append(sample_id)
+		self._rows[sample_id] = None
+		self._samples[sample_id] = sample
+	def __delitem__(self, sample_id):
+		del self._rows[sample_id]
+		self._order.remove(sample_id)
+		self._samples.pop(sample_id, None)
+	def __iter__(self):
+		return iter(self._order)
+	def __len__(self):
+		return len(self._rows)
+	def __contains__(self, sample_id):
+		return sample_id in self._rows
 	def write(self, stream, _filter=None):
 		for s in self:
 			if _filter is None or s in _filter:
-				print(*tuple(self[s]), sep=",", file=stream)
-				print("")
-	def verifySampleData(self, fields=["R1", "R2", "R1trim", "R2trim", "R1norm", "R2norm"]):
+				if s in self._samples:
+					print(*tuple(self._samples[s]), sep=",", file=stream)
+				else:
+					print(self._rows[s], file=stream)
+	def verifySampleData(self, fields=["R1", "R2", "R1trim", "R2trim", "R1norm", "R2norm"], stat_cache=None):
+		if stat_cache is None:
+			stat_cache = StatCache()
+		datasets = list()
 		for s in self:
-			self[s].verifyDatasets(fields=fields)
+			sample = self[s]
+			datasets.extend((s, f, getattr(sample, f)) for f in fields if getattr(sample, f))
+		missing = stat_cache.verify(path for s, f, path in datasets)
+		stat_cache.save()
+		if missing:
+			raise ValueError(
+				"SAMPLESHEET ERROR: Cannot find {} dataset(s):\n{}".format(
+					len(missing),
+					"\n".join("Sample {}: {} data at {}".format(s, f, path) for s, f, path in datasets if path in missing)
+				)
+			)
 		return True
 
 
@@ -118,9 +205,20 @@ def readSamplesheet(fn, delimiter=","):
 				row[1] = sample.sampleID
 			yield (sample.sampleID, Sample(*row))
 
-def verifySamplesheet(fn, delimiter=","):
-	for sample_id, sample in readSamplesheet(fn, delimiter=delimiter):
-		r1_exists, r2_exists, s_exists = map(os.path.exists, (sample.R1, sample.R2, sample.S))
-		if not (r1_exists and r2_exists):
-			raise ValueError("Cannot find R1/R2 data at R1={}, R2={}.".format(sample.R1, sample.R2))
-		return True
+def verifySamplesheet(fn, delimiter=",", stat_cache=None):
+	if stat_cache is None:
+		stat_cache = StatCache()
+	samples = list(readSamplesheet(fn, delimiter=delimiter))
+	missing = stat_cache.verify(path for sample_id, sample in samples for path in (sample.R1, sample.R2))
+	stat_cache.save()
+	if missing:
+		raise ValueError(
+			"Cannot find R1/R2 data for {} sample(s):\n{}".format(
+				sum(1 for sample_id, sample in samples if sample.R1 in missing or sample.R2 in missing),
+				"\n".join(
+					"{}: R1={}, R2={}".format(sample_id, sample.R1, sample.R2) 
+					for sample_id, sample in samples if sample.R1 in missing or sample.R2 in missing
+				)
+			)
+		)
+	return True
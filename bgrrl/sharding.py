@@ -0,0 +1,64 @@
+import os
+from os.path import join, exists, dirname
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+
+def get_shard_dirs(shard_root, nshards):
+	return [join(shard_root, "shard_{}".format(i)) for i in range(1, nshards + 1)]
+
+
+def split_samplesheet(samplesheet, nshards, shard_root):
+	'''
+	Splits samplesheet into (at most) nshards contiguous, equally sized shards.
+	Each shard gets its own directory containing its part of the samplesheet.
+	Returns a list of (shard_dir, shard_samplesheet) tuples.
+	'''
+	with open(samplesheet) as _in:
+		rows = [line for line in _in.read().splitlines() if line]
+
+	nshards = max(1, min(nshards, len(rows)))
+	shard_size, remainder = divmod(len(rows), nshards)
+
+	shards, start = list(), 0
+	for i, shard_dir in enumerate(get_shard_dirs(shard_root, nshards)):
+		end = start + shard_size + (1 if i < remainder else 0)
+		pathlib.Path(shard_dir).mkdir(parents=True, exist_ok=True)
+		shard_sheet = join(shard_dir, "samplesheet.csv")
+		content = "\n".join(rows[start:end]) + "\n"
+		# only rewrite on change, the parse caches are keyed by samplesheet mtime
+		if not exists(shard_sheet) or open(shard_sheet).read() != content:
+			with open(shard_sheet, "wt") as shard_out:
+				shard_out.write(content)
+		shards.append((shard_dir, shard_sheet))
+		start = end
+
+	return shards
+
+
+def run_sharded(func, shard_args):
+	'''Runs func(*args) once per shard, each in its own process. Returns the results in shard order.'''
+	with ProcessPoolExecutor(max_workers=len(shard_args)) as pool:
+		futures = [pool.submit(func, *args) for args in shard_args]
+		return [future.result() for future in futures]
+
+
+def merge_tables(shard_tables, merged_table, header_lines=0):
+	'''
+	Concatenates per-shard tables in shard order.
+	The first header_lines lines are taken from the first shard table that exists and skipped for all others.
+	'''
+	pathlib.Path(dirname(merged_table) or ".").mkdir(parents=True, exist_ok=True)
+	header_written = False
+	with open(merged_table, "wt") as merged_out:
+		for table in shard_tables:
+			if not exists(table):
+				continue
+			with open(table) as _in:
+				for i, line in enumerate(_in):
+					if i < header_lines:
+						if header_written:
+							continue
+					merged_out.write(line)
+			header_written = True
+	return merged_table
@@ -1,5 +1,6 @@
 from enum import Enum, unique
 import os
+import json
 from textwrap import dedent
 
 from snakemake import snakemake
@@ -15,7 +16,6 @@ ETC_DIR = os.path.join(os.path.dirname(__file__), "..", "etc")
 DEFAULT_HPC_CONFIG_FILE = os.path.join(ETC_DIR, "hpc_config.json")
 DEFAULT_CONFIG_FILE = os.path.join(ETC_DIR, "default_config.yaml")
 
-from .capturing import Capturing
 
 
 @unique
@@ -30,6 +30,135 @@ def get_cmd_call(cfg, container):
     call = cfg.get("singularity", dict()).get(container, "")
     return "singularity exec {0} ".format(call) if call and cfg.get("singularity", dict()).get("use_singularity", False) else ""
 
+# small, short-lived rules, which are batched into group jobs when submitting to a scheduler
+# a "group" entry for a rule in the hpc configuration overrides this, an empty group disables batching for the rule
+JOB_GROUPS = {
+	"qc_fastqc_bbduk": "grp_qc_fastqc",
+	"qc_fastqc_bbnorm": "grp_qc_fastqc",
+	"asm_postprocess": "grp_asm_postprocess",
+	"ann_prokka_16S": "grp_ann_prokka_16S",
+	"ann_ratt_prepref": "grp_ann_ratt_ref",
+	"ann_ratt_mergegff": "grp_ann_ratt_ref"
+}
+
+def is_job_process(workflow):
+	"""Whether a Snakefile is parsed by a job (e.g. a cluster job script) rather than by the main snakemake process."""
+	try:
+		from snakemake.common import Mode
+	except ImportError:
+		return False
+	return getattr(workflow, "mode", Mode.default) != Mode.default
+
+
+def snakemake_supports(*params):
+	import inspect
+	parameters = inspect.signature(snakemake).parameters
+	return all(param in parameters for param in params)
+
+def get_total_memory():
+	"""Returns the physical memory of this machine in MB."""
+	try:
+		return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+	except (ValueError, OSError, AttributeError):
+		return 0
+
+
+class RuleResources:
+	"""
+	Provides the per-rule job resources declared in the hpc configuration (section per rule, falling back to __default__).
+	Used in the Snakefiles to declare threads and resources (mem_mb) of each rule, 
+	so that local execution can schedule jobs by memory as well as by cores.
+	"""
+	def __init__(self, cfg):
+		self.hpc_config = dict()
+		hpc_config_file = cfg.get("hpc_config_file", "")
+		if hpc_config_file and os.path.exists(hpc_config_file):
+			with open(hpc_config_file) as hpc_in:
+				self.hpc_config = json.load(hpc_in)
+		# set by the local executor, a job cannot request more memory than is available
+		self.max_mem = int(cfg.get("max_mem_mb", 0))
+
+	def __get(self, rule, key, default=None):
+		return self.hpc_config.get(rule, dict()).get(key, self.hpc_config.get("__default__", dict()).get(key, default))
+
+	def threads(self, rule, default=1):
+		"""Threads are only taken from the hpc configuration if the rule has its own entry, otherwise the rule's default applies."""
+		return int(self.hpc_config.get(rule, dict()).get("c", default))
+
+	def mem_mb(self, rule, default=8000):
+		mem_mb = int(self.__get(rule, "memory", default))
+		return min(mem_mb, self.max_mem) if self.max_mem else mem_mb
+
+	def groups(self):
+		groups = dict(JOB_GROUPS)
+		groups.update((rule, cfg["group"]) for rule, cfg in self.hpc_config.items() if "group" in cfg)
+		return {rule: group for rule, group in groups.items() if group}
+
+COMPRESSION_METHODS = ("gzip", "pigz", "bgzip")
+
+class CompressionPolicy:
+	"""
+	Provides the per-rule compression of read files declared in the compression section of the configuration 
+	(section per rule, falling back to __default__): level (1-9), method (gzip, pigz, bgzip) and threads 
+	(compression threads, default: the rule's threads). Without a policy, the tools' defaults apply.
+	All read files that are kept are gzip-compressed, there is no uncompressed method.
+	"""
+	def __init__(self, cfg):
+		self.policy = cfg.get("compression", dict()) or dict()
+		for rule, policy in self.policy.items():
+			level, method = policy.get("level", 6), policy.get("method", "gzip")
+			if not isinstance(level, int) or not 1 <= level <= 9:
+				raise ValueError("CONFIG ERROR: Invalid compression level for {}: {}. Expected 1-9.".format(rule, level))
+			if method not in COMPRESSION_METHODS:
+				raise ValueError("CONFIG ERROR: Invalid compression method for {}: {}. Expected one of {}.".format(rule, method, ", ".join(COMPRESSION_METHODS)))
+
+	def get(self, rule):
+		policy = dict(self.policy.get("__default__", dict()))
+		policy.update(self.policy.get(rule, dict()))
+		return policy
+
+	def level(self, rule):
+		return self.get(rule).get("level", None)
+
+	def bbtools_args(self, rule):
+		"""Compression options for BBTools (bbduk, bbnorm, reformat)."""
+		policy, args = self.get(rule), list()
+		if "level" in policy:
+			args.append("zl={}".format(policy["level"]))
+		method = policy.get("method", None)
+		if method == "pigz":
+			args.extend(["pigz=t", "unpigz=t"])
+		elif method == "bgzip":
+			args.extend(["bgzip=t", "unbgzip=t"])
+		elif method == "gzip":
+			args.extend(["pigz=f", "unpigz=f"])
+		if "threads" in policy:
+			args.append("zipthreads={}".format(policy["threads"]))
+		return " ".join(args)
+
+	def compress_cmd(self, rule):
+		"""Compression command (stdin -> stdout) for shell rules."""
+		policy = self.get(rule)
+		level, threads = policy.get("level", 6), policy.get("threads", "{threads}")
+		method = policy.get("method", "gzip")
+		if method == "pigz":
+			return "pigz -p {} -{} -c".format(threads, level)
+		if method == "bgzip":
+			return "bgzip -@ {} -l {} -c".format(threads, level)
+		return "gzip -{} -c".format(level)
+
+	def decompress_cmd(self, rule):
+		"""Decompression command (file -> stdout) for shell rules."""
+		policy = self.get(rule)
+		if policy.get("method", "gzip") in ("pigz", "bgzip"):
+			return "pigz -p {} -dc".format(policy.get("threads", "{threads}"))
+		return "gzip -dc"
+
+	def needs_recompression(self, rule, *source_rules):
+		"""Files written by source_rules need recompression in rule, if they may have been compressed at a lower level."""
+		level = self.level(rule)
+		return level is not None and any((self.level(src) or 0) < level for src in source_rules)
+
 def make_exeenv_arg_group(parser, default_hpc_config_file=DEFAULT_HPC_CONFIG_FILE, allow_mode_selection=True, silent=False):  
 	"""
 	This adds a command line option group to the provided parser.  These options help control the external_process process over various architectures and schedulers
@@ -64,6 +193,12 @@ def make_exeenv_arg_group(parser, default_hpc_config_file=DEFAULT_HPC_CONFIG_FIL
 						   help="Maximum number of nodes to use concurrently")
 	hpc_group.add_argument("-c", "--max_cores", type=int, default=200,
 						   help="Maximum number of cores to use concurrently")
+	hpc_group.add_argument("--max_mem", type=int, default=0,
+						   help="Maximum amount of memory (in MB) to use concurrently when running without a scheduler.  Defaults to the physical memory of the machine.")
+	hpc_group.add_argument("--group_size", type=int, default=10,
+						   help="Up to this many small, short-lived jobs (e.g. fastqc, assembly postprocessing) of the same kind are batched into a single submission to the scheduler.  0 disables batching.")
+	hpc_group.add_argument("--array_size", type=int, default=0,
+						   help="SLURM only: Ready jobs of the same rule and resources are submitted as job arrays of up to this many tasks instead of individually (implies --no_drmaa).  0 disables array submission.")
 	hpc_group.add_argument("--hpc_config", default=default_hpc_config_file,
 						   help="Configuration file for the HPC.  Can be used to override what resources and partitions each job uses.")
 	hpc_group.add_argument("--unlock", action='store_true', default=False,
@@ -82,6 +217,12 @@ class ExecutionEnvironment:
 		self.partition = ""
 		self.max_nodes = 1
 		self.max_cores = 4
+		self.max_mem = 0
+		self.group_size = 0
+		self.array_size = 0
+		self.executor = "local"
+		self.log_dir = log_dir
+		self.scheduler = ""
 		self.sub_cmd = ""
 		self.res_cmd = ""
 		self.hpc_config = ""
@@ -92,22 +233,29 @@ class ExecutionEnvironment:
 			self.use_drmaa = not args.no_drmaa
 			self.max_nodes = args.max_nodes
 			self.max_cores = args.max_cores
+			self.max_mem = getattr(args, "max_mem", 0)
+			self.group_size = getattr(args, "group_size", 0)
+			self.array_size = getattr(args, "array_size", 0) if scheduler.upper() == "SLURM" else 0
 			log_prefix = os.path.join(log_dir, now + "{rule}%j_%N")
 			job_name = "{rule}_" + job_suffix if job_suffix and job_suffix != "" else "{rule}"
 			if scheduler.upper() == "LSF":
 				self.sub_cmd = "bsub"
-				self.res_cmd = " -R rusage[mem={cluster.memory}]span[ptile={threads}] -n {threads} -q " + self.partition + " -J " + job_name + " -oo " + log_prefix + ".lsf.log"
+				self.res_cmd = " -R rusage[mem={resources.mem_mb}]span[ptile={threads}] -n {threads} -q " + self.partition + " -J " + job_name + " -oo " + log_prefix + ".lsf.log"
 				self.use_scheduler = True
 			elif scheduler.upper() == "PBS":
 				self.sub_cmd = "qsub"
-				self.res_cmd = " -lselect=1:mem={cluster.memory}MB:ncpus={threads} -q " + self.partition + " -N " + job_name + " -o " + log_prefix + ".pbs.stdout -e " + log_prefix + ".pbs.stderr"
+				self.res_cmd = " -lselect=1:mem={resources.mem_mb}MB:ncpus={threads} -q " + self.partition + " -N " + job_name + " -o " + log_prefix + ".pbs.stdout -e " + log_prefix + ".pbs.stderr"
 				self.use_scheduler = True
 			elif scheduler.upper() == "SLURM":
+				if self.array_size > 0:
+					# array tasks are logged per array job and task
+					log_prefix = os.path.join(log_dir, now + "{rule}%A_%a_%N")
+					self.use_drmaa = False
 				self.sub_cmd = "sbatch"
 				self.res_cmd =	 " -c {threads}" + \
 								" -p " + self.partition + \
 								" --exclude={cluster.exclude}" + \
-								" --mem={cluster.memory}" + \
+								" --mem={resources.mem_mb}" + \
 								" -J " + job_name + \
 								" -o " + log_prefix + ".slurm.log" + \
 								" --time={cluster.time}"
@@ -116,20 +264,168 @@ class ExecutionEnvironment:
 				pass
 			else:
 				raise ValueError("Unexpected scheduler configuration.  Check settings.")
+			if self.use_scheduler:
+				self.scheduler = scheduler.upper()
+		if self.use_scheduler:
+			self.executor = "slurm_array" if self.array_size > 0 else "cluster"
+		elif not self.max_mem:
+			self.max_mem = get_total_memory()
 
 	def __str__(self):
 		return '\n'.join([
 			"Use scheduler: " + str(self.use_scheduler),
 			"Use DRMAA: " + str(self.use_drmaa),
+			"Executor: " + self.executor,
 			"Submission command: " + self.sub_cmd,
 			"Resource command: " + self.res_cmd,
 			"Partition: " + self.partition,
 			"Max nodes: " + str(self.max_nodes),
 			"Max cores: " + str(self.max_cores),
+			"Max memory (MB): " + (str(self.max_mem) if self.max_mem else "n/a"),
+			"Job group size: " + (str(self.group_size) if self.use_scheduler and self.group_size > 0 else "n/a"),
+			"Job array size: " + (str(self.array_size) if self.array_size > 0 else "n/a"),
 			"HPC configuration file: " + self.hpc_config
 		])
 
 
+class Executor:
+	"""Translates an ExecutionEnvironment into the snakemake options controlling how jobs are executed."""
+	def __init__(self, exe_env):
+		self.exe_env = exe_env
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		return False
+
+	def get_snakemake_args(self):
+		raise NotImplementedError
+
+
+class ClusterExecutor(Executor):
+	"""
+	Submits jobs to the scheduler (LSF, PBS, SLURM), either via DRMAA or via the submission command.
+	Jobs of grouped rules are batched into submissions of up to group_size jobs (connected components), 
+	which requests the combined threads and memory (resources: mem_mb) of its jobs.
+	Without DRMAA, jobs are submitted and checked via bin/cluster_status.py, which queries the status of all
+	outstanding jobs in a single scheduler call per interval and shares the answers between the status checks.
+	"""
+	STATUS_SCRIPT = os.path.join(os.path.dirname(__file__), "bin", "cluster_status.py")
+
+	def __enter__(self):
+		self.status_dir = None
+		if not self.exe_env.use_drmaa:
+			from tempfile import mkdtemp
+			os.makedirs(self.exe_env.log_dir, exist_ok=True)
+			self.status_dir = mkdtemp(prefix="status_cache_", dir=self.exe_env.log_dir)
+		return self
+
+	def __exit__(self, *exc_info):
+		# the status cache is only needed while snakemake is running
+		if self.status_dir:
+			import shutil
+			shutil.rmtree(self.status_dir, ignore_errors=True)
+		return False
+
+	def get_snakemake_args(self):
+		import sys
+		exe_env = self.exe_env
+		args = dict(
+			cores=exe_env.max_cores,
+			local_cores=exe_env.max_cores,
+			nodes=exe_env.max_nodes,
+			cluster_config=exe_env.hpc_config,
+			cluster=None,
+			drmaa=exe_env.res_cmd if exe_env.use_drmaa else None,
+			latency_wait=60
+		)
+		if getattr(self, "status_dir", None):
+			call = "{} {} ".format(sys.executable, self.STATUS_SCRIPT)
+			args.update(
+				cluster=call + "submit {} {} {}".format(self.status_dir, exe_env.scheduler, exe_env.sub_cmd) + exe_env.res_cmd,
+				cluster_status=call + "status {} {}".format(self.status_dir, exe_env.scheduler)
+			)
+		elif not exe_env.use_drmaa:
+			args.update(cluster=exe_env.sub_cmd + exe_env.res_cmd)
+		if exe_env.group_size > 0:
+			if snakemake_supports("overwrite_groups", "group_components"):
+				groups = RuleResources({"hpc_config_file": exe_env.hpc_config}).groups()
+				args.update(
+					overwrite_groups=groups,
+					group_components={group: exe_env.group_size for group in set(groups.values())}
+				)
+			else:
+				print("WARNING: The installed snakemake does not support job groups. Small jobs will be submitted individually.")
+		return args
+
+
+class LocalExecutor(Executor):
+	"""
+	Runs jobs as local processes. Jobs are scheduled by the threads and memory (resources: mem_mb) 
+	declared for each rule, such that the running jobs never exceed max_cores and max_mem.
+	"""
+	def get_snakemake_args(self):
+		exe_env = self.exe_env
+		args = dict(
+			cores=exe_env.max_cores,
+			local_cores=exe_env.max_cores,
+			nodes=exe_env.max_nodes,
+			latency_wait=1
+		)
+		if exe_env.max_mem:
+			args.update(resources={"mem_mb": exe_env.max_mem}, config={"max_mem_mb": exe_env.max_mem})
+		return args
+
+
+class SlurmArrayExecutor(ClusterExecutor):
+	"""
+	Collects the ready jobs of each rule and resource class and submits them as SLURM job arrays.
+	Snakemake's submission command only queues the job script (bin/slurm_array.py submit) in a spool directory, 
+	from which a dispatcher thread submits the arrays. Job status is tracked per array task (batched sacct queries, see ClusterExecutor).
+	"""
+	SCRIPT = os.path.join(os.path.dirname(__file__), "bin", "slurm_array.py")
+
+	def __enter__(self):
+		from tempfile import mkdtemp
+		from .bin.slurm_array import ArrayDispatcher
+		os.makedirs(self.exe_env.log_dir, exist_ok=True)
+		self.spool_dir = mkdtemp(prefix="array_spool_", dir=self.exe_env.log_dir)
+		self.dispatcher = ArrayDispatcher(self.spool_dir, sub_cmd=self.exe_env.sub_cmd, array_size=self.exe_env.array_size)
+		self.dispatcher.start()
+		return self
+
+	def __exit__(self, *exc_info):
+		import shutil
+		self.dispatcher.stop()
+		shutil.rmtree(self.spool_dir, ignore_errors=True)
+		return False
+
+	def get_snakemake_args(self):
+		import sys
+		args = super().get_snakemake_args()
+		call = "{} {} ".format(sys.executable, self.SCRIPT)
+		args.update(
+			cluster=call + "submit " + self.spool_dir + self.exe_env.res_cmd,
+			cluster_status=call + "status " + self.spool_dir,
+			drmaa=None
+		)
+		return args
+
+
+EXECUTORS = {
+	"cluster": ClusterExecutor,
+	"slurm_array": SlurmArrayExecutor,
+	"local": LocalExecutor
+}
+
+def get_executor(exe_env):
+	try:
+		return EXECUTORS[exe_env.executor](exe_env)
+	except KeyError:
+		raise ValueError("Unknown executor: {}. Valid executors: {}.".format(exe_env.executor, ", ".join(sorted(EXECUTORS))))
+
+
 def loadPreCmd(*args):
 	
 	"""Used to prefix a shell command that utilises some external software with another command used
@@ -148,69 +444,40 @@ def loadPreCmd(*args):
 	return final_command
 
 
-def run_snakemake(snakefile, out_dir, cfg_file, exe_env, dryrun=False, unlock=False):
+def run_snakemake(snakefile, out_dir, cfg_file, exe_env, dryrun=False, unlock=False, workdir=".", targets=None, log_handler=None):
 	"""Helper function for calling external_process pipeline.  This helps us deal with all the different options that we
-	might want to switch between running in dryrun and regular mode."""
-	res = False
+	might want to switch between running in dryrun and regular mode.
+	In dryrun mode, the jobs are only reported (to log_handler, if given) but not executed."""
+	handler_args = dict()
+	if log_handler is not None:
+		# older snakemake versions take a single log handler, newer ones a list of handlers
+		import inspect
+		default_handler = inspect.signature(snakemake).parameters["log_handler"].default
+		handler_args["log_handler"] = [log_handler] if isinstance(default_handler, list) else log_handler
+
 	if dryrun:
 		print("Dry run requested.  Will not execute tasks.")
 		print()
-		with Capturing() as output:
-			res = snakemake(snakefile,
-							cores=exe_env.max_cores,
-							nodes=exe_env.max_nodes,
-							configfile=cfg_file,
-							workdir=".",
-							unlock=unlock,
-							# force_incomplete=args.force_incomplete,
-							# detailed_summary=args.detailed_summary,
-							# list_resources=args.list_resources,
-							latency_wait=60 if exe_env.use_scheduler else 1,
-							printdag=dryrun,
-							dryrun=False,
-							forceall=dryrun,
-							# allowed_rules=args.allowed_rules
-							)
-		if res:
-			dag_file = os.path.join(out_dir,
-									"eicore-" + os.path.basename(snakefile).split('.')[0] + "_dag-" + NOW + ".dot")
-			print("Saving DAG of pipeline to " + dag_file + " ... ", end="", flush=True)
-			with open(dag_file, 'w') as df:
-				print("\n".join(output), file=df)
-			print("done.")
-		else:
-			print("Error occured processing Illumina PAP:\n" + "\n".join(output))
-
-	else:
-
-		cluster_cfg = exe_env.hpc_config if exe_env.use_scheduler else None
-		cluster = (
-			exe_env.sub_cmd + exe_env.res_cmd if not exe_env.use_drmaa else None) if exe_env.use_scheduler else None
-		drmaa = exe_env.res_cmd if exe_env.use_drmaa else None
+
+	with get_executor(exe_env) as executor:
 		res = snakemake(snakefile,
-						cores=exe_env.max_cores,
-						local_cores=exe_env.max_cores,
-						nodes=exe_env.max_nodes,
+						targets=targets,
 						configfile=cfg_file,
-						workdir=".",
-						cluster_config=cluster_cfg,
-						cluster=cluster,
-						drmaa=drmaa,
+						workdir=workdir,
 						unlock=unlock,
 						printshellcmds=True,
 						printreason=True,
-						stats=os.path.join(out_dir, os.path.basename(snakefile) + "-" + NOW + ".stats"),
+						stats=None if dryrun else os.path.join(out_dir, os.path.basename(snakefile) + "-" + NOW + ".stats"),
 						jobname="eicore.{rulename}.{jobid}",
 						force_incomplete=True,
 						# detailed_summary=args.detailed_summary,
 						# list_resources=True,
-						latency_wait=60 if exe_env.use_scheduler or exe_env.use_drmaa else 1,
-						printdag=dryrun,
 						dryrun=dryrun,
-						forceall=dryrun,
-						verbose=True,
+						verbose=not dryrun,
 						use_conda=True,
-						use_singularity=True
+						use_singularity=True,
 						# allowed_rules=args.allowed_rules
+						**handler_args,
+						**executor.get_snakemake_args()
 						)
 	return res
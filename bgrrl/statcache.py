@@ -0,0 +1,92 @@
+import os
+from os.path import dirname, basename, exists
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+VERIFY_THREADS = 16
+STAT_BATCH_SIZE = 256
+
+
+class StatCache(object):
+	'''
+	Existence/stat cache for input files on slow (network) filesystems.
+	Each parent directory is listed once and files are stat'ed concurrently in a bounded thread pool.
+	Existence is always taken from a fresh listing of the parent directory. The (mtime, size) of each file is stored
+	together with the mtime of its parent directory and files are only re-stat'ed if their directory has changed,
+	if they are symlinks (the target may have disappeared) or if they were empty (placeholders that are filled in place).
+	'''
+	def __init__(self, cache_file=None, threads=VERIFY_THREADS):
+		self.cache_file = cache_file
+		self.threads = max(1, threads)
+		self.dirs, self.files = dict(), dict()
+		if cache_file and exists(cache_file):
+			try:
+				with open(cache_file) as cache_in:
+					data = json.load(cache_in)
+				self.dirs, self.files = data.get("dirs", dict()), data.get("files", dict())
+			except (ValueError, OSError):
+				self.dirs, self.files = dict(), dict()
+
+	def save(self):
+		if self.cache_file:
+			tmp_file = self.cache_file + ".tmp"
+			with open(tmp_file, "wt") as cache_out:
+				json.dump({"dirs": self.dirs, "files": self.files}, cache_out)
+			os.replace(tmp_file, self.cache_file)
+
+	@staticmethod
+	def _list_dir(_dir):
+		try:
+			mtime = os.stat(_dir).st_mtime
+			with os.scandir(_dir) as entries:
+				return _dir, mtime, dict((entry.name, entry.is_symlink()) for entry in entries)
+		except OSError:
+			return _dir, None, dict()
+
+	@staticmethod
+	def _stat_files(paths):
+		stats = list()
+		for path in paths:
+			try:
+				st = os.stat(path)
+			except OSError:
+				st = None
+			stats.append((path, (st.st_mtime, st.st_size) if st is not None else None))
+		return stats
+
+	def verify(self, paths):
+		'''Returns the set of paths that do not exist.'''
+		by_dir = OrderedDict()
+		for path in set(paths):
+			by_dir.setdefault(dirname(path) or ".", list()).append(path)
+
+		missing, to_stat = set(), list()
+		with ThreadPoolExecutor(max_workers=self.threads) as pool:
+			for _dir, mtime, entries in pool.map(StatCache._list_dir, by_dir):
+				if mtime is None:
+					missing.update(by_dir[_dir])
+					self.dirs.pop(_dir, None)
+					continue
+				reuse = self.dirs.get(_dir, None) == mtime
+				self.dirs[_dir] = mtime
+				for path in by_dir[_dir]:
+					is_link = entries.get(basename(path), None)
+					if is_link is None:
+						missing.add(path)
+						self.files.pop(path, None)
+					elif is_link or not (reuse and self.files.get(path, (0, 0))[1] > 0):
+						# symlinks need a stat to resolve their target, empty files may have been filled in place
+						to_stat.append(path)
+
+			batches = [to_stat[i:i + STAT_BATCH_SIZE] for i in range(0, len(to_stat), STAT_BATCH_SIZE)]
+			for stats in pool.map(StatCache._stat_files, batches):
+				for path, stat in stats:
+					if stat is None:
+						missing.add(path)
+						self.files.pop(path, None)
+					else:
+						self.files[path] = stat
+
+		return missing
@@ -0,0 +1,115 @@
+# annotation rules (prokka, ratt annotation transfer)
+# included by bgasm.smk.py and bgfull.smk.py, which define the i/o directories,
+# RATT_REF_PATH, REF_PREFIXES, TIME_V, CMD_CALL, CONTAINER_PARAM and RESOURCES
+
+def get_ref(wc):
+	if len(REF_PREFIXES[wc.ref_ann]) > 1:
+		return [join(RATT_REF_PATH, wc.ref_ann, "gff", "{}.{}.parts_gff".format(wc.ref_ann, index)) for index in REF_PREFIXES[wc.ref_ann]]
+	else:
+		return [join(RATT_REF_PATH, wc.ref_ann, "gff", "{}.parts_gff".format(wc.ref_ann))]
+
+
+if config["run_prokka"]:
+	rule ann_prokka:
+		message:
+			"Running de novo gene/functional annotation with prokka (incl. barrnap)..."
+		input:
+			contigs = join(ASSEMBLY_DIR, "{sample}", "{sample}.assembly.fasta")
+		output:
+			log = join(PROKKA_DIR, "{sample}", "{sample}.log"),
+			faa = join(PROKKA_DIR, "{sample}", "{sample}.faa"),
+			ffn = join(PROKKA_DIR, "{sample}", "{sample}.ffn"),
+			gff = join(PROKKA_DIR, "{sample}", "{sample}.gff"),
+			fna = join(PROKKA_DIR, "{sample}", "{sample}.fna")
+		log:
+			join(ANNOTATION_DIR, "log", "{sample}_ann_prokka.log")
+		params:
+			outdir = lambda wildcards: join(PROKKA_DIR, wildcards.sample),
+			prefix = lambda wildcards: wildcards.sample,
+			centre = config["misc"]["seqcentre"],
+			container = CONTAINER_PARAM,
+			custom_proteins = ("--proteins " + config["custom_prokka_proteins"]) if config.get("custom_prokka_proteins", "") else ""
+		threads:
+			RESOURCES.threads("ann_prokka", 8)
+		resources:
+			mem_mb = RESOURCES.mem_mb("ann_prokka")
+		shell:
+			"(" + TIME_V + " prokka_wrapper {input.contigs} {params.container} --prefix {params.prefix} --outdir {params.outdir} --seq-centre {params.centre} --force --threads {threads}" + \
+            " {params.custom_proteins} && " + \
+			" touch {PROKKA_DIR}/{wildcards.sample}/{wildcards.sample}.txt && " + \
+			" sed -i \"s/strain/{wildcards.sample}/\" {PROKKA_DIR}/{wildcards.sample}/{wildcards.sample}.txt" + \
+			") &> {log}"
+
+	rule ann_prokka_16S:
+		message:
+			"Extracting 16S rRNA sequences from barrnap-annotation..."
+		input:
+			ffn = join(PROKKA_DIR, "{sample}", "{sample}.ffn")
+		output:
+			ffn = join(PROKKA_DIR, "{sample}", "{sample}.ffn.16S")
+		params:
+			cmd = CMD_CALL + "seqtk"
+		resources:
+			mem_mb = RESOURCES.mem_mb("ann_prokka_16S")
+		shell:
+			"{params.cmd} subseq {input.ffn} <(grep -o \">[^ ]\+ 16S ribosomal RNA\" {input.ffn} | cut -f 1 -d \" \" | cut -f 2 -d \>) > {output.ffn}"
+
+
+if config["run_ratt"]:
+	rule ann_ratt_prepref:
+		message:
+			"Preprocessing reference annotations for ratt-annotation transfer..."
+		input:
+			embl_ref = join(RATT_REF_PATH, "{ref_ann}", "{prefix}.embl")
+		output:
+			join(RATT_REF_PATH, "{ref_ann}", "gff", "{prefix}.parts_gff")
+		params:
+			refdir = join(RATT_REF_PATH, "{ref_ann}"),
+			cmd = CMD_CALL + "seqret"			
+		threads:
+			RESOURCES.threads("ann_ratt_prepref", 1)
+		resources:
+			mem_mb = RESOURCES.mem_mb("ann_ratt_prepref")
+		shell:
+			"cd {params.refdir} && " + \
+			"{params.cmd} -sequence $(basename {input.embl_ref}) -outseq $(basename {input.embl_ref} .embl).$(basename {input.embl_ref} .embl | sed 's/\./_x_/g').gff -offormat gff -feature && " + \
+			"rm $(basename {input.embl_ref} .embl).$(basename {input.embl_ref} .embl | sed 's/\./_x_/g').gff && " + \
+			"mkdir -p gff && mv $(basename {input.embl_ref} .embl | sed 's/\./_x_/g').gff gff/$(basename {input.embl_ref} .embl | sed 's/_x_/./g').parts_gff && cd -" 
+
+	rule ann_ratt_mergegff:
+		message:
+			"Merging single-gene .gffs of ratt-annotation transfer reference..."
+		input:
+			gff = get_ref
+		output:
+			join(config["ratt_reference"], "{ref_ann}", "gff", "{ref_ann}.gff")
+		log:
+			join(ANNOTATION_DIR, "log", "{ref_ann}.ann_ratt_mergegff.log")
+		params:
+			gffdir = join(RATT_REF_PATH, "{ref_ann}", "gff")
+		threads:
+			RESOURCES.threads("ann_ratt_mergegff", 1)
+		resources:
+			mem_mb = RESOURCES.mem_mb("ann_ratt_mergegff")
+		shell:
+			"cat {input.gff} > {output}"
+
+	rule ann_ratt:
+		message:
+			"Running annotation-transfer with ratt..."
+		input:
+			contigs = rules.ann_prokka.output.fna,# join(PROKKA_DIR, "{sample}", "{sample}.ffn"),
+			reference = join(RATT_REF_PATH, "{ref_ann}")
+		output:
+			done = join(RATT_DIR, "{sample}", "{ref_ann}", "{sample}_{ref_ann}.final.gff")
+		log:
+			join(ANNOTATION_DIR, "log", "{sample}_{ref_ann}.ann_ratt.log")
+		params:	
+			outdir = lambda wildcards: join(RATT_DIR, wildcards.sample, wildcards.ref_ann),
+			container = CONTAINER_PARAM, 
+		threads:
+			RESOURCES.threads("ann_ratt", 1)
+		resources:
+			mem_mb = RESOURCES.mem_mb("ann_ratt")
+		shell:
+			"ratt_wrapper {params.container} -o {params.outdir} {input.contigs} {input.reference} some_dummy_path &> {log}"
@@ -0,0 +1,54 @@
+# assembly rules
+# included by bgasm.smk.py and bgfull.smk.py, which define the i/o directories,
+# TIME_V, CMD_CALL, CONTAINER_PARAM, RESOURCES, ASSEMBLY_RACE and get_asm_reads
+
+def get_asm_read_param(wc, mate):
+	# (R1, R2) or (R1norm, R1trim, R2norm, R2trim): comma-separated main and fallback reads of a mate for asm_wrapper
+	reads = get_asm_reads(wc)
+	n = len(reads) // 2
+	return ",".join(reads[:n] if mate == "R1" else reads[n:])
+
+rule asm_assembly:
+	message:
+		"Generating assembly with " + config["assembler"] + "..."
+	input:
+		get_asm_reads
+	output:
+		join(ASSEMBLY_DIR, "{sample}", "assembly.fasta")
+	log:
+		join(ASSEMBLY_DIR, "log", "{sample}.asm_assembly.log")
+	params:
+		outdir = lambda wildcards: join(ASSEMBLY_DIR, wildcards.sample),
+		assembly = lambda wildcards: join(ASSEMBLY_DIR, wildcards.sample, "assembly.fasta"),
+		assembler = config["assembler"],
+		r1 = lambda wildcards: get_asm_read_param(wildcards, "R1"),
+		r2 = lambda wildcards: get_asm_read_param(wildcards, "R2"),
+		container = CONTAINER_PARAM,
+		# main and fallback assembly stages race within the job's allocation
+		race = "--race {} --mem-mb {}".format(ASSEMBLY_RACE, RESOURCES.mem_mb("asm_assembly")) if ASSEMBLY_RACE > 1 else ""
+	threads:
+		RESOURCES.threads("asm_assembly", 8)
+	resources:
+		mem_mb = RESOURCES.mem_mb("asm_assembly")
+	shell:
+		TIME_V + " asm_wrapper --threads {threads} {params.race} {params.container} {params.assembler} {params.r1} {params.r2} {params.outdir} &> {log}"
+
+rule asm_postprocess:
+	message:
+		"Postprocessing assembly (minimum contig length={})...".format(config["asm_lengthfilter_contig_minlen"]) 
+	input:
+		assembly = join(ASSEMBLY_DIR, "{sample}", "assembly.fasta")
+	output:
+		filtered_assembly = join(ASSEMBLY_DIR, "{sample}", "{sample}.assembly.fasta")
+	log:
+		join(ASSEMBLY_DIR, "log", "{sample}.asm_postprocess.log")
+	params:
+		minlen = int(config["asm_lengthfilter_contig_minlen"]),
+		cmd = CMD_CALL + "reformat.sh"
+	threads:
+		RESOURCES.threads("asm_postprocess", 1)
+	resources:
+		mem_mb = RESOURCES.mem_mb("asm_postprocess")
+	shell:
+		TIME_V + " {params.cmd}" + \
+		" in={input.assembly} out={output[0]} minlength={params.minlen} &> {log}"
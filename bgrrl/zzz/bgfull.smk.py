@@ -0,0 +1,120 @@
+import sys
+import csv
+import os
+import json
+from os.path import join, basename, dirname
+
+from snakemake.utils import min_version
+# per-sample gating requires checkpoints
+min_version("5.4")
+
+from bgrrl.parse_cache import load_parse_data, get_survey_targets, get_asm_targets, get_gate_dir
+from bgrrl.snakemake_helper import get_cmd_call, RuleResources, CompressionPolicy, is_job_process
+from bgrrl.bin.qc_eval import getNormalizationFile, readNormalizationPolicy
+
+DEBUG = config.get("debugmode", False)
+SKIP_NORMALIZATION = config.get("no_normalization", False)
+STREAM_PREPROCESSING = config.get("stream_preprocessing", False)
+STREAM_SCRATCH_DIR = config.get("stream_scratch_dir", "")
+ADAPTIVE_NORMALIZATION = config.get("adaptive_normalization", False)
+RUN_KAT = config.get("run_kat", False)
+SURVEY_COVERAGE = float(config.get("survey_coverage", 0))
+SURVEY_GENOME_SIZE = float(config.get("survey_genome_size", 5e6))
+SURVEY_SEED = int(config.get("survey_subsample_seed", 42))
+ASSEMBLY_RACE = int(config.get("assembly_race", 1))
+
+TIME_V = config.get("tools", dict()).get("time", "time")
+
+# set up i/o
+OUTPUTDIR = os.path.abspath(config["out_dir"])
+QC_OUTDIR = join(OUTPUTDIR, "qc")
+QC_LOGDIR = join(QC_OUTDIR, "log")
+FASTQC_DIR = join(QC_OUTDIR, "fastqc")
+BBDUK_DIR = join(QC_OUTDIR, "bbduk")
+KAT_DIR = join(QC_OUTDIR, "kat")
+BBNORM_DIR = join(QC_OUTDIR, "bbnorm")
+TADPOLE_DIR = join(QC_OUTDIR, "tadpole")
+GATE_DIR = get_gate_dir(config)
+REPORT_DIR = join(OUTPUTDIR, "reports")
+ASSEMBLY_DIR = join(OUTPUTDIR, "assembly")
+ANNOTATION_DIR = join(OUTPUTDIR, "annotation")
+PROKKA_DIR = join(ANNOTATION_DIR, "prokka")
+RATT_DIR = join(ANNOTATION_DIR, "ratt")
+
+if config["module"] != "bgfull":
+	raise ValueError("Module not recognized as bgfull: " + config["module"])
+
+INPUTFILES, TARGETS, REF_PREFIXES = load_parse_data(config, targets=not is_job_process(workflow))
+if config["run_ratt"]:
+	RATT_REF_PATH = os.path.abspath(config.get("ratt_reference", "."))
+
+MIN_TADPOLE_SIZE = int(config.get("minimum_survey_assembly_size", 1e6))
+
+# define normalization/no-normalization behaviour
+if SKIP_NORMALIZATION:
+	PRIMARY_READDIR = BBDUK_DIR
+	SECONDARY_READDIR = BBDUK_DIR
+	PRIMARY_READ_ID = "bbduk"
+	SECONDARY_READ_ID = "bbduk"
+else:
+	PRIMARY_READDIR = BBNORM_DIR
+	SECONDARY_READDIR = BBDUK_DIR
+	PRIMARY_READ_ID = "bbnorm"
+	SECONDARY_READ_ID = "bbduk"
+
+if DEBUG:
+	with open("full-inputfiles.txt", "w") as input_out:
+		print(*INPUTFILES.values(), sep="\n", file=input_out)
+	with open("full-targets.txt", "w") as targets_out:
+		print(*TARGETS, sep="\n", file=targets_out)
+
+
+# helpers
+def get_raw_reads(wc):
+	return INPUTFILES[wc.sample].R1, INPUTFILES[wc.sample].R2
+
+def is_passthrough(sample):
+	policy = readNormalizationPolicy(getNormalizationFile(QC_OUTDIR, sample)) if ADAPTIVE_NORMALIZATION else None
+	return policy is not None and policy["mode"] == "passthrough"
+
+def get_asm_reads(wc):
+	# same order as the ASM samplesheet based input of bgasm
+	trimmed = [join(BBDUK_DIR, wc.sample, "{}_{}.bbduk.fastq.gz".format(wc.sample, mate)) for mate in ("R1", "R2")]
+	# samples whose reads were passed through by adaptive normalization are assembled from the trimmed reads only
+	if SKIP_NORMALIZATION or is_passthrough(wc.sample):
+		return trimmed
+	normalized = [join(BBNORM_DIR, wc.sample, "{}_{}.bbnorm.fastq.gz".format(wc.sample, mate)) for mate in ("R1", "R2")]
+	return normalized[0], trimmed[0], normalized[1], trimmed[1]
+
+def get_sample_targets(wc):
+	# assembly/annotation of a sample is only requested once its own survey gate has passed
+	targets = get_survey_targets([wc.sample], config)
+	with open(checkpoints.qc_gate.get(sample=wc.sample).output.verdict) as verdict_in:
+		passed = json.load(verdict_in)["passed"]
+	if passed:
+		targets.extend(get_asm_targets([wc.sample], config, REF_PREFIXES))
+	return targets
+
+CMD_CALL = get_cmd_call(config, "bgrrl_container")
+RESOURCES = RuleResources(config)
+COMPRESSION = CompressionPolicy(config)
+CONTAINER_PARAM = ("--singularity-container " + " ".join(CMD_CALL.split(" ")[2:])) if CMD_CALL else ""
+
+
+### RULES ###
+
+localrules: all, qc_pregate, qc_gate, qc_survey_sample, full_sample
+
+rule all:
+	input: TARGETS
+
+include: "bgsurvey.rules.smk"
+
+include: "bgasm.rules.smk"
+include: "bgann.rules.smk"
+
+rule full_sample:
+	input:
+		get_sample_targets
+	output:
+		touch(join(GATE_DIR, "{sample}", "{sample}.done"))
@@ -4,12 +4,14 @@ import os
 from os.path import join, basename, dirname
 import glob
 
-from bgrrl.snakemake_helper import loadPreCmd
+from bgrrl.snakemake_helper import loadPreCmd, RuleResources, CompressionPolicy
 
 DEBUG = config.get("debugmode", False)
 # needed for tar-ball generation
 EB_ORGANISMS = config.get("enterobase_groups", list())  # ["Salmonella"]
 CWD = os.getcwd()
+RESOURCES = RuleResources(config)
+COMPRESSION = CompressionPolicy(config)
 
 # setup i/o
 INPUTDIR = config["out_dir"]
@@ -70,6 +72,8 @@ if EB_ORGANISMS:
 			package_dir = lambda wildcards: join(OUTPUTDIR, config["project_prefix"] + "_" + wildcards.organism + "_assemblies"),
 			outdir = basename(INPUTDIR),
 			prefix = config["project_prefix"]
+		resources:
+			mem_mb = RESOURCES.mem_mb("fin_compile_assembly")
 		shell:
 			"mkdir -p {params.package_dir} &&" + \
 			" (for s in $(cat {input.eb_samples}); do" + \
@@ -92,6 +96,8 @@ if EB_ORGANISMS:
 		params:
 			outdir = lambda wildcards: join(OUTPUTDIR, config["project_prefix"] + "_" + wildcards.organism + "_rawreads"),
 			prefix = config["project_prefix"]
+		resources:
+			mem_mb = RESOURCES.mem_mb("fin_compile_reads")
 		shell:
 			"mkdir -p {params.outdir} &&" + \
 			" (for r in $(grep -F -f {input.eb_samples} {input.samplesheet} | cut -f 3 -d ,); do" + \
@@ -107,6 +113,12 @@ if EB_ORGANISMS:
 
 elif config["package_mode"] == "processed_reads" or "processed_reads" in config["package_mode"]:
 
+	# processed reads written at a fast compression level are recompressed at the package level
+	if COMPRESSION.needs_recompression("fin_package_processed_reads", "qc_bbduk"):
+		PACKAGE_READ = COMPRESSION.decompress_cmd("fin_package_processed_reads") + " $r | " + COMPRESSION.compress_cmd("fin_package_processed_reads") + " > {params.outdir}/$(basename $r)"
+	else:
+		PACKAGE_READ = "ln -sf ../../$r {params.outdir}/$(basename $r)"
+
 	rule fin_package_processed_reads:
 		message:
 			"Packaging processed_reads..."
@@ -117,12 +129,16 @@ elif config["package_mode"] == "processed_reads" or "processed_reads" in config[
 		params:
 			outdir = lambda wildcards: join(OUTPUTDIR, config["project_prefix"] + "_processed_reads"),
 			prefix = config["project_prefix"]
+		threads:
+			RESOURCES.threads("fin_package_processed_reads", 8)
+		resources:
+			mem_mb = RESOURCES.mem_mb("fin_package_processed_reads")
 		shell:
 			"mkdir -p {params.outdir}" + \
 			" && (for r in $(cut -f 11 -d , {input.samplesheet}); do" + \
-			" ln -sf ../../$r {params.outdir}/$(basename $r);" + \
+			" " + PACKAGE_READ + ";" + \
 			" r=$(dirname $r)/$(basename $r _R1.bbduk.fastq.gz)_R2.bbduk.fastq.gz;" + \
-			" ln -sf ../../$r {params.outdir}/$(basename $r); done)" + \
+			" " + PACKAGE_READ + "; done)" + \
 			" && cd " + OUTPUTDIR + \
 			" && tar chvzf $(basename {params.outdir}).tar.gz $(basename {params.outdir})" + \
 			" && cd " + CWD + \
@@ -142,6 +158,8 @@ if config["package_mode"] == "analysis" or "analysis" in config["package_mode"]:
 		params:
 			outdir = lambda wildcards: join(OUTPUTDIR, config["project_prefix"] + "_analysis"),
 			prefix = config["project_prefix"]
+		resources:
+			mem_mb = RESOURCES.mem_mb("fin_package_analysis")
 		shell:
 			"mkdir -p {params.outdir}" + \
 			" && cd {params.outdir}" + \
@@ -174,6 +192,8 @@ if config["package_mode"] == "asm" or "asm" in config["package_mode"]:
 			package_dir = lambda wildcards: join(OUTPUTDIR, config["project_prefix"] + "_assemblies"),
 			outdir = basename(INPUTDIR),
 			prefix = config["project_prefix"]
+		resources:
+			mem_mb = RESOURCES.mem_mb("fin_package_assembly")
 		shell:
 			"mkdir -p {params.package_dir} &&" + \
 			" (for s in $(tail -n +2 {input.samples} | cut -f 1 | grep -v _broken); do" + \
@@ -218,6 +238,8 @@ if config["package_mode"] == "ann" or "ann" in config["package_mode"]:
 				outdir = basename(INPUTDIR),
 				prefix = config["project_prefix"],
 				lcmd = link_command
+			resources:
+				mem_mb = RESOURCES.mem_mb("fin_package_annotation")
 			shell:
 				"mkdir -p {params.package_dir}" + \
 				" && cwd=$(pwd)" + \
@@ -242,6 +264,8 @@ if config["package_mode"] == "ann" or "ann" in config["package_mode"]:
 				package_dir = lambda wildcards: join(OUTPUTDIR, config["project_prefix"] + "_annotation"),
 				outdir = basename(INPUTDIR),
 				prefix = config["project_prefix"]
+			resources:
+				mem_mb = RESOURCES.mem_mb("fin_package_annotation")
 			shell:
 				"mkdir -p {params.package_dir}/ratt/{{reports,gff}}" + \
 				" && ln -sf ../../{params.outdir}/annotation/prokka {params.package_dir}/prokka" + \
@@ -268,6 +292,8 @@ if config["package_mode"] == "ann" or "ann" in config["package_mode"]:
 				package_dir = lambda wildcards: join(OUTPUTDIR, config["project_prefix"] + "_ratt_annotation"),
 				outdir = basename(INPUTDIR),
 				prefix = config["project_prefix"]
+			resources:
+				mem_mb = RESOURCES.mem_mb("fin_package_annotation_make_ratt_batches")
 			run:
 				import pathlib
 				batchid = 0
@@ -292,6 +318,8 @@ if config["package_mode"] == "ann" or "ann" in config["package_mode"]:
 				outdir = OUTPUTDIR, 
 				prefix = config["project_prefix"],
 				indir = dirname("{input.goflag}")
+			resources:
+				mem_mb = RESOURCES.mem_mb("fin_package_annotation_ratt_tarballs")
 			shell:
 				"""
 				cd {params.outdir} &&
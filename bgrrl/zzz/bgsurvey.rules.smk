@@ -0,0 +1,402 @@
+# survey rules (read preprocessing, survey assembly, k-mer analysis)
+# included by bgsurvey.smk.py and bgfull.smk.py, which define the i/o directories,
+# PRIMARY_READDIR/PRIMARY_READ_ID, SKIP_NORMALIZATION, STREAM_PREPROCESSING, STREAM_SCRATCH_DIR, ADAPTIVE_NORMALIZATION, RUN_KAT, SURVEY_COVERAGE, SURVEY_GENOME_SIZE, SURVEY_SEED,
+# TIME_V, CMD_CALL, RESOURCES, COMPRESSION and get_raw_reads
+
+from bgrrl.samplesheet import RAW_SAMPLE_FIELDS
+from bgrrl.parse_cache import get_post_pregate_targets
+from bgrrl.bin.qc_eval import writeVerdict, appendVerdict, getASMSampleData, writeNormalizationPolicy, readNormalizationPolicy, writePregate, readPregate
+
+BBNORM_PARAMS = dict(param.split("=", 1) for param in config["params"]["bbnorm"].split() if "=" in param)
+
+# the k-mer analysis (peaks, genome size, coverage) is taken from bbnorm's k-mer histogram of the trimmed reads,
+# kat is only run if there is no such histogram for every sample (--no-normalization, --adaptive-normalization) or on request
+KHIST_ANALYSIS = not (SKIP_NORMALIZATION or ADAPTIVE_NORMALIZATION or RUN_KAT)
+
+if STREAM_PREPROCESSING and not SKIP_NORMALIZATION and not ADAPTIVE_NORMALIZATION:
+	# bbduk streams the trimmed reads (interleaved, uncompressed) into reformat, which writes the compressed
+	# bbduk output once, and into an uncompressed scratch copy (STREAM_SCRATCH_DIR, default: $TMPDIR), from which bbnorm reads.
+	# bbnorm reads its input twice (k-mer counting, normalization), hence it cannot read from a pipe.
+	# If the scratch directory has less free space than 4x the compressed input reads, bbnorm reads the compressed bbduk output instead.
+	rule qc_bbduk_bbnorm:
+		message:
+			"Preprocessing and normalizing read data with bbduk and bbnorm..."
+		input:
+			get_raw_reads
+		output:
+			r1 = join(BBDUK_DIR, "{sample}", "{sample}_R1.bbduk.fastq.gz"),
+			r2 = join(BBDUK_DIR, "{sample}", "{sample}_R2.bbduk.fastq.gz"),
+			norm_r1 = join(BBNORM_DIR, "{sample}", "{sample}_R1.bbnorm.fastq.gz"),
+			norm_r2 = join(BBNORM_DIR, "{sample}", "{sample}_R2.bbnorm.fastq.gz"),
+			prehist = join(BBNORM_DIR, "{sample}", "{sample}.bbnorm.pre.hist"),
+			posthist = join(BBNORM_DIR, "{sample}", "{sample}.bbnorm.post.hist")
+		log:
+			join(QC_LOGDIR, "{sample}", "{sample}.qc_bbduk_bbnorm.log")
+		threads:
+			RESOURCES.threads("qc_bbduk_bbnorm", 8)
+		resources:
+			mem_mb = RESOURCES.mem_mb("qc_bbduk_bbnorm")
+		params:
+			bbduk_cmd = CMD_CALL + "bbduk.sh",
+			reformat_cmd = CMD_CALL + "reformat.sh",
+			bbnorm_cmd = CMD_CALL + "bbnorm.sh",
+			adapters = config["resources"]["bb_adapters"],
+			bbduk_params = config["params"]["bbduk"],
+			bbnorm_params = config["params"]["bbnorm"],
+			bbduk_compression = COMPRESSION.bbtools_args("qc_bbduk"),
+			bbnorm_compression = COMPRESSION.bbtools_args("qc_bbnorm"),
+			scratch_dir = STREAM_SCRATCH_DIR or "${TMPDIR:-/tmp}"
+		shell:
+			"(set -o pipefail && mkdir -p {params.scratch_dir} && scratch=$(mktemp -d -p {params.scratch_dir}) && trap 'rm -rf $scratch' EXIT" + \
+			" && need=$(( $(du -Lck {input} | tail -n 1 | cut -f 1) * 4 )) && avail=$(df -Pk $scratch | tail -n 1 | awk '{{print $4}}')" + \
+			" && if [ $avail -ge $need ]; then copy=$scratch/{wildcards.sample}.bbduk.fq; norm_in=\"in=$copy interleaved=t\";" + \
+			" else copy=/dev/null; norm_in=\"in={output.r1} in2={output.r2}\";" + \
+			" echo \"WARNING: $scratch has ${{avail}}k free, ${{need}}k needed for the uncompressed trimmed reads. bbnorm reads the bbduk output.\"; fi" + \
+			" && " + TIME_V + " {params.bbduk_cmd}" + \
+			" -Xmx30g t={threads} in1={input[0]} in2={input[1]} out=stdout.fq" + \
+			" ref={params.adapters}" + \
+			" {params.bbduk_params}" + \
+			" | tee $copy" + \
+			" | {params.reformat_cmd} -Xmx2g in=stdin.fq interleaved=t out1={output.r1} out2={output.r2} {params.bbduk_compression}" + \
+			" && " + TIME_V + " {params.bbnorm_cmd}" + \
+			" -Xmx30g t={threads} $norm_in out={output.norm_r1} out2={output.norm_r2}" + \
+			" {params.bbnorm_params} {params.bbnorm_compression}" + \
+			" khist={output.prehist} khistout={output.posthist}) &> {log}"
+else:
+	rule qc_bbduk:
+		message:
+			"Preprocessing read data with bbduk..."
+		input:
+			get_raw_reads
+		output:
+			r1 = join(BBDUK_DIR, "{sample}", "{sample}_R1.bbduk.fastq.gz"),
+			r2 = join(BBDUK_DIR, "{sample}", "{sample}_R2.bbduk.fastq.gz")
+		log:
+			join(QC_LOGDIR, "{sample}", "{sample}.qc_bbduk.log")
+		threads:
+			RESOURCES.threads("qc_bbduk", 8)
+		resources:
+			mem_mb = RESOURCES.mem_mb("qc_bbduk")
+		params:
+			cmd = CMD_CALL + "bbduk.sh",
+			adapters = config["resources"]["bb_adapters"],
+			bbduk_params = config["params"]["bbduk"],
+			compression = COMPRESSION.bbtools_args("qc_bbduk")
+		shell:
+			TIME_V + " {params.cmd}" + \
+			" -Xmx30g t={threads} in1={input[0]} in2={input[1]} out1={output.r1} out2={output.r2}" + \
+			" ref={params.adapters}" + \
+			" {params.bbduk_params} {params.compression}" + \
+			" &> {log}"
+
+rule qc_fastqc_bbduk:
+	message:
+		"Generating post-preprocessing report with FastQC..."
+	input:
+		join(BBDUK_DIR, "{sample}", "{sample}_{mate}.bbduk.fastq.gz")
+	output:
+		fqc = join(FASTQC_DIR, "bbduk", "{sample}", "{sample}_{mate}.bbduk_fastqc.html")
+	params:
+		outdir = join(FASTQC_DIR, "bbduk", "{sample}"),
+		cmd = CMD_CALL + "fastqc" 
+	log:
+		join(QC_LOGDIR, "{sample}", "{sample}_{mate}.qc_fastqc_bbduk.log")
+	threads:
+		RESOURCES.threads("qc_fastqc_bbduk", 2)
+	resources:
+		mem_mb = RESOURCES.mem_mb("qc_fastqc_bbduk")
+	shell:
+		"(" + TIME_V + " {params.cmd}" + \
+		" --extract --threads={threads} --outdir={params.outdir} {input} " + \
+		" || mkdir -p {params.outdir} && touch {output.fqc}) &> {log}"
+
+if not SKIP_NORMALIZATION and not STREAM_PREPROCESSING and not ADAPTIVE_NORMALIZATION:
+	rule qc_bbnorm:
+		message:
+			"Normalizing read data with bbnorm..."
+		input:
+			r1 = join(BBDUK_DIR, "{sample}", "{sample}_R1.bbduk.fastq.gz"),
+			r2 = join(BBDUK_DIR, "{sample}", "{sample}_R2.bbduk.fastq.gz")
+		output:
+			r1 = join(BBNORM_DIR, "{sample}", "{sample}_R1.bbnorm.fastq.gz"),
+			r2 = join(BBNORM_DIR, "{sample}", "{sample}_R2.bbnorm.fastq.gz"),
+			prehist = join(BBNORM_DIR, "{sample}", "{sample}.bbnorm.pre.hist"),
+			posthist = join(BBNORM_DIR, "{sample}", "{sample}.bbnorm.post.hist")
+		params:
+			cmd = CMD_CALL + "bbnorm.sh",
+			bbnorm_params = config["params"]["bbnorm"],
+			compression = COMPRESSION.bbtools_args("qc_bbnorm")
+		log:
+			join(QC_LOGDIR, "{sample}", "{sample}.qc_bbnorm.log")
+		threads:
+			RESOURCES.threads("qc_bbnorm", 8)
+		resources:
+			mem_mb = RESOURCES.mem_mb("qc_bbnorm")
+		shell:
+			TIME_V + " {params.cmd}" + \
+			" -Xmx30g t={threads} in={input.r1} in2={input.r2} out={output.r1} out2={output.r2}" + \
+			" {params.bbnorm_params} {params.compression}" + \
+			" khist={output.prehist} khistout={output.posthist} &> {log}"
+
+if not SKIP_NORMALIZATION and ADAPTIVE_NORMALIZATION:
+	# adaptive normalization: depending on the coverage of its trimmed reads (estimated from read_stats and SURVEY_GENOME_SIZE),
+	# a sample's reads are passed through (linked), subsampled to the bbnorm target coverage or normalized with bbnorm.
+	# Only bbnorm jobs reserve bbnorm's memory, the decision is recorded for the assembly (get_asm_reads).
+	NORMALIZATION_TARGET = float(BBNORM_PARAMS.get("target", 100))
+
+	def get_normalization_mem_mb(wildcards, input):
+		policy = readNormalizationPolicy(input.policy)
+		if policy is None or policy["mode"] == "bbnorm":
+			return RESOURCES.mem_mb("qc_bbnorm")
+		return RESOURCES.mem_mb("qc_bbnorm_subsample")
+
+	localrules: qc_normalization_policy
+
+	rule qc_normalization_policy:
+		message:
+			"Deciding read normalization..."
+		input:
+			stats = join(QC_OUTDIR, "readstats", "bbduk", "{sample}", "{sample}.bbduk.read_stats.json")
+		output:
+			policy = join(BBNORM_DIR, "{sample}", "{sample}.normalization.json")
+		run:
+			writeNormalizationPolicy(wildcards.sample, input.stats, output.policy, SURVEY_GENOME_SIZE, target_coverage=NORMALIZATION_TARGET)
+
+	rule qc_bbnorm:
+		message:
+			"Normalizing read data with bbnorm (adaptive)..."
+		input:
+			r1 = join(BBDUK_DIR, "{sample}", "{sample}_R1.bbduk.fastq.gz"),
+			r2 = join(BBDUK_DIR, "{sample}", "{sample}_R2.bbduk.fastq.gz"),
+			policy = join(BBNORM_DIR, "{sample}", "{sample}.normalization.json")
+		output:
+			r1 = join(BBNORM_DIR, "{sample}", "{sample}_R1.bbnorm.fastq.gz"),
+			r2 = join(BBNORM_DIR, "{sample}", "{sample}_R2.bbnorm.fastq.gz"),
+			prehist = join(BBNORM_DIR, "{sample}", "{sample}.bbnorm.pre.hist"),
+			posthist = join(BBNORM_DIR, "{sample}", "{sample}.bbnorm.post.hist")
+		params:
+			cmd = CMD_CALL + "bbnorm.sh",
+			reformat_cmd = CMD_CALL + "reformat.sh",
+			bbnorm_params = config["params"]["bbnorm"],
+			compression = COMPRESSION.bbtools_args("qc_bbnorm"),
+			seed = SURVEY_SEED
+		log:
+			join(QC_LOGDIR, "{sample}", "{sample}.qc_bbnorm.log")
+		threads:
+			RESOURCES.threads("qc_bbnorm", 8)
+		resources:
+			mem_mb = get_normalization_mem_mb
+		run:
+			policy = readNormalizationPolicy(input.policy)
+			if policy["mode"] == "passthrough":
+				# histograms are only written by bbnorm
+				for trimmed, normalized in ((input.r1, output.r1), (input.r2, output.r2)):
+					# leftovers of an interrupted run
+					if os.path.lexists(normalized):
+						os.remove(normalized)
+					os.symlink(os.path.relpath(trimmed, os.path.dirname(normalized)), normalized)
+				shell("(echo 'Estimated coverage: {:.1f}x, reads are not normalized.' && touch {{output.prehist}} {{output.posthist}}) &> {{log}}".format(policy["coverage"]))
+			elif policy["mode"] == "subsample":
+				shell(
+					"(echo 'Estimated coverage: {:.1f}x, reads are subsampled.' && ".format(policy["coverage"]) + \
+					TIME_V + " {params.reformat_cmd}" + \
+					" -Xmx2g in={input.r1} in2={input.r2} out={output.r1} out2={output.r2}" + \
+					" samplerate={:.6f} sampleseed={{params.seed}} {{params.compression}}".format(policy["sample_rate"]) + \
+					" && touch {output.prehist} {output.posthist}) &> {log}"
+				)
+			else:
+				shell(
+					TIME_V + " {params.cmd}" + \
+					" -Xmx30g t={threads} in={input.r1} in2={input.r2} out={output.r1} out2={output.r2}" + \
+					" {params.bbnorm_params} {params.compression}" + \
+					" khist={output.prehist} khistout={output.posthist} &> {log}"
+				)
+
+if not SKIP_NORMALIZATION:
+	rule qc_fastqc_bbnorm:
+		message:
+			"Generating post-normalization report with FastQC..."
+		input:
+			join(BBNORM_DIR, "{sample}", "{sample}_{mate}.bbnorm.fastq.gz")
+		output:
+			fqc = join(FASTQC_DIR, "bbnorm", "{sample}", "{sample}_{mate}.bbnorm_fastqc.html")
+		params:
+			outdir = join(FASTQC_DIR, "bbnorm", "{sample}"),
+			cmd = CMD_CALL + "fastqc"
+		log:
+			join(QC_LOGDIR, "{sample}", "{sample}_{mate}.qc_fastqc_bbnorm.log")
+		threads:
+			RESOURCES.threads("qc_fastqc_bbnorm", 2)
+		resources:
+			mem_mb = RESOURCES.mem_mb("qc_fastqc_bbnorm")
+		shell:
+			"({params.cmd}" + \
+			" --extract --threads={threads} --outdir={params.outdir} {input}" + \
+			" || mkdir -p {params.outdir} && touch {output.fqc}) &> {log}"
+
+rule qc_readstats:
+	message:
+		"Computing read statistics..."
+	input:
+		r1 = join(QC_OUTDIR, "{readtype}", "{sample}", "{sample}_R1.{readtype}.fastq.gz"),
+		r2 = join(QC_OUTDIR, "{readtype}", "{sample}", "{sample}_R2.{readtype}.fastq.gz")
+	output:
+		stats = join(QC_OUTDIR, "readstats", "{readtype}", "{sample}", "{sample}.{readtype}.read_stats.json")
+	wildcard_constraints:
+		readtype = "bbduk|bbnorm"
+	log:
+		join(QC_LOGDIR, "{sample}", "{readtype}", "{sample}.qc_readstats.log")
+	threads:
+		RESOURCES.threads("qc_readstats", 4)
+	resources:
+		mem_mb = RESOURCES.mem_mb("qc_readstats")
+	shell:
+		TIME_V + " read_stats --threads {threads} -o {output.stats} {input.r1} {input.r2} &> {log}"
+
+# coverage-targeted subsampling of the survey reads (tadpole, kat): samples whose coverage (estimated from their read bases)
+# is at least twice SURVEY_COVERAGE are streamed as a seeded, pair-preserving random subsample, SURVEY_COVERAGE = 0 disables subsampling
+SURVEY_SUBSAMPLE_INPUT = {
+	"stats": join(QC_OUTDIR, "readstats", PRIMARY_READ_ID, "{sample}", "{sample}." + PRIMARY_READ_ID + ".read_stats.json")
+} if SURVEY_COVERAGE else dict()
+
+SUBSAMPLE_READS = CMD_CALL + "reformat.sh -Xmx2g in={input.r1} in2={input.r2} out=stdout.fq samplerate=$rate sampleseed=" + str(SURVEY_SEED)
+
+def subsampled(cmd, subsample_cmd):
+	if not SURVEY_COVERAGE:
+		return cmd
+	return "( rate=$(read_stats --sample-rate {input.stats}" + \
+		" --target-coverage " + str(SURVEY_COVERAGE) + " --genome-size " + str(int(SURVEY_GENOME_SIZE)) + ")" + \
+		" && if [ \"$rate\" = 1 ]; then " + cmd + "; else " + subsample_cmd + "; fi )"
+
+rule qc_tadpole:
+	message:
+		"Generating survey assemblies with tadpole..."
+	input:
+		r1 = join(PRIMARY_READDIR, "{sample}", "{sample}_R1." + PRIMARY_READ_ID + ".fastq.gz"),
+		r2 = join(PRIMARY_READDIR, "{sample}", "{sample}_R2." + PRIMARY_READ_ID + ".fastq.gz"),
+		**SURVEY_SUBSAMPLE_INPUT
+	output:
+		contigs = join(TADPOLE_DIR, "{sample}", "{sample}_tadpole_contigs.fasta")
+	params:
+		cmd = CMD_CALL + "tadpole.sh"
+	log:
+		join(QC_LOGDIR, "{sample}", "{sample}.qc_tadpole.log")
+	threads:
+		RESOURCES.threads("qc_tadpole", 8)
+	resources:
+		mem_mb = RESOURCES.mem_mb("qc_tadpole")
+	shell:
+		subsampled(
+			TIME_V + " {params.cmd} -Xmx30g threads={threads} in={input.r1} in2={input.r2} out={output.contigs}",
+			SUBSAMPLE_READS + " | " + TIME_V + " {params.cmd} -Xmx30g threads={threads} in=stdin.fq interleaved=t out={output.contigs}"
+		) + " &> {log}"
+
+if KHIST_ANALYSIS:
+	localrules: qc_khist_analysis
+
+	rule qc_khist_analysis:
+		message:
+			"Analyzing k-mer distribution and estimated genome size from bbnorm k-mer histograms..."
+		input:
+			khist = join(BBNORM_DIR, "{sample}", "{sample}.bbnorm.pre.hist"),
+			stats = join(QC_OUTDIR, "readstats", "bbduk", "{sample}", "{sample}.bbduk.read_stats.json")
+		output:
+			katgcp = join(KAT_DIR, "{sample}", "{sample}.dist_analysis.json")
+		log:
+			join(QC_LOGDIR, "{sample}", "{sample}.qc_khist_analysis.log")
+		params:
+			kmer_size = BBNORM_PARAMS.get("k", 31)
+		shell:
+			"khist_analysis --read-stats {input.stats} --kmer-size {params.kmer_size} -o {output.katgcp} {input.khist} &> {log}"
+else:
+	rule qc_katgcp:
+		message:
+			"Analyzing k-mer distribution, GC content and estimated genome size with kat..."
+		input:
+			r1 = join(PRIMARY_READDIR, "{sample}", "{sample}_R1." + PRIMARY_READ_ID + ".fastq.gz"),
+			r2 = join(PRIMARY_READDIR, "{sample}", "{sample}_R2." + PRIMARY_READ_ID + ".fastq.gz"),
+			**SURVEY_SUBSAMPLE_INPUT
+		output:
+			katgcp = join(KAT_DIR, "{sample}", "{sample}.dist_analysis.json")
+		log:
+			join(KAT_DIR, "{sample}", "{sample}.kat")
+		params:
+			prefix = lambda wildcards: join(KAT_DIR, wildcards.sample, wildcards.sample), 
+			cmd = CMD_CALL + "kat"
+		threads:
+			RESOURCES.threads("qc_katgcp", 2)
+		resources:
+			mem_mb = RESOURCES.mem_mb("qc_katgcp")
+		shell:
+			" ( " + subsampled(
+				"{params.cmd} gcp -o {params.prefix} -t {threads} -v {input.r1} {input.r2}",
+				"{params.cmd} gcp -o {params.prefix} -t {threads} -v <(" + SUBSAMPLE_READS + ")"
+			) + " || touch {output.katgcp}) &> {log}"
+
+
+# early survey gate on the preprocessed reads: samples with too few reads are not normalized, assembled or k-mer analysed,
+# their verdict (FAIL) is recorded by qc_gate right away
+checkpoint qc_pregate:
+	message:
+		"Checking read counts after preprocessing..."
+	input:
+		stats = join(QC_OUTDIR, "readstats", "bbduk", "{sample}", "{sample}.bbduk.read_stats.json")
+	output:
+		pregate = join(GATE_DIR, "{sample}", "{sample}.pregate.json")
+	run:
+		writePregate(wildcards.sample, OUTPUTDIR, output.pregate)
+
+def passed_pregate(sample):
+	return readPregate(checkpoints.qc_pregate.get(sample=sample).output.pregate)
+
+# per-sample survey gate, also requires GATE_DIR, REPORT_DIR and MIN_TADPOLE_SIZE
+# FastQC reports are not needed for gating (only for reporting)
+QC_GATE_INPUT = {
+	"readstats": join(QC_OUTDIR, "readstats", PRIMARY_READ_ID, "{sample}", "{sample}." + PRIMARY_READ_ID + ".read_stats.json"),
+	"kat": join(KAT_DIR, "{sample}", "{sample}.dist_analysis.json"),
+	"contigs": join(TADPOLE_DIR, "{sample}", "{sample}_tadpole_contigs.fasta")
+}
+
+def get_gate_input(wc):
+	gate_input = {"pregate": join(GATE_DIR, wc.sample, wc.sample + ".pregate.json")}
+	if passed_pregate(wc.sample):
+		gate_input.update((key, f.format(sample=wc.sample)) for key, f in QC_GATE_INPUT.items())
+	return gate_input
+
+def get_survey_sample_input(wc):
+	# the remaining survey (reporting) outputs of samples that passed the early gate
+	verdict = join(GATE_DIR, wc.sample, wc.sample + ".qc_verdict.json")
+	return [verdict] + (get_post_pregate_targets([wc.sample], config) if passed_pregate(wc.sample) else list())
+
+rule qc_survey_sample:
+	input:
+		get_survey_sample_input
+	output:
+		touch(join(GATE_DIR, "{sample}", "{sample}.survey.done"))
+
+def run_qc_gate(sample, verdict_file):
+	passed, row = writeVerdict(sample, OUTPUTDIR, verdict_file, readtype=PRIMARY_READ_ID, min_tadpole_size=MIN_TADPOLE_SIZE)
+	asm_row = (list(INPUTFILES[sample])[:len(RAW_SAMPLE_FIELDS)] + getASMSampleData(sample, QC_OUTDIR)) if passed else None
+	appendVerdict(REPORT_DIR, row, asm_row)
+
+if config["module"] == "bgfull":
+	# downstream (assembly) targets are determined by the verdict
+	checkpoint qc_gate:
+		message:
+			"Evaluating survey results..."
+		input:
+			unpack(get_gate_input)
+		output:
+			verdict = join(GATE_DIR, "{sample}", "{sample}.qc_verdict.json")
+		run:
+			run_qc_gate(wildcards.sample, output.verdict)
+else:
+	rule qc_gate:
+		message:
+			"Evaluating survey results..."
+		input:
+			unpack(get_gate_input)
+		output:
+			verdict = join(GATE_DIR, "{sample}", "{sample}.qc_verdict.json")
+		run:
+			run_qc_gate(wildcards.sample, output.verdict)
@@ -41,14 +41,15 @@ setup(
 	],
 	zip_safe=False,
 	keywords="bacterial genomics illumina sequencing assembly annotation",
-	packages=find_packages(exclude=["test"]),
+	packages=find_packages(exclude=["tests", "tests.*"]),
 	scripts=[
 		path.join("bgrrl/bin/slurm", script) for script in ["bgsurvey_sub", "bgasm_sub", "bgann_sub", "bgpack_sub"]
 	],
 	install_requires=[
-		"snakemake>=4.4.0",
+		"snakemake>=5.4",
 		"drmaa",
-		"sphinx"
+		"sphinx",
+		"numpy"
 	],
 	entry_points={
 		"console_scripts": [
@@ -69,7 +70,10 @@ setup(
 			"asm_wrapper=bgrrl.bin.wrappers.asm_wrapper:main",
 			"prokka_wrapper=bgrrl.bin.wrappers.prokka_wrapper:main",
 			"ratt_wrapper=bgrrl.bin.wrappers.ratt_wrapper:main",
-			"qc2asm=bgrrl.bin.qc2asm:main"
+			"qc2asm=bgrrl.bin.qc2asm:main",
+			"resource_profile=bgrrl.bin.resource_profile:main",
+			"read_stats=bgrrl.bin.read_stats:main",
+			"khist_analysis=bgrrl.bin.khist_analysis:main"
 		]
 	},
 	package_data={
@@ -0,0 +1,78 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from bgrrl.bin.wrappers import asm_wrapper
+from bgrrl.bin.wrappers.asm_wrapper import ASM_Wrapper
+
+
+SUCCESS = "echo {step} > {outdir}/assembly.fasta"
+SLOW = "sleep 60 & echo $! > {pid_file}; wait"
+
+RACE_SCRIPT = """
+import sys
+from bgrrl.bin.wrappers import asm_wrapper
+asm_wrapper.RACE_POLL_INTERVAL = 0.1
+asm = object.__new__(asm_wrapper.ASM_Wrapper)
+asm.outdir, asm.threads, asm.race, asm.mem_mb = sys.argv[1], 8, 2, 0
+asm.fallback_queue = [(step, {cmd!r}, dict(pid_file=sys.argv[1] + "/" + step + ".pid")) for step in ("asm_main", "asm_fallback")]
+asm.run()
+"""
+
+
+def _make_wrapper(outdir, stages, race=3):
+	asm = object.__new__(ASM_Wrapper)
+	asm.outdir, asm.threads, asm.race, asm.mem_mb = str(outdir), 12, race, 0
+	asm.fallback_queue = [(step, cmd, dict(step=step, pid_file=str(outdir / (step + ".pid")))) for step, cmd in stages]
+	return asm
+
+
+def _is_running(pid):
+	try:
+		with open("/proc/{}/stat".format(pid)) as stat_in:
+			return stat_in.read().split(")")[-1].split()[0] != "Z"
+	except OSError:
+		return False
+
+
+def _wait_for(condition, timeout=10):
+	start = time.time()
+	while not condition():
+		assert time.time() - start < timeout
+		time.sleep(0.05)
+
+
+def test_race_winner(tmp_path, monkeypatch):
+	monkeypatch.setattr(asm_wrapper, "RACE_POLL_INTERVAL", 0.1)
+	outdir = tmp_path / "asm"
+	asm = _make_wrapper(outdir, [("asm_main", "exit 1"), ("asm_fallback", SUCCESS), ("asm_fallback2", SLOW)])
+	assert asm.get_race_width() == 3
+	start = time.time()
+	asm.run()
+	assert time.time() - start < 30
+	assert (outdir / "assembly.fasta").read_text() == "asm_fallback\n"
+	assert (outdir / "asm_fallback").exists()
+	assert not (outdir / "race").exists()
+
+
+def test_race_without_winner(tmp_path, monkeypatch):
+	monkeypatch.setattr(asm_wrapper, "RACE_POLL_INTERVAL", 0.1)
+	outdir = tmp_path / "asm"
+	_make_wrapper(outdir, [("asm_main", "exit 1"), ("asm_fallback", "exit 2")]).run()
+	assert (outdir / "assembly.fasta").read_text() == ""
+
+
+def test_race_stages_killed_on_sigterm(tmp_path):
+	outdir = tmp_path / "asm"
+	outdir.mkdir()
+	proc = subprocess.Popen([sys.executable, "-c", RACE_SCRIPT.format(cmd=SLOW), str(outdir)], stdout=subprocess.DEVNULL)
+	pid_files = [outdir / (step + ".pid") for step in ("asm_main", "asm_fallback")]
+	_wait_for(lambda: all(f.exists() and f.read_text().strip() for f in pid_files))
+	pids = [int(f.read_text()) for f in pid_files]
+	assert all(_is_running(pid) for pid in pids)
+
+	proc.send_signal(signal.SIGTERM)
+	assert proc.wait(timeout=30) == 128 + signal.SIGTERM
+	_wait_for(lambda: not any(_is_running(pid) for pid in pids))
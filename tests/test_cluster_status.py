@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from bgrrl.bin import cluster_status
+from bgrrl.bin.cluster_status import getJobId, StatusCache, submitJob, getJobStatus
+
+
+def _fake_command(bin_dir, name, script):
+	cmd = bin_dir / name
+	cmd.write_text("#!/bin/sh\n" + script)
+	cmd.chmod(0o755)
+	return str(cmd)
+
+
+@pytest.fixture
+def bin_dir(tmp_path, monkeypatch):
+	bin_dir = tmp_path / "bin"
+	bin_dir.mkdir()
+	monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+	return bin_dir
+
+
+def test_getJobId():
+	assert getJobId("Submitted batch job 1234\n", "SLURM") == "1234"
+	assert getJobId("1234;cluster", "slurm") == "1234"
+	assert getJobId("Job <5678> is submitted to queue <short>.", "LSF") == "5678"
+	assert getJobId("91011.pbs-server", "PBS") == "91011.pbs-server"
+	with pytest.raises(ValueError):
+		getJobId("sbatch: error: invalid partition", "SLURM")
+
+
+def test_unsupported_scheduler(tmp_path):
+	with pytest.raises(ValueError):
+		StatusCache(str(tmp_path), "SGE")
+
+
+def test_status_queries_are_batched_and_cached(tmp_path, bin_dir):
+	calls = tmp_path / "sacct.calls"
+	_fake_command(bin_dir, "sbatch", 'echo "Submitted batch job $1"\n')
+	_fake_command(
+		bin_dir, "sacct",
+		'echo "$@" >> "{}"\nprintf "1|COMPLETED\\n2|CANCELLED by 0\\n3|RUNNING\\n4|PENDING\\n4|OUT_OF_MEMORY\\n"\n'.format(calls)
+	)
+	cache_dir = str(tmp_path / "status_cache")
+	assert [submitJob(cache_dir, "SLURM", ["sbatch", str(i)]) for i in range(1, 5)] == ["1", "2", "3", "4"]
+
+	assert [getJobStatus(cache_dir, "SLURM", job_id) for job_id in "1234"] == ["success", "failed", "running", "failed"]
+	# all outstanding jobs are queried in a single call, running jobs are not queried again within the interval
+	assert calls.read_text().splitlines() == ["-X -n -P -o JobID,State -j 1,2,3,4"]
+
+	with StatusCache(cache_dir, "SLURM", interval=0) as cache:
+		assert cache.get_status("3") == "running"
+	assert calls.read_text().splitlines()[1].endswith("-j 3")
+
+
+def test_scheduler_unavailable(tmp_path, bin_dir):
+	_fake_command(bin_dir, "sacct", "exit 1\n")
+	cache_dir = str(tmp_path / "status_cache")
+	assert getJobStatus(cache_dir, "SLURM", "1") == "running"
+
+
+def test_main_exit_status(tmp_path, bin_dir):
+	_fake_command(bin_dir, "bsub", 'echo "Job <42> is submitted to queue <short>."\n')
+	# snakemake runs the script by path (ClusterExecutor.STATUS_SCRIPT)
+	call = [sys.executable, cluster_status.__file__]
+	proc = subprocess.run(call + ["submit", str(tmp_path / "cache"), "LSF", "bsub", "job.sh"], stdout=subprocess.PIPE)
+	assert proc.returncode == 0
+	assert proc.stdout.decode().strip() == "42"
+	assert subprocess.run(call, stdout=subprocess.PIPE).returncode == 1
@@ -0,0 +1,89 @@
+import gzip
+import os
+import subprocess
+import sys
+
+from bgrrl.bin.create_samplesheet import parseReadFile, scanReadDirectories, pairReadFiles
+
+
+def _touch(path):
+	path.parent.mkdir(parents=True, exist_ok=True)
+	path.write_bytes(b"")
+	return path
+
+
+def _run(*args):
+	return subprocess.run(
+		[sys.executable, "-c", "import sys; from bgrrl.bin.create_samplesheet import main; sys.exit(main())"] + list(args),
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE
+	)
+
+
+def test_parseReadFile():
+	rf = parseReadFile("/run/S1_S3_L001_R2_001.fastq.gz")
+	assert (rf.sample, rf.library, rf.lane, rf.mate) == ("S1", "S1_S3_L001_001", "L001", "R2")
+	rf = parseReadFile("S2_R1.fq.gz")
+	assert (rf.sample, rf.library, rf.lane, rf.mate) == ("S2", "S2", "", "R1")
+	assert parseReadFile("S1_R1.fastq") is None
+	assert parseReadFile("undetermined.fastq.gz") is None
+
+
+def test_scan_and_pair(tmp_path):
+	for lane in ("L001", "L002"):
+		for mate in ("R1", "R2"):
+			_touch(tmp_path / "run1" / "S1_{}_{}.fastq.gz".format(lane, mate))
+	_touch(tmp_path / "run2" / "sub" / "S2_R1.fastq.gz")
+	_touch(tmp_path / "run2" / "sub" / "S2_R2.fastq.gz")
+	_touch(tmp_path / "run2" / "S3_R1.fastq.gz")
+
+	readfiles = scanReadDirectories([str(tmp_path)], threads=2)
+	assert len(readfiles) == 7
+	samples, unpaired = pairReadFiles(readfiles)
+	assert list(samples) == ["S1", "S2"]
+	assert [library for library, _, _ in samples["S1"]] == ["S1_L001", "S1_L002"]
+	assert all(r1.endswith("_R1.fastq.gz") and r2 == r1.replace("_R1.", "_R2.") for _, r1, r2 in samples["S1"])
+	assert [rf.sample for rf in unpaired] == ["S3"]
+
+	samples, unpaired = pairReadFiles(readfiles, lane="L002")
+	assert samples == {"S1": [("S1", str(tmp_path / "run1" / "S1_L002_R1.fastq.gz"), str(tmp_path / "run1" / "S1_L002_R2.fastq.gz"))]}
+	assert not unpaired
+
+	assert len(scanReadDirectories([str(tmp_path)], recursive=False)) == 0
+
+
+def test_main_exit_status(tmp_path):
+	_touch(tmp_path / "reads" / "S1_R1.fastq.gz")
+	_touch(tmp_path / "reads" / "S1_R2.fastq.gz")
+	sheet = tmp_path / "samplesheet.csv"
+	proc = _run(str(tmp_path / "reads"), "-o", str(sheet), "--strict")
+	assert proc.returncode == 0
+	assert sheet.read_text().split(",")[:2] == ["S1", "S1"]
+	assert len(sheet.read_text().strip().split(",")) == 10
+
+	_touch(tmp_path / "reads" / "S2_R1.fastq.gz")
+	assert _run(str(tmp_path / "reads"), "-o", str(sheet)).returncode == 0
+	assert _run(str(tmp_path / "reads"), "-o", str(sheet), "--strict").returncode == 1
+
+
+def test_multi_lane_samples_are_merged(tmp_path):
+	for lane in ("L001", "L002"):
+		for mate in ("R1", "R2"):
+			with gzip.open(str(_touch(tmp_path / "reads" / "S1_{}_{}.fastq.gz".format(lane, mate))), "wt") as reads_out:
+				reads_out.write("@{0}_{1}\nACGT\n+\nIIII\n".format(lane, mate))
+	_touch(tmp_path / "reads" / "S2_R1.fastq.gz")
+	_touch(tmp_path / "reads" / "S2_R2.fastq.gz")
+	sheet = tmp_path / "samplesheet.csv"
+	assert _run(str(tmp_path / "reads"), "-o", str(sheet)).returncode == 0
+
+	rows = [line.split(",") for line in sheet.read_text().splitlines()]
+	assert [row[:2] for row in rows] == [["S1", "S1"], ["S2", "S2"]]
+	assert rows[0][2:4] == [str(tmp_path / "merged_reads" / "S1_R1.fastq.gz"), str(tmp_path / "merged_reads" / "S1_R2.fastq.gz")]
+	assert rows[1][2] == str(tmp_path / "reads" / "S2_R1.fastq.gz")
+	with gzip.open(rows[0][3], "rt") as merged_in:
+		assert [line for line in merged_in.read().splitlines() if line.startswith("@")] == ["@L001_R2", "@L002_R2"]
+
+	# up-to-date merged files are kept and are not picked up as read files
+	os.utime(rows[0][2], (2 * 10**9, 2 * 10**9))
+	assert _run(str(tmp_path), "-o", str(sheet)).returncode == 0
+	assert os.path.getmtime(rows[0][2]) == 2 * 10**9
+	assert [line.split(",")[:3] for line in sheet.read_text().splitlines()] == [row[:3] for row in rows]
@@ -0,0 +1,60 @@
+import os
+
+from bgrrl.incremental import read_records, write_increment, merge_records, merged_reports, get_increment_table
+
+
+def _write(path, text):
+	path.write_text(text)
+	return str(path)
+
+
+def test_write_increment(tmp_path):
+	sheet = _write(tmp_path / "samplesheet.csv", "S1,a\nS2,b\nS3,c\n")
+	record = _write(tmp_path / "bgsurvey.samples.csv", "S1,a\nS2,old\n")
+	increment = str(tmp_path / "bgsurvey.increment.csv")
+	assert write_increment(sheet, record, increment) == 2
+	assert open(increment).read() == "S2,b\nS3,c\n"
+
+
+def test_merge_records(tmp_path):
+	table = _write(tmp_path / "report.tsv", "Sample\tN50\nS1\t10\nS2\t20\nS2\t21\nS4\t40\n")
+	increment = _write(tmp_path / "report.increment.tsv", "Sample\tN50\nS2\t22\nS3\t30\n")
+	assert merge_records(increment, table, header_lines=1, delimiter="\t", drop=("S4",)) == 3
+	header, records = read_records(table, header_lines=1, delimiter="\t")
+	assert header == ["Sample\tN50"]
+	assert list(records.values()) == ["S1\t10", "S2\t22", "S3\t30"]
+
+
+def test_merged_reports(tmp_path):
+	report = str(tmp_path / "quast_report.tsv")
+	tables = [(report, 1, "\t"), (str(tmp_path / "blobtools_report.tsv"), 1, "\t")]
+
+	def run_qaa(samples):
+		# qaa rewrites its reports from the current (increment) samplesheet only
+		with open(report, "w") as _out:
+			print("Assembly\tN50", *("{}\t{}".format(s, n50) for s, n50 in samples), sep="\n", file=_out)
+		return True
+
+	with merged_reports(tables, incremental=True):
+		assert run_qaa([("S1", 10), ("S2", 20)])
+	with merged_reports(tables, incremental=True):
+		assert run_qaa([("S3", 30), ("S2", 25)])
+
+	assert open(report).read() == "Assembly\tN50\nS1\t10\nS2\t25\nS3\t30\n"
+	assert open(get_increment_table(report)).read() == "Assembly\tN50\nS3\t30\nS2\t25\n"
+	assert sorted(os.listdir(str(tmp_path))) == ["quast_report.increment.tsv", "quast_report.tsv"]
+
+	with merged_reports(tables, incremental=False):
+		run_qaa([("S4", 40)])
+	assert open(report).read() == "Assembly\tN50\nS4\t40\n"
+
+
+def test_merged_reports_restores_on_error(tmp_path):
+	report = _write(tmp_path / "quast_report.tsv", "Assembly\tN50\nS1\t10\n")
+	try:
+		with merged_reports([(report, 1, "\t")]):
+			raise RuntimeError
+	except RuntimeError:
+		pass
+	assert open(report).read() == "Assembly\tN50\nS1\t10\n"
+	assert not os.path.exists(report + ".project")
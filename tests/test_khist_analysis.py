@@ -0,0 +1,80 @@
+import json
+import math
+import subprocess
+import sys
+
+import numpy as np
+
+from bgrrl.bin.khist_analysis import readKmerHistogram, findPeaks, analyseKmerHistogram, getMeanGC
+
+
+GENOME_SIZE = 5000000
+KMER_COVERAGE = 60
+
+
+def _poisson(depth, mean):
+	return math.exp(depth * math.log(mean) - mean - math.lgamma(depth + 1))
+
+
+def _write_khist(path, genome_size=GENOME_SIZE, coverage=KMER_COVERAGE, errors=2e7, repeats=0.02):
+	'''bbnorm khist of a genome at coverage, with sequencing errors (depth 1-3) and a small duplicated fraction (2 x coverage).'''
+	with open(str(path), "w") as _out:
+		print("#Depth", "Raw_Count", "Unique_Kmers", sep="\t", file=_out)
+		for depth in range(1, 6 * coverage):
+			unique = genome_size * ((1 - repeats) * _poisson(depth, coverage) + repeats / 2 * _poisson(depth, 2 * coverage))
+			unique += errors * math.exp(-2 * depth)
+			if unique >= 1:
+				print(depth, int(unique * depth), int(round(unique)), sep="\t", file=_out)
+	return str(path)
+
+
+def _run(*args):
+	return subprocess.run(
+		[sys.executable, "-c", "import sys; from bgrrl.bin.khist_analysis import main; sys.exit(main())"] + list(args),
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE
+	)
+
+
+def test_readKmerHistogram(tmp_path):
+	khist = tmp_path / "S1.khist.txt"
+	khist.write_text("#Depth\tRaw_Count\tUnique_Kmers\n1\t10\t10\n3\t30\t10\n")
+	assert readKmerHistogram(str(khist)).tolist() == [0, 10, 0, 10]
+	khist.write_text("")
+	assert readKmerHistogram(str(khist)).size == 0
+	assert readKmerHistogram(str(tmp_path / "missing.txt")).size == 0
+
+
+def test_genome_size_from_poisson_histogram(tmp_path):
+	counts = readKmerHistogram(_write_khist(tmp_path / "S1.khist.txt"))
+	start, regions = findPeaks(counts)
+	assert 2 < start < 20
+	assert len(regions) == 2
+
+	coverage = analyseKmerHistogram(counts, read_length=150)
+	assert coverage["nb_peaks"] == 2
+	assert abs(coverage["mean_freq"] - KMER_COVERAGE) < 1
+	assert abs(coverage["est_genome_size"] - GENOME_SIZE) < 0.02 * GENOME_SIZE
+	assert abs(coverage["est_base_coverage"] - KMER_COVERAGE * 150 / 120) < 1
+
+
+def test_empty_histogram():
+	coverage = analyseKmerHistogram(np.zeros(0))
+	assert coverage["nb_peaks"] == 0 and coverage["est_genome_size"] is None
+
+
+def test_getMeanGC():
+	assert getMeanGC({"R1": {"bases": 100, "gc_bases": 40}, "R2": {"bases": 100, "gc_bases": 60}}) == 50
+	assert getMeanGC({"R1": {"bases": 100}, "R2": {"bases": 100}}) is None
+	assert getMeanGC(None) is None
+
+
+def test_main(tmp_path):
+	khist = _write_khist(tmp_path / "S1.khist.txt")
+	read_stats = tmp_path / "S1.read_stats.json"
+	read_stats.write_text(json.dumps({"R1": {"bases": 1000, "gc_bases": 500, "mean_length": 150}, "R2": {"bases": 1000, "gc_bases": 500, "mean_length": 150}}))
+	out = tmp_path / "S1.dist_analysis.json"
+	proc = _run(khist, "--read-stats", str(read_stats), "-o", str(out))
+	assert proc.returncode == 0
+	analysis = json.loads(out.read_text())
+	assert abs(analysis["coverage"]["est_genome_size"] - GENOME_SIZE) < 0.02 * GENOME_SIZE
+	assert analysis["gc"]["mean_gc%"] == 50
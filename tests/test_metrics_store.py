@@ -0,0 +1,80 @@
+import os
+
+from bgrrl.metrics_store import MetricsStore, get_metrics_store, update_metrics_store, to_metric_value, get_metric_names
+
+
+QUAST_REPORT = "Assembly\tN50\t# contigs\tGC (%)\nS1\t100000\t12\t50.5\nS2\t80000\t20\tnan\n"
+
+
+def test_to_metric_value():
+	assert to_metric_value("12") == 12
+	assert to_metric_value("50.5") == 50.5
+	assert to_metric_value("nan") == "nan"
+	assert to_metric_value("PASS") == "PASS"
+	assert to_metric_value(3) == 3
+
+
+def test_get_metric_names():
+	header = [["Read count", "", "Pair"], ["R1", "R2", "consistent"]]
+	assert get_metric_names(header) == ["Read count:R1", "Read count:R2", "Pair:consistent"]
+	assert get_metric_names([["N50", "N50"]]) == ["N50", "N50[1]"]
+	assert get_metric_names([]) == []
+
+
+def test_import_and_query(tmp_path):
+	table = tmp_path / "quast_report.tsv"
+	table.write_text(QUAST_REPORT)
+	with MetricsStore(str(tmp_path / "metrics.sqlite")) as store:
+		assert store.import_table("quast", str(table)) == 2
+		assert store.get_metrics("quast") == ("Assembly", ["N50", "# contigs", "GC (%)"])
+		assert store.get("S1", stage="quast") == {"N50": 100000, "# contigs": 12, "GC (%)": 50.5}
+		assert store.get("S2") == {"quast": {"N50": 80000, "# contigs": 20, "GC (%)": "nan"}}
+		assert list(store.get_stage("quast", samples=["S2"])) == ["S2"]
+		assert store.get_table("quast", metrics=["N50", "missing"]) == [["Assembly", "N50", "missing"], ["S1", "100000", ""], ["S2", "80000", ""]]
+
+		store.put_records("quast", "Assembly", ["N50"], [("S2", ["90000"])], samples=["S2"])
+		assert store.get_stage("quast")["S2"] == {"N50": 90000}
+		assert store.get("S1", stage="quast")["N50"] == 100000
+		assert not store.has_stage("blobtools")
+
+
+def test_update_metrics_store(tmp_path):
+	report_dir = str(tmp_path)
+	table = tmp_path / "quast_report.tsv"
+	table.write_text(QUAST_REPORT)
+	(tmp_path / "assembly_stages.tsv").write_text("S1\tspades\nS2\tunicycler\n")
+	assert update_metrics_store(report_dir) == ["quast", "assembly_stages"]
+	with MetricsStore(get_metrics_store(report_dir)) as store:
+		assert store.get("S2", stage="assembly_stages") == {"Assembly stage": "unicycler"}
+
+	# changed tables are re-imported on the next sync
+	table.write_text("Assembly\tN50\nS3\t5000\n")
+	os.utime(str(table), (0, 0))
+	with MetricsStore(get_metrics_store(report_dir)) as store:
+		assert store.sync("quast", report_dir)
+		assert list(store.get_stage("quast")) == ["S3"]
+		assert store.sync("blobtools", report_dir) is False
+
+
+def test_values_are_rendered_as_imported(tmp_path):
+	table = tmp_path / "quast_report.tsv"
+	table.write_text("Assembly\tGC (%)\tID\nS1\t50.10\t00123\n")
+	with MetricsStore(str(tmp_path / "metrics.sqlite")) as store:
+		store.import_table("quast", str(table))
+		assert store.get("S1", stage="quast") == {"GC (%)": 50.1, "ID": 123}
+		assert store.get("S1", stage="quast", text=True) == {"GC (%)": "50.10", "ID": "00123"}
+		assert store.get_table("quast") == [["Assembly", "GC (%)", "ID"], ["S1", "50.10", "00123"]]
+
+
+def test_report_order_is_preserved(tmp_path):
+	table = tmp_path / "quast_report.tsv"
+	table.write_text("Assembly\tN50\nS3\t1\nS1\t2\nS2\t3\n")
+	with MetricsStore(str(tmp_path / "metrics.sqlite")) as store:
+		store.import_table("quast", str(table))
+		assert list(store.get_stage("quast")) == ["S3", "S1", "S2"]
+		assert list(store.get_stage("quast", samples=["S2", "S3"])) == ["S3", "S2"]
+		assert [row[0] for row in store.get_table("quast")[1:]] == ["S3", "S1", "S2"]
+
+		# replaced samples keep their row, new samples are appended
+		store.put_records("quast", "Assembly", ["N50"], [("S0", ["4"]), ("S1", ["5"])], samples=["S0", "S1"])
+		assert [row for row in store.get_table("quast")[1:]] == [["S3", "1"], ["S1", "5"], ["S2", "3"], ["S0", "4"]]
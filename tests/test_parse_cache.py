@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from bgrrl.parse_cache import build_parse_cache, load_parse_data, get_cache_key, get_ratt_references, CachedSamples, _read_cache_key
+
+
+@pytest.fixture
+def asm_config(tmp_path):
+	sheet = tmp_path / "samplesheet.asm.csv"
+	sheet.write_text("\n".join(",".join([s, s] + ["r.fastq.gz"] * 2 + [""] * 12) for s in ("S1", "S2")) + "\n")
+	ref_dir = tmp_path / "ratt_ref"
+	(ref_dir / "refA").mkdir(parents=True)
+	(ref_dir / "refA" / "refA.chr1.embl").write_text("ID x\n")
+	return {
+		"module": "bgasm",
+		"samplesheet": str(sheet),
+		"out_dir": str(tmp_path / "Analysis"),
+		"run_prokka": False,
+		"run_ratt": True,
+		"ratt_reference": str(ref_dir),
+		"parse_cache": str(tmp_path / "bgasm.parse_cache.sqlite")
+	}
+
+
+def test_ratt_references(asm_config):
+	assert get_ratt_references(asm_config["ratt_reference"]) == {"refA": ["chr1"]}
+
+
+def test_cache_is_built_once_and_loaded(asm_config):
+	assert build_parse_cache(asm_config, asm_config["parse_cache"])
+	assert not build_parse_cache(asm_config, asm_config["parse_cache"])
+	samplesheet, targets, ref_prefixes = load_parse_data(asm_config)
+	assert isinstance(samplesheet, CachedSamples)
+	assert list(samplesheet) == ["S1", "S2"]
+	assert ref_prefixes == {"refA": ["chr1"]}
+	assert any(t.endswith("S1_refA.final.gff") for t in targets)
+	assert any(t.endswith("S2.assembly.fasta") for t in targets)
+
+
+def test_new_reference_files_invalidate_the_cache(asm_config):
+	build_parse_cache(asm_config, asm_config["parse_cache"])
+	ref_dir = asm_config["ratt_reference"]
+	top_mtime = os.stat(ref_dir).st_mtime
+	with open(os.path.join(ref_dir, "refA", "refA.chr2.embl"), "w") as embl_out:
+		embl_out.write("ID y\n")
+	# only the subdirectory changed
+	assert os.stat(ref_dir).st_mtime == top_mtime
+	assert _read_cache_key(asm_config["parse_cache"]) != get_cache_key(asm_config)
+	_, _, ref_prefixes = load_parse_data(asm_config)
+	assert sorted(ref_prefixes["refA"]) == ["chr1", "chr2"]
+	assert build_parse_cache(asm_config, asm_config["parse_cache"])
+
+
+def test_changed_samplesheet_invalidates_the_cache(asm_config):
+	build_parse_cache(asm_config, asm_config["parse_cache"])
+	with open(asm_config["samplesheet"], "a") as sheet_out:
+		sheet_out.write(",".join(["S3", "S3"] + ["r.fastq.gz"] * 2 + [""] * 12) + "\n")
+	os.utime(asm_config["samplesheet"], (0, 0))
+	samplesheet, _, _ = load_parse_data(asm_config)
+	assert list(samplesheet) == ["S1", "S2", "S3"]
+
+
+def test_jobs_load_samples_on_demand(asm_config):
+	build_parse_cache(asm_config, asm_config["parse_cache"])
+	samples, targets, ref_prefixes = load_parse_data(asm_config, targets=False)
+	assert targets == []
+	assert ref_prefixes == {"refA": ["chr1"]}
+	assert not samples._samples
+	assert samples["S2"].sampleID == "S2" and samples["S2"].R1 == "r.fastq.gz"
+	assert list(samples._samples) == ["S2"]
+	assert len(samples) == 2 and "S1" in samples and "S3" not in samples
+	with pytest.raises(KeyError):
+		samples["S3"]
+
+
+def test_invalid_cache_is_recomputed(asm_config):
+	with open(asm_config["parse_cache"], "w") as cache_out:
+		cache_out.write("not a cache")
+	samples, targets, _ = load_parse_data(asm_config)
+	assert list(samples) == ["S1", "S2"] and targets
+	assert build_parse_cache(asm_config, asm_config["parse_cache"])
+	assert isinstance(load_parse_data(asm_config)[0], CachedSamples)
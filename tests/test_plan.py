@@ -0,0 +1,48 @@
+import io
+import json
+
+import pytest
+
+pytest.importorskip("snakemake")
+
+from bgrrl.plan import load_rule_runtimes, parse_time, PlanCollector, write_plan
+
+
+def _job(jobid, rule, inputs, outputs, threads=1, mem_mb=1000, sample="S1"):
+	return {
+		"level": "job_info", "jobid": jobid, "name": rule, "threads": threads,
+		"resources": {"mem_mb": mem_mb}, "input": inputs, "output": outputs, "wildcards": {"sample": sample}
+	}
+
+
+def test_load_rule_runtimes(tmp_path):
+	for i, runtime in enumerate((10, 30)):
+		(tmp_path / "run{}.stats".format(i)).write_text(json.dumps({"rules": {"qc_bbduk": {"mean-runtime": runtime}}}))
+	(tmp_path / "broken.stats").write_text("{")
+	assert load_rule_runtimes(sorted(str(f) for f in tmp_path.iterdir())) == {"qc_bbduk": 20}
+	assert parse_time("1:00:30") == 3630
+
+
+def test_plan_collector(tmp_path):
+	reads = tmp_path / "S1_R1.fastq.gz"
+	reads.write_bytes(b"x" * 1000)
+	jobs_out = io.StringIO()
+	collector = PlanCollector(jobs_out)
+	collector({"level": "info", "msg": "Building DAG of jobs..."})
+	collector(_job(1, "qc_bbduk", [str(reads)], ["bbduk/S1_R1.fastq.gz", "bbduk/S1_R2.fastq.gz"], threads=8, mem_mb=4000))
+	collector(_job(2, "qc_bbnorm", ["bbduk/S1_R1.fastq.gz", "bbduk/S1_R2.fastq.gz"], ["bbnorm/S1_R1.fastq.gz"], threads=4))
+	collector(_job(3, "qc_fastqc", [str(reads)], ["fastqc/S1_R1_fastqc.html"]))
+
+	assert [line.split("\t")[:2] for line in jobs_out.getvalue().splitlines()[1:]] == [["1", "qc_bbduk"], ["2", "qc_bbnorm"], ["3", "qc_fastqc"]]
+	assert collector.jobs[1] == ("qc_bbnorm", 4, 1000, (0,))
+
+	path, length = collector.estimate({"qc_bbduk": 3600}, {"qc_bbnorm": 1800, "qc_fastqc": 60}, lambda rule_plan: 2)
+	assert path == [("qc_bbduk", 1), ("qc_bbnorm", 1)]
+	assert length == 5400
+	assert collector.rules["qc_bbduk"].runtime_src == "stats"
+	assert collector.rules["qc_bbduk"].core_hours == 8
+	assert collector.rules["qc_bbnorm"].runtime_src == "hpc_config"
+
+	plan_out = io.StringIO()
+	write_plan(collector, path, length, plan_out)
+	assert "#Critical path [h]: 1.50" in plan_out.getvalue()
@@ -0,0 +1,116 @@
+import json
+import os
+
+import pytest
+
+from bgrrl.bin import qc_eval
+from bgrrl.bin.qc_eval import getNormalizationPolicy, writeNormalizationPolicy, readNormalizationPolicy, writeVerdict, getVerdictFile, EvaluationCache
+
+
+def _write_read_stats(path, bases):
+	with open(str(path), "wt") as _out:
+		json.dump({"R1": {"reads": 1, "bases": bases // 2}, "R2": {"reads": 1, "bases": bases - bases // 2}}, _out)
+	return str(path)
+
+
+@pytest.mark.parametrize("bases,mode,sample_rate", [
+	(50000, "passthrough", 1),
+	# up to the target coverage (100x), bbnorm would not reduce the reads
+	(100000, "passthrough", 1),
+	(100001, "bbnorm", 1),
+	(999999, "bbnorm", 1),
+	# from max_excess (10) times the target coverage, reads are subsampled to the target coverage
+	(1000000, "subsample", 0.1),
+	(4000000, "subsample", 0.025),
+])
+def test_getNormalizationPolicy_thresholds(bases, mode, sample_rate):
+	policy = getNormalizationPolicy({"R1": {"bases": bases // 2}, "R2": {"bases": bases - bases // 2}}, 1000, target_coverage=100)
+	assert policy["mode"] == mode
+	assert policy["coverage"] == pytest.approx(bases / 1000)
+	assert policy["sample_rate"] == pytest.approx(sample_rate)
+
+
+def test_getNormalizationPolicy_without_genome_size():
+	assert getNormalizationPolicy({"R1": {"bases": 10**9}, "R2": {"bases": 10**9}}, 0)["mode"] == "passthrough"
+
+
+@pytest.mark.parametrize("bases,mode", [(80000, "passthrough"), (500000, "bbnorm"), (2000000, "subsample")])
+def test_writeNormalizationPolicy(tmp_path, bases, mode):
+	stats = _write_read_stats(tmp_path / "S1.read_stats.json", bases)
+	policy_file = str(tmp_path / "S1.normalization.json")
+	policy = writeNormalizationPolicy("S1", stats, policy_file, 1000, target_coverage=100)
+	assert policy["mode"] == mode
+	assert (policy["sample"], policy["genome_size"]) == ("S1", 1000)
+	assert readNormalizationPolicy(policy_file) == policy
+
+
+def test_writeNormalizationPolicy_missing_stats(tmp_path):
+	with pytest.raises(ValueError):
+		writeNormalizationPolicy("S1", str(tmp_path / "missing.json"), str(tmp_path / "S1.normalization.json"), 1000)
+	assert not (tmp_path / "S1.normalization.json").exists()
+
+
+def test_readNormalizationPolicy_undecided(tmp_path):
+	assert readNormalizationPolicy(str(tmp_path / "missing.json")) is None
+	(tmp_path / "broken.json").write_text("{")
+	assert readNormalizationPolicy(str(tmp_path / "broken.json")) is None
+	(tmp_path / "unknown.json").write_text(json.dumps({"mode": "digital"}))
+	assert readNormalizationPolicy(str(tmp_path / "unknown.json")) is None
+
+
+def _write_verdicts(indir, samples):
+	for sample in samples:
+		verdict_file = getVerdictFile(os.path.join(indir, "qc"), sample)
+		os.makedirs(os.path.dirname(verdict_file), exist_ok=True)
+		writeVerdict(sample, indir, verdict_file)
+
+
+def test_evaluation_cache_keeps_sample_order(tmp_path, monkeypatch):
+	monkeypatch.setattr(qc_eval, "EVAL_BATCH_SIZE", 3)
+	samples = ["S{}".format(i) for i in range(20, 0, -1)]
+	_write_verdicts(str(tmp_path), samples[::2])
+	cache = EvaluationCache(str(tmp_path / "qc_eval.cache.json"), threads=4)
+	evaluation = cache.evaluate(samples, str(tmp_path))
+	assert [row[0] for _, row, _ in evaluation] == samples
+	assert cache.n_evaluated == len(samples)
+
+
+def test_evaluation_cache_invalidation(tmp_path):
+	indir, cache_file = str(tmp_path), str(tmp_path / "qc_eval.cache.json")
+	samples = ["S1", "S2", "S3"]
+	_write_verdicts(indir, samples)
+	cache = EvaluationCache(cache_file)
+	first = cache.evaluate(samples, indir)
+	assert cache.n_evaluated == 3
+	cache.save()
+
+	cache = EvaluationCache(cache_file)
+	assert cache.evaluate(samples, indir) == first
+	assert cache.n_evaluated == 0
+
+	# a new input file (e.g. survey contigs) only invalidates its sample
+	contigs = tmp_path / "qc" / "tadpole" / "S2" / "S2_tadpole_contigs.fasta"
+	contigs.parent.mkdir(parents=True)
+	contigs.write_text(">c1\nACGT\n")
+	assert cache.evaluate(samples, indir) == first
+	assert cache.n_evaluated == 1
+	cache.save()
+
+	# a replaced verdict is picked up
+	verdict_file = getVerdictFile(os.path.join(indir, "qc"), "S3")
+	with open(verdict_file) as verdict_in:
+		verdict = json.load(verdict_in)
+	verdict["passed"], verdict["row"] = True, ["S3", "PASS"]
+	with open(verdict_file + ".new", "wt") as verdict_out:
+		json.dump(verdict, verdict_out)
+	os.replace(verdict_file + ".new", verdict_file)
+	cache = EvaluationCache(cache_file)
+	evaluation = cache.evaluate(samples, indir)
+	assert cache.n_evaluated == 1
+	assert evaluation[2][:2] == (True, ["S3", "PASS"])
+	assert evaluation[:2] == first[:2]
+
+	# other settings invalidate all samples
+	cache = EvaluationCache(cache_file, min_tadpole_size=1e5)
+	cache.evaluate(samples, indir)
+	assert cache.n_evaluated == 3
@@ -0,0 +1,78 @@
+import gzip
+import json
+import subprocess
+import sys
+
+import pytest
+
+from bgrrl.bin.read_stats import readFastq, getPairName, computeReadStats, readReadStats, getSampleRate
+
+
+def _write_fastq(path, records):
+	with gzip.open(str(path), "wt") as _out:
+		for name, seq in records:
+			print("@" + name, seq, "+", "I" * len(seq), sep="\n", file=_out)
+	return str(path)
+
+
+def _run(*args):
+	return subprocess.run(
+		[sys.executable, "-c", "import sys; from bgrrl.bin.read_stats import main; sys.exit(main())"] + list(args),
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE
+	)
+
+
+@pytest.fixture
+def read_pair(tmp_path):
+	r1 = _write_fastq(tmp_path / "S1_R1.fastq.gz", [("r1/1 1:N", "ACGTAC"), ("r2/1", "GGGG")])
+	r2 = _write_fastq(tmp_path / "S1_R2.fastq.gz", [("r1/2 2:N", "ACGT"), ("r2/2", "GGCCAA")])
+	return r1, r2
+
+
+def test_readFastq(read_pair):
+	with gzip.open(read_pair[0], "rb") as _in:
+		assert list(readFastq(_in)) == [(b"r1/1", 6, 6 * 40, 3), (b"r2/1", 4, 4 * 40, 4)]
+	assert getPairName(b"r1/1") == getPairName(b"r1/2") == b"r1"
+	assert getPairName(b"r1") == b"r1"
+
+
+def test_computeReadStats(tmp_path, read_pair):
+	stats = computeReadStats(*read_pair)
+	assert stats["R1"]["reads"] == stats["R2"]["reads"] == 2
+	assert stats["R1"]["bases"] == 10 and stats["R1"]["gc_bases"] == 7
+	assert (stats["R2"]["min_length"], stats["R2"]["max_length"], stats["R2"]["mean_length"]) == (4, 6, 5)
+	assert stats["R1"]["mean_quality"] == 40
+	assert stats["R1"]["length_distribution"] == {"4": 1, "6": 1}
+	assert stats["pairs"] == {"consistent": True, "unpaired": 0, "name_mismatches": 0}
+
+	r2 = _write_fastq(tmp_path / "S2_R2.fastq.gz", [("r3/2", "ACGT")])
+	assert computeReadStats(read_pair[0], r2)["pairs"] == {"consistent": False, "unpaired": 1, "name_mismatches": 1}
+
+
+def test_main(tmp_path, read_pair):
+	out = str(tmp_path / "S1.read_stats.json")
+	proc = _run("-o", out, *read_pair)
+	assert proc.returncode == 0
+	assert readReadStats(out) == json.loads(json.dumps(computeReadStats(*read_pair)))
+	assert readReadStats(str(tmp_path / "missing.json")) is None
+	assert _run(str(tmp_path / "missing_R1.fastq.gz"), read_pair[1]).returncode != 0
+
+
+def test_getSampleRate():
+	read_stats = {"R1": {"bases": 250000000}, "R2": {"bases": 250000000}}
+	assert getSampleRate(read_stats, 40, 5e6) == 0.4
+	assert getSampleRate(read_stats, 60, 5e6) == 1
+	assert getSampleRate(read_stats, 0, 5e6) == 1
+	assert getSampleRate(read_stats, 40, 0) == 1
+
+
+def test_sample_rate(tmp_path):
+	stats = tmp_path / "S1.read_stats.json"
+	stats.write_text(json.dumps({"R1": {"bases": 250000000}, "R2": {"bases": 250000000}}))
+	proc = _run("--sample-rate", str(stats), "--target-coverage", "40", "--genome-size", "5000000")
+	assert proc.returncode == 0
+	assert proc.stdout.decode().strip() == "0.400000"
+	proc = _run("--sample-rate", str(stats), "--target-coverage", "60")
+	assert proc.returncode == 0
+	assert proc.stdout.decode().strip() == "1"
+	assert _run("--sample-rate", str(tmp_path / "missing.json")).returncode != 0
@@ -0,0 +1,78 @@
+import json
+import subprocess
+import sys
+
+from bgrrl.bin.resource_profile import parseTime, formatTime, parseTimeLog, collectMeasurements, fitLinear, profileRule, parsePartitions, main
+
+
+TIME_LOG = """\
+	Command being timed: "bbduk.sh"
+	Elapsed (wall clock) time (h:mm:ss or m:ss): {time}
+	Maximum resident set size (kbytes): {rss}
+"""
+
+
+def _make_run(run_dir, n=5):
+	for i in range(1, n + 1):
+		sample_dir = run_dir / "qc" / "bbduk" / "S{}".format(i)
+		sample_dir.mkdir(parents=True)
+		(sample_dir / "S{}_R1.bbduk.fastq.gz".format(i)).write_bytes(b"x" * (1000 * i))
+		(sample_dir / "S{}.qc_bbduk.log".format(i)).write_text(TIME_LOG.format(time="{}:00".format(10 * i), rss=1024 * 1000 * i))
+	return str(run_dir)
+
+
+def _run(*args):
+	return subprocess.run(
+		[sys.executable, "-c", "import sys; from bgrrl.bin.resource_profile import main; sys.exit(main())"] + list(args),
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE
+	)
+
+
+def test_time_parsing():
+	assert parseTime("1:02:03") == 3723
+	assert parseTime("2:03.5") == 123.5
+	assert formatTime(3723.2) == "1:02:04"
+
+
+def test_parseTimeLog(tmp_path):
+	log = tmp_path / "S1.qc_bbduk.log"
+	log.write_text(TIME_LOG.format(time="1:00", rss=2048) + TIME_LOG.format(time="0:30", rss=1024))
+	assert parseTimeLog(str(log)) == (2, 90)
+	log.write_text("no time output\n")
+	assert parseTimeLog(str(log)) is None
+
+
+def test_collectMeasurements(tmp_path):
+	run_dir = _make_run(tmp_path / "run")
+	measurements = sorted(collectMeasurements(run_dir), key=lambda m:m.sample)
+	assert [(m.rule, m.sample, m.input_size) for m in measurements] == [("qc_bbduk", "S{}".format(i), 1000 * i) for i in range(1, 6)]
+	assert measurements[1].max_rss_mb == 2000 and measurements[1].wall_time_s == 1200
+
+
+def test_fit_and_profile(tmp_path):
+	assert fitLinear([1, 2, 3], [3, 5, 7]) == (1, 2)
+	assert fitLinear([1, 2, 3], [7, 5, 3]) == (5, 0)
+	assert fitLinear([2, 2], [1, 3]) == (2, 0)
+
+	measurements = list(collectMeasurements(_make_run(tmp_path / "run")))
+	partitions = parsePartitions("short=2:00:00,long=24:00:00")
+	profile = profileRule("qc_bbduk", measurements, partitions)
+	assert profile.n == 5
+	assert profile.memory_mb == 7000
+	assert profile.time_s == 4200 and profile.partition == "short"
+	profile = profileRule("qc_bbduk", measurements, partitions, target_size=10000)
+	assert profile.time_s == 7800 and profile.partition == "long"
+
+
+def test_main(tmp_path):
+	run_dir = _make_run(tmp_path / "run")
+	hpc_config = tmp_path / "hpc_config.json"
+	hpc_config.write_text(json.dumps({"__default__": {"memory": "8000"}}))
+	tuned = tmp_path / "hpc_config.tuned.json"
+	proc = _run(run_dir, "--hpc-config", str(hpc_config), "-o", str(tuned), "--partitions", "short=2:00:00")
+	assert proc.returncode == 0
+	config = json.load(open(str(tuned)))
+	assert config["__default__"] == {"memory": "8000"}
+	assert config["qc_bbduk"] == {"memory": "7000", "time": "1:10:00", "partition": "short"}
+
+	assert _run(run_dir, "--hpc-config", str(hpc_config), "-o", str(tuned), "--min-jobs", "6").returncode == 1
@@ -0,0 +1,71 @@
+import io
+import pickle
+
+import pytest
+
+from bgrrl.samplesheet import Samplesheet, BaseSample, ASM_Sample, ASM_SAMPLE_FIELDS, RAW_SAMPLE_FIELDS
+
+
+def make_row(sample, r1="r1.fastq.gz", r2="r2.fastq.gz"):
+	return ",".join([sample, sample, r1, r2, "", "590", "Salmonella", "", "", ""])
+
+
+@pytest.fixture
+def sheet_file(tmp_path):
+	sheet = tmp_path / "samplesheet.csv"
+	sheet.write_text("\n".join(make_row(s) for s in ("S1", "S2", "S3")) + "\n")
+	return str(sheet)
+
+
+def test_samplesheet_order_and_lazy_parsing(sheet_file):
+	sheet = Samplesheet(sheet_file)
+	assert list(sheet) == ["S1", "S2", "S3"]
+	assert len(sheet) == 3 and "S2" in sheet and "S4" not in sheet
+	assert sheet["S2"].R1 == "r1.fastq.gz"
+	assert sheet["S2"].taxonomyTxt == "Salmonella"
+
+
+def test_samplesheet_duplicates_last_row_wins(tmp_path):
+	sheet_file = tmp_path / "samplesheet.csv"
+	sheet_file.write_text("\n".join([make_row("S1"), make_row("S2"), make_row("S1", r1="new.fastq.gz")]) + "\n")
+	sheet = Samplesheet(str(sheet_file))
+	assert list(sheet) == ["S1", "S2"]
+	assert sheet["S1"].R1 == "new.fastq.gz"
+
+
+def test_samplesheet_write_filter_and_upgrade(sheet_file):
+	sheet = Samplesheet(sheet_file)
+	sheet["S1"].upgrade(ASM_SAMPLE_FIELDS, ["t1", "t2", "", "n1", "n2", ""])
+	out = io.StringIO()
+	sheet.write(out, {"S1", "S3"})
+	rows = out.getvalue().splitlines()
+	assert rows[0] == make_row("S1") + ",t1,t2,,n1,n2,"
+	assert rows[1] == make_row("S3")
+
+
+def test_quoted_rows(tmp_path):
+	sheet_file = tmp_path / "samplesheet.csv"
+	sheet_file.write_text('"S1","S1","a,b.fastq.gz","r2","","","","","",""\n')
+	assert Samplesheet(str(sheet_file))["S1"].R1 == "a,b.fastq.gz"
+
+
+def test_sample_fields_and_pickle():
+	sample = ASM_Sample(*(["x"] * (len(RAW_SAMPLE_FIELDS) + len(ASM_SAMPLE_FIELDS))))
+	sample.R1norm = "norm.fastq.gz"
+	restored = pickle.loads(pickle.dumps(sample))
+	assert restored.R1norm == "norm.fastq.gz" and list(restored) == list(sample)
+	with pytest.raises(AttributeError):
+		sample.unknown_field
+	with pytest.raises(ValueError):
+		BaseSample("too", "few")
+
+
+def test_verify_sample_data(tmp_path):
+	r1, r2 = tmp_path / "r1.fastq.gz", tmp_path / "r2.fastq.gz"
+	r1.write_bytes(b"x")
+	sheet_file = tmp_path / "samplesheet.csv"
+	sheet_file.write_text(make_row("S1", r1=str(r1), r2=str(r2)) + "\n")
+	with pytest.raises(ValueError, match="Cannot find 1 dataset"):
+		Samplesheet(str(sheet_file)).verifySampleData(fields=["R1", "R2"])
+	r2.write_bytes(b"x")
+	assert Samplesheet(str(sheet_file)).verifySampleData(fields=["R1", "R2"])
@@ -0,0 +1,35 @@
+import os
+
+from bgrrl.sharding import split_samplesheet, run_sharded, merge_tables
+
+
+def test_split_samplesheet(tmp_path):
+	sheet = tmp_path / "samplesheet.csv"
+	sheet.write_text("".join("S{},x\n".format(i) for i in range(7)))
+	shards = split_samplesheet(str(sheet), 3, str(tmp_path / "shards"))
+	assert [os.path.basename(shard_dir) for shard_dir, _ in shards] == ["shard_1", "shard_2", "shard_3"]
+	rows = [open(shard_sheet).read().splitlines() for _, shard_sheet in shards]
+	assert [len(r) for r in rows] == [3, 2, 2]
+	assert sum(rows, []) == ["S{},x".format(i) for i in range(7)]
+
+
+def test_split_samplesheet_keeps_unchanged_shards(tmp_path):
+	sheet = tmp_path / "samplesheet.csv"
+	sheet.write_text("S1,x\nS2,x\n")
+	shards = split_samplesheet(str(sheet), 5, str(tmp_path / "shards"))
+	assert len(shards) == 2
+	os.utime(shards[0][1], (0, 0))
+	split_samplesheet(str(sheet), 5, str(tmp_path / "shards"))
+	assert os.stat(shards[0][1]).st_mtime == 0
+
+
+def test_run_sharded():
+	assert run_sharded(max, [(1, 2), (4, 3), (5, 6)]) == [2, 4, 6]
+
+
+def test_merge_tables(tmp_path):
+	tables = [tmp_path / "t1.tsv", tmp_path / "t2.tsv", tmp_path / "missing.tsv"]
+	tables[0].write_text("h1\nh2\nS1\n")
+	tables[1].write_text("h1\nh2\nS2\nS3\n")
+	merged = merge_tables([str(t) for t in tables], str(tmp_path / "out" / "merged.tsv"), header_lines=2)
+	assert open(merged).read() == "h1\nh2\nS1\nS2\nS3\n"
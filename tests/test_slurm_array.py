@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+
+from bgrrl.bin import slurm_array
+from bgrrl.bin.slurm_array import getResourceClass, submitJob, getJobStatus, ArrayDispatcher
+
+
+def _fake_command(bin_dir, name, script):
+	cmd = bin_dir / name
+	cmd.write_text("#!/bin/sh\n" + script)
+	cmd.chmod(0o755)
+	return str(cmd)
+
+
+def test_getResourceClass():
+	assert getResourceClass(["-c", "4", "--mem=8000"]) == getResourceClass(["-c", "4", "--mem=8000"])
+	assert getResourceClass(["-c", "4", "--mem=8000"]) != getResourceClass(["-c", "4", "--mem=16000"])
+
+
+def test_submit_and_dispatch(tmp_path, monkeypatch):
+	bin_dir = tmp_path / "bin"
+	bin_dir.mkdir()
+	_fake_command(bin_dir, "sbatch", 'echo "$@" >> "{}"\necho "4711;cluster"\n'.format(tmp_path / "sbatch.args"))
+	_fake_command(bin_dir, "sacct", 'printf "4711_0|COMPLETED\\n4711_1|FAILED\\n4711_2|RUNNING\\n"\n')
+	monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+
+	spool_dir = str(tmp_path / "spool")
+	dispatcher = ArrayDispatcher(spool_dir, array_size=3, wait=3600)
+	options = ["-c", "4", "--mem=8000"]
+	job_ids = [submitJob(spool_dir, options, "job{}.sh".format(i)) for i in range(4)]
+	other_job = submitJob(spool_dir, ["-c", "1"], "other.sh")
+	assert all(job_id.startswith(getResourceClass(options) + ".") for job_id in job_ids)
+	assert getJobStatus(spool_dir, job_ids[0]) == "running"
+
+	# only full arrays are submitted before their oldest job has waited long enough
+	for job_id, mtime in zip(job_ids, range(4)):
+		os.utime(os.path.join(spool_dir, getResourceClass(options), "queue", job_id), (mtime, mtime))
+	dispatcher.wait = 10 ** 10
+	dispatcher.dispatch()
+	submissions = (tmp_path / "sbatch.args").read_text().splitlines()
+	assert len(submissions) == 1 and submissions[0].startswith("--parsable --array=0-2 -c 4 --mem=8000")
+	assert [getJobStatus(spool_dir, job_id) for job_id in job_ids[:3]] == ["success", "failed", "running"]
+	assert getJobStatus(spool_dir, job_ids[3]) == "running"
+	assert getJobStatus(spool_dir, other_job) == "running"
+
+	manifest = submissions[0].split()[-1]
+	assert open(manifest).read().splitlines() == [os.path.abspath("job{}.sh".format(i)) for i in range(3)]
+
+	dispatcher.wait = 0
+	dispatcher.dispatch()
+	assert not os.listdir(os.path.join(spool_dir, getResourceClass(options), "queue"))
+	submissions = (tmp_path / "sbatch.args").read_text().splitlines()[1:]
+	assert sorted(" ".join(line.split()[:4]) for line in submissions) == ["--parsable --array=0-0 -c 1", "--parsable --array=0-0 -c 4"]
+
+
+def test_failed_submission(tmp_path, monkeypatch):
+	bin_dir = tmp_path / "bin"
+	bin_dir.mkdir()
+	_fake_command(bin_dir, "sbatch", "exit 1\n")
+	monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+	spool_dir = str(tmp_path / "spool")
+	job_id = submitJob(spool_dir, ["-c", "1"], "job.sh")
+	ArrayDispatcher(spool_dir, wait=0).dispatch()
+	assert getJobStatus(spool_dir, job_id) == "failed"
+	assert getJobStatus(spool_dir, getResourceClass(["-c", "1"]) + ".unknown") == "failed"
+
+
+def test_main_exit_status(tmp_path):
+	# snakemake runs the script by path (SlurmArrayExecutor.SCRIPT)
+	call = [sys.executable, slurm_array.__file__]
+	proc = subprocess.run(call + ["submit", str(tmp_path), "-c", "1", "job.sh"], stdout=subprocess.PIPE)
+	assert proc.returncode == 0
+	assert proc.stdout.decode().startswith(getResourceClass(["-c", "1"]) + ".")
+	assert subprocess.run(call, stdout=subprocess.PIPE).returncode == 1
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+pytest.importorskip("snakemake")
+
+from bgrrl.snakemake_helper import ExecutionEnvironment, ClusterExecutor, CompressionPolicy
+
+
+def test_cluster_executor_removes_status_dir(tmp_path):
+	exe_env = ExecutionEnvironment(log_dir=str(tmp_path / "hpc_logs"))
+	exe_env.scheduler, exe_env.sub_cmd = "SLURM", "sbatch"
+	with ClusterExecutor(exe_env) as executor:
+		assert os.path.isdir(executor.status_dir)
+		assert executor.status_dir in executor.get_snakemake_args()["cluster_status"]
+	assert not os.path.exists(executor.status_dir)
+	assert os.listdir(str(tmp_path / "hpc_logs")) == []
+
+
+def test_compression_policy_bbtools_args():
+	policy = CompressionPolicy({"compression": {
+		"__default__": {"level": 2, "method": "pigz"},
+		"qc_bbnorm": {"method": "bgzip", "threads": 4},
+		"fin_package_processed_reads": {"level": 9, "method": "gzip"}
+	}})
+	assert policy.bbtools_args("qc_bbduk") == "zl=2 pigz=t unpigz=t"
+	assert policy.bbtools_args("qc_bbnorm") == "zl=2 bgzip=t unbgzip=t zipthreads=4"
+	assert policy.bbtools_args("fin_package_processed_reads") == "zl=9 pigz=f unpigz=f"
+	assert CompressionPolicy(dict()).bbtools_args("qc_bbduk") == ""
+
+
+def test_compression_policy_commands():
+	policy = CompressionPolicy({"compression": {"__default__": {"method": "pigz"}, "qc_bbnorm": {"method": "gzip", "level": 1}}})
+	assert policy.compress_cmd("qc_bbduk") == "pigz -p {threads} -6 -c"
+	assert policy.decompress_cmd("qc_bbduk") == "pigz -p {threads} -dc"
+	assert policy.compress_cmd("qc_bbnorm") == "gzip -1 -c"
+	assert policy.decompress_cmd("qc_bbnorm") == "gzip -dc"
+
+
+def test_compression_policy_needs_recompression():
+	policy = CompressionPolicy({"compression": {"qc_bbduk": {"level": 2}, "fin_package_processed_reads": {"level": 9}}})
+	assert policy.needs_recompression("fin_package_processed_reads", "qc_bbduk")
+	assert not policy.needs_recompression("qc_bbduk", "fin_package_processed_reads")
+	# without a level, the tools' defaults apply and nothing is recompressed
+	assert not policy.needs_recompression("qc_bbnorm", "qc_bbduk")
+	# source rules without a level may have been compressed at any level
+	assert policy.needs_recompression("fin_package_processed_reads", "qc_bbnorm")
+	assert not CompressionPolicy(dict()).needs_recompression("fin_package_processed_reads", "qc_bbduk")
+
+
+def test_compression_policy_rejects_invalid_config():
+	with pytest.raises(ValueError, match="CONFIG ERROR"):
+		CompressionPolicy({"compression": {"qc_bbduk": {"level": 10}}})
+	with pytest.raises(ValueError, match="CONFIG ERROR"):
+		CompressionPolicy({"compression": {"qc_bbduk": {"method": "xz"}}})
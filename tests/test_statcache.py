@@ -0,0 +1,54 @@
+import os
+
+from bgrrl.statcache import StatCache
+
+
+def test_verify_reports_missing_files(tmp_path):
+	present = tmp_path / "r1.fastq.gz"
+	present.write_bytes(b"reads")
+	missing = [str(tmp_path / "r2.fastq.gz"), str(tmp_path / "nodir" / "r1.fastq.gz")]
+	assert StatCache().verify([str(present)] + missing) == set(missing)
+
+
+def test_dangling_symlink_is_missing(tmp_path):
+	target = tmp_path / "target.fastq.gz"
+	target.write_bytes(b"reads")
+	link = tmp_path / "link.fastq.gz"
+	link.symlink_to(target)
+	cache = StatCache()
+	assert cache.verify([str(link)]) == set()
+	target.unlink()
+	assert cache.verify([str(link)]) == {str(link)}
+
+
+def test_cache_is_persisted_and_reused(tmp_path):
+	reads = tmp_path / "reads"
+	reads.mkdir()
+	r1 = reads / "r1.fastq.gz"
+	r1.write_bytes(b"reads")
+	cache_file = str(tmp_path / "stat_cache.json")
+	cache = StatCache(cache_file)
+	assert cache.verify([str(r1)]) == set()
+	cache.save()
+
+	reloaded = StatCache(cache_file)
+	assert reloaded.files[str(r1)][1] == 5
+	assert reloaded.dirs[str(reads)] == os.stat(str(reads)).st_mtime
+	# removing a file changes the directory listing
+	r1.unlink()
+	assert reloaded.verify([str(r1)]) == {str(r1)}
+	assert str(r1) not in reloaded.files
+
+
+def test_empty_placeholders_are_restated(tmp_path):
+	placeholder = tmp_path / "r1.fastq.gz"
+	placeholder.write_bytes(b"")
+	cache = StatCache()
+	cache.verify([str(placeholder)])
+	assert cache.files[str(placeholder)][1] == 0
+	dir_mtime = os.stat(str(tmp_path)).st_mtime
+	# filled in place: the directory mtime does not change
+	placeholder.write_bytes(b"reads")
+	assert os.stat(str(tmp_path)).st_mtime == dir_mtime
+	cache.verify([str(placeholder)])
+	assert cache.files[str(placeholder)][1] == 5